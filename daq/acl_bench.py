@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Benchmark of faucet ACL size and generation cost for the device mirroring modes"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import yaml
+
+import configurator
+import logger
+from topology import FaucetTopology
+
+LOGGER = logger.get_logger('aclbench')
+
+
+class AclBenchmark:
+    """Attach a group of devices to one port set, and measure the resulting ACLs per mode"""
+
+    _DEFAULT_GROUP_SIZES = '4,16,64'
+
+    def __init__(self, config):
+        self._config = config
+        sizes = str(config.get('group_sizes', self._DEFAULT_GROUP_SIZES))
+        self._group_sizes = [int(size) for size in sizes.split(',')]
+        self._modes = config.get('modes', ','.join(FaucetTopology.MIRROR_MODES)).split(',')
+
+    def run(self):
+        """Run the benchmark for all group sizes and modes, returning results by mode and size"""
+        results = {mode: {} for mode in self._modes}
+        cwd = os.getcwd()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.chdir(tmpdir)
+            for size in self._group_sizes:
+                for mode in self._modes:
+                    results[mode][size] = self._run_group(mode, size)
+                    LOGGER.info('Mode %s group %d: %s', mode, size, results[mode][size])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmpdir)
+        results['passed'] = self._check_limits(results)
+        return results
+
+    def _run_group(self, mode, size):
+        topology = FaucetTopology({'sec_port': str(size + 1), 'settle_sec': 0,
+                                   'mirror_mode': mode})
+        topology.initialize(types.SimpleNamespace(name='pri'))
+        start = time.monotonic()
+        for port in range(1, size + 1):
+            mac = '9a:02:57:1e:%02x:%02x' % (port >> 8, port & 0xff)
+            target = {'port': port, 'port_set': 1, 'mac': mac}
+            topology.direct_port_traffic(mac, port, target)
+            topology.update_acls()
+        generate_sec = time.monotonic() - start
+        acl_file = FaucetTopology.INST_FILE_PREFIX + FaucetTopology.DP_ACL_FILE_FORMAT
+        start = time.monotonic()
+        with open(acl_file) as acl_stream:
+            acls = yaml.safe_load(acl_stream)['acls']
+        parse_sec = time.monotonic() - start
+        return {
+            'incoming_rules': len(acls[FaucetTopology.INCOMING_ACL_FORMAT % 'pri']),
+            'total_rules': sum(len(rules) for rules in acls.values()),
+            'file_kb': os.path.getsize(acl_file) // 1024,
+            'attach_ms': round(generate_sec * 1000 / size, 3),
+            'parse_ms': round(parse_sec * 1000, 3)
+        }
+
+    def _check_limits(self, results):
+        max_rules = int(self._config.get('max_rules', 0))
+        passed = True
+        for mode in self._modes:
+            for size, result in results[mode].items():
+                if max_rules and result['total_rules'] > max_rules:
+                    LOGGER.error('Mode %s group %d has %d rules, above maximum %d',
+                                 mode, size, result['total_rules'], max_rules)
+                    passed = False
+        return passed
+
+
+if __name__ == '__main__':
+    logger.set_config(format='%(levelname)s:%(message)s', level='INFO')
+    CONFIG = configurator.Configurator().parse_args(sys.argv)
+    RESULTS = AclBenchmark(CONFIG).run()
+    print(json.dumps(RESULTS, indent=2, sort_keys=True))
+    sys.exit(0 if RESULTS['passed'] else 1)
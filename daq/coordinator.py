@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+"""Coordinator for sharding device ports across multiple DAQ worker processes"""
+
+import json
+import os
+import select
+import socket
+import sys
+import time
+
+import configurator
+import logger
+
+LOGGER = logger.get_logger('coord')
+
+
+def _parse_switch_port(value):
+    """Parse a [dpid, port] pair from a message, or None if it's malformed"""
+    if not isinstance(value, list) or len(value) != 2:
+        return None
+    if not all(isinstance(item, int) and not isinstance(item, bool) for item in value):
+        return None
+    return tuple(value)
+
+
+class _LineChannel:
+    """Newline-delimited json messages over a non-blocking stream socket"""
+
+    _READ_SIZE = 64 * 1024
+    _MAX_OUTBOUND = 1024 * 1024
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self._buffer = b''
+        self._outbound = b''
+
+    @property
+    def sending(self):
+        """True if there is buffered output waiting for the socket to be writable"""
+        return bool(self._outbound)
+
+    def send(self, message):
+        """Queue a message and send what the socket will take, returning False on failure"""
+        self._outbound += json.dumps(message).encode() + b'\n'
+        if len(self._outbound) > self._MAX_OUTBOUND:
+            LOGGER.warning('Channel send failed: %d bytes backed up', len(self._outbound))
+            return False
+        return self.flush()
+
+    def flush(self):
+        """Send any buffered output, returning False if the channel has failed"""
+        try:
+            while self._outbound:
+                sent = self.sock.send(self._outbound)
+                self._outbound = self._outbound[sent:]
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            LOGGER.warning('Channel send failed: %s', e)
+            return False
+        return True
+
+    def receive(self):
+        """Return a list of complete messages, or None if the channel is closed"""
+        try:
+            data = self.sock.recv(self._READ_SIZE)
+        except BlockingIOError:
+            return []
+        except OSError as e:
+            LOGGER.warning('Channel receive failed: %s', e)
+            return None
+        if not data:
+            return None
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        messages = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError as e:
+                LOGGER.warning('Dropping malformed message: %s', e)
+                continue
+            if not isinstance(message, dict):
+                LOGGER.warning('Dropping non-object message: %s', line[:80])
+                continue
+            messages.append(message)
+        return messages
+
+    def close(self):
+        """Close the underlying socket"""
+        self.sock.close()
+
+
+class _Worker:
+    """Coordinator view of a single registered worker, with ports as (dpid, port) pairs"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, channel, capacity):
+        self.name = name
+        self.channel = channel
+        self.capacity = capacity
+        self.ports = set()
+        self.active = set()
+        self.heartbeat = None
+        self.last_seen = time.time()
+
+
+class Coordinator:
+    """Assigns device ports to workers, and aggregates their results and heartbeats"""
+
+    _DEFAULT_SOCK = 'inst/coordinator.sock'
+    _DEFAULT_RESULT_LOG = 'inst/coordinator_result.log'
+    _DEFAULT_STATUS_FILE = 'inst/coordinator_status.json'
+    _WORKER_TIMEOUT_SEC = 30
+    _SERVICE_SEC = 1
+
+    def __init__(self, config):
+        self._sock_path = config.get('coordinator_sock', self._DEFAULT_SOCK)
+        self._worker_timeout = float(config.get('worker_timeout_sec', self._WORKER_TIMEOUT_SEC))
+        self._ports = self._parse_ports(config)
+        self._result_log_path = config.get('coordinator_result_log', self._DEFAULT_RESULT_LOG)
+        self._status_path = config.get('coordinator_status', self._DEFAULT_STATUS_FILE)
+        self._server = None
+        self._pending = {}
+        self._workers = {}
+        self._result_log = None
+
+    @staticmethod
+    def _parse_ports(config):
+        """Parse comma separated [dpid:]low[-high] ranges into sorted (dpid, port) pairs"""
+        default_dpid = int(config.get('ext_dpid', '2'), 0)
+        if 'coordinator_ports' not in config:
+            return [(default_dpid, port) for port in range(1, int(config.get('sec_port', '7'), 0))]
+        ports = set()
+        for entry in str(config['coordinator_ports']).split(','):
+            dpid, _, port_range = entry.strip().rpartition(':')
+            low, _, high = port_range.partition('-')
+            dpid = int(dpid, 0) if dpid else default_dpid
+            ports.update((dpid, port) for port in range(int(low), int(high or low) + 1))
+        return sorted(ports)
+
+    def start(self):
+        """Start listening for workers"""
+        if os.path.exists(self._sock_path):
+            os.remove(self._sock_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._sock_path)
+        self._server.listen()
+        self._server.setblocking(False)
+        self._result_log = open(self._result_log_path, 'a')
+        LOGGER.info('Coordinating ports %s on %s', self._ports, self._sock_path)
+
+    def stop(self):
+        """Stop the coordinator and drop all workers"""
+        for conn in list(self._pending):
+            conn.close()
+        for worker in self._workers.values():
+            worker.channel.close()
+        self._pending = {}
+        self._workers = {}
+        self._server.close()
+        os.remove(self._sock_path)
+        self._result_log.close()
+
+    def main_loop(self):
+        """Service workers until interrupted"""
+        LOGGER.info('Entering coordinator loop...')
+        while True:
+            self.service(self._SERVICE_SEC)
+
+    def service(self, timeout=0):
+        """Handle any pending connections and messages, waiting up to timeout seconds"""
+        channels = [self._server] + list(self._pending) + [
+            worker.channel.sock for worker in self._workers.values()]
+        sending = [worker.channel.sock for worker in self._workers.values()
+                   if worker.channel.sending]
+        readable, writable, _ = select.select(channels, sending, [], timeout)
+        for sock in writable:
+            self._flush_worker(sock)
+        for sock in readable:
+            if sock is self._server:
+                self._accept()
+            elif sock in self._pending:
+                self._service_pending(sock)
+            else:
+                self._service_worker(sock)
+        self._expire_workers()
+
+    def get_assignments(self):
+        """Return the current port assignment for each worker"""
+        return {name: sorted(worker.ports) for name, worker in self._workers.items()}
+
+    @staticmethod
+    def _port_list(ports):
+        return [list(port) for port in sorted(ports)]
+
+    def get_status(self):
+        """Return aggregated worker status"""
+        assigned = set().union(*[worker.ports for worker in self._workers.values()])
+        return {
+            'workers': {name: {
+                'ports': self._port_list(worker.ports),
+                'active': self._port_list(worker.active),
+                'heartbeat': worker.heartbeat,
+                'last_seen': worker.last_seen
+            } for name, worker in self._workers.items()},
+            'unassigned': self._port_list(port for port in self._ports if port not in assigned)
+        }
+
+    def _accept(self):
+        try:
+            conn, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        self._pending[conn] = _LineChannel(conn)
+
+    def _service_pending(self, sock):
+        channel = self._pending[sock]
+        messages = channel.receive()
+        if messages is None:
+            del self._pending[sock]
+            channel.close()
+            return
+        for index, message in enumerate(messages):
+            if message.get('type') == 'register' and message.get('worker'):
+                del self._pending[sock]
+                worker = self._register(channel, message)
+                for extra in messages[index + 1:]:
+                    self._handle_message(worker, extra)
+                return
+            LOGGER.warning('Ignoring %s message before register', message.get('type'))
+
+    def _register(self, channel, message):
+        name = str(message['worker'])
+        if name in self._workers:
+            LOGGER.warning('Worker %s re-registered, replacing', name)
+            self._drop_worker(self._workers[name], rebalance=False)
+        capacity = message.get('capacity') or 0
+        if not isinstance(capacity, int) or capacity < 0:
+            LOGGER.warning('Worker %s has invalid capacity %s, using unlimited', name, capacity)
+            capacity = 0
+        worker = _Worker(name, channel, capacity)
+        self._workers[name] = worker
+        LOGGER.info('Worker %s registered with capacity %s', name, capacity or 'unlimited')
+        self._rebalance()
+        return worker
+
+    def _find_worker(self, sock):
+        return next((worker for worker in self._workers.values()
+                     if worker.channel.sock is sock), None)
+
+    def _flush_worker(self, sock):
+        worker = self._find_worker(sock)
+        if worker and not worker.channel.flush():
+            self._drop_worker(worker)
+
+    def _service_worker(self, sock):
+        worker = self._find_worker(sock)
+        if not worker:
+            # Dropped while servicing another socket in the same batch.
+            return
+        messages = worker.channel.receive()
+        if messages is None:
+            LOGGER.warning('Worker %s disconnected', worker.name)
+            self._drop_worker(worker)
+            return
+        for message in messages:
+            self._handle_message(worker, message)
+
+    def _handle_message(self, worker, message):
+        worker.last_seen = time.time()
+        kind = message.get('type')
+        if kind == 'heartbeat':
+            active = message.get('active', [])
+            if isinstance(active, list):
+                active = [_parse_switch_port(port) for port in active]
+            if not isinstance(active, list) or None in active:
+                LOGGER.warning('Rejecting malformed heartbeat from %s: %s', worker.name, message)
+                return
+            worker.heartbeat = message.get('status')
+            worker.active = set(active)
+            self._write_status()
+        elif kind == 'result':
+            port = _parse_switch_port(message.get('port'))
+            if not port or 'result' not in message:
+                LOGGER.warning('Rejecting malformed result from %s: %s', worker.name, message)
+                return
+            self._result_log.write('%s %d:%02d: %s\n' % (worker.name, *port, message['result']))
+            self._result_log.flush()
+        else:
+            LOGGER.warning('Unknown message type %s from %s', kind, worker.name)
+
+    def _expire_workers(self):
+        if not self._worker_timeout:
+            return
+        deadline = time.time() - self._worker_timeout
+        for worker in list(self._workers.values()):
+            if worker.last_seen < deadline:
+                LOGGER.warning('Worker %s heartbeat timeout', worker.name)
+                self._drop_worker(worker)
+
+    def _drop_worker(self, worker, rebalance=True):
+        del self._workers[worker.name]
+        worker.channel.close()
+        if worker.ports:
+            LOGGER.info('Releasing ports %s from worker %s', sorted(worker.ports), worker.name)
+        if rebalance:
+            self._rebalance()
+
+    def _has_room(self, worker):
+        return not worker.capacity or len(worker.ports) < worker.capacity
+
+    def _rebalance(self):
+        previous = {name: set(worker.ports) for name, worker in self._workers.items()}
+        workers = sorted(self._workers.values(), key=lambda worker: worker.name)
+        assigned = set().union(*[worker.ports for worker in workers])
+        for port in self._ports:
+            if port in assigned:
+                continue
+            candidates = [worker for worker in workers if self._has_room(worker)]
+            if not candidates:
+                break
+            min(candidates, key=lambda worker: len(worker.ports)).ports.add(port)
+        # Even out the load, but only by moving ports that aren't testing a device.
+        while len(workers) > 1:
+            busiest = max(workers, key=lambda worker: len(worker.ports))
+            idlest = min((worker for worker in workers if self._has_room(worker)),
+                         key=lambda worker: len(worker.ports), default=None)
+            movable = sorted(busiest.ports - busiest.active)
+            if not idlest or len(busiest.ports) - len(idlest.ports) <= 1 or not movable:
+                break
+            busiest.ports.remove(movable[-1])
+            idlest.ports.add(movable[-1])
+        for worker in workers:
+            if worker.ports != previous.get(worker.name):
+                LOGGER.info('Assigning ports %s to worker %s', sorted(worker.ports), worker.name)
+                assignment = {'type': 'assign', 'ports': self._port_list(worker.ports)}
+                if not worker.channel.send(assignment):
+                    self._drop_worker(worker)
+                    return
+        self._write_status()
+
+    def _write_status(self):
+        tmp_path = self._status_path + '.tmp'
+        with open(tmp_path, 'w') as status_file:
+            json.dump(self.get_status(), status_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._status_path)
+
+
+class CoordinatorClient:
+    """Worker side connection to a coordinator, tracking the assigned (dpid, port) pairs"""
+
+    def __init__(self, config):
+        self._sock_path = config.get('coordinator_sock')
+        self._name = config.get('worker_name', '%s-%d' % (socket.gethostname(), os.getpid()))
+        self._capacity = int(config.get('worker_capacity', 0))
+        self._channel = None
+        self.ports = set()
+
+    @property
+    def sock(self):
+        """Socket connected to the coordinator"""
+        return self._channel.sock if self._channel else None
+
+    def connect(self):
+        """Connect and register with the coordinator"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._sock_path)
+        self._channel = _LineChannel(sock)
+        LOGGER.info('Registering worker %s with coordinator %s', self._name, self._sock_path)
+        self._send({'type': 'register', 'worker': self._name, 'capacity': self._capacity})
+
+    def disconnect(self):
+        """Disconnect from the coordinator"""
+        if self._channel:
+            self._channel.close()
+            self._channel = None
+
+    def owns_port(self, dpid, port):
+        """Check if the given switch port is assigned to this worker"""
+        return (dpid, port) in self.ports
+
+    def receive(self):
+        """Process pending coordinator messages, returning False if the connection is closed"""
+        if not self._channel.flush():
+            return False
+        messages = self._channel.receive()
+        if messages is None:
+            return False
+        for message in messages:
+            if message.get('type') == 'assign':
+                ports = [_parse_switch_port(port) for port in message.get('ports', [])]
+                self.ports = set(port for port in ports if port)
+                LOGGER.info('Worker %s assigned ports %s', self._name, sorted(self.ports))
+        return True
+
+    def send_heartbeat(self, active_ports, status=None):
+        """Report the (dpid, port) pairs with devices under test, and any other status"""
+        active = [list(port) for port in sorted(active_ports)]
+        self._send({'type': 'heartbeat', 'active': active, 'status': status})
+
+    def send_result(self, dpid, port, result):
+        """Report the result of a finished device"""
+        self._send({'type': 'result', 'port': [dpid, port], 'result': result})
+
+    def _send(self, message):
+        if self._channel:
+            self._channel.send(message)
+
+
+if __name__ == '__main__':
+    logger.set_config(format='%(asctime)s %(levelname)-8s %(message)s', level='INFO')
+    CONFIG = configurator.Configurator().parse_args(sys.argv)
+    COORDINATOR = Coordinator(CONFIG)
+    COORDINATOR.start()
+    try:
+        COORDINATOR.main_loop()
+    finally:
+        COORDINATOR.stop()
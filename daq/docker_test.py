@@ -25,20 +25,16 @@ class DockerTest:
         self.host_name = '%s%02d' % (test_name, self.target_port)
         self.docker_log = None
         self.docker_host = None
+        self.port = None
         self.callback = None
         self.start_time = None
         self.pipe = None
         self.env_vars = env_vars or []
         self._finish_hook = None
 
-    def start(self, port, params, callback, finish_hook):
-        """Start the docker test"""
-        LOGGER.debug('Target port %d starting docker test %s', self.target_port, self.test_name)
-
-        self.start_time = datetime.datetime.now()
-        self.callback = callback
-        self._finish_hook = finish_hook
-
+    def prepare(self, port, params):
+        """Create the test container and attach it to the network, ready to start"""
+        assert not self.docker_host, 'docker test %s already prepared' % self.host_name
         env_vars = self.env_vars + ["TARGET_NAME=" + self.host_name,
                                     "TARGET_IP=" + params['target_ip'],
                                     "TARGET_MAC=" + params['target_mac'],
@@ -58,18 +54,46 @@ class DockerTest:
         self._map_if_exists(vol_maps, params, 'type')
 
         image = self.IMAGE_NAME_FORMAT % self.test_name
-        LOGGER.debug("Target port %d running docker test %s", self.target_port, image)
+        LOGGER.debug("Target port %d preparing docker test %s", self.target_port, image)
         cls = docker_host.make_docker_host(image, prefix=self.CONTAINER_PREFIX)
         # Work around an instability in the faucet/clib/docker library, b/152520627.
         if getattr(cls, 'pullImage'):
             setattr(cls, 'pullImage', lambda x: True)
         try:
-            host = self.runner.add_host(self.host_name, port=port, cls=cls, env_vars=env_vars,
-                                        vol_maps=vol_maps, tmpdir=self.tmpdir)
-            self.docker_host = host
+            self.docker_host = self.runner.add_host(self.host_name, port=port, cls=cls,
+                                                    env_vars=env_vars, vol_maps=vol_maps,
+                                                    tmpdir=self.tmpdir)
+            self.port = port
         except Exception as e:
+            # The image may have gone since it was last indexed.
+            self.runner.image_manager.invalidate(image)
             # pylint: disable=no-member
             raise wrappers.DaqException(e)
+
+    def discard(self):
+        """Remove a prepared test container that was never started"""
+        assert not self.pipe, 'docker test %s already started' % self.host_name
+        if self.docker_host:
+            LOGGER.info('Target port %d discarding docker test %s',
+                        self.target_port, self.test_name)
+            self.runner.remove_host(self.docker_host)
+            self.docker_host.terminate()
+            self.docker_host = None
+
+    def start(self, port, params, callback, finish_hook):
+        """Start the docker test, using the prepared container if there is one"""
+        LOGGER.debug('Target port %d starting docker test %s', self.target_port, self.test_name)
+
+        self.start_time = datetime.datetime.now()
+        self.callback = callback
+        self._finish_hook = finish_hook
+
+        if self.docker_host:
+            assert port == self.port, 'prepared docker test %s port mismatch' % self.host_name
+        else:
+            self.prepare(port, params)
+        host = self.docker_host
+        image = self.IMAGE_NAME_FORMAT % self.test_name
         try:
             LOGGER.debug("Target port %d activating docker test %s", self.target_port, image)
             pipe = host.activate(log_name=None)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+"""Benchmark harness for the faucet event path, using synthetic or recorded event streams"""
+
+import json
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import configurator
+import logger
+from faucet_event_bus import coalesce_port_events
+from faucet_event_client import EventType, FaucetEventClient
+
+LOGGER = logger.get_logger('evbench')
+
+
+def learn_storm(count, ports, dpid):
+    """Generate a storm of learn events spread across ports"""
+    for index in range(count):
+        mac = '9a:02:57:%02x:%02x:%02x' % ((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+        yield {'dp_id': dpid, 'L2_LEARN': {'port_no': index % ports + 1, 'eth_src': mac}}
+
+
+def port_flaps(count, ports, dpid):
+    """Generate port changes that repeatedly take every port down and up"""
+    for index in range(count):
+        status = bool((index // ports) % 2)
+        yield {'dp_id': dpid,
+               'PORT_CHANGE': {'port_no': index % ports + 1, 'status': status, 'reason': 'MODIFY'}}
+
+
+def mixed(count, ports, dpid):
+    """Generate mostly learns, with a port flap every tenth event"""
+    learns = learn_storm(count, ports, dpid)
+    flaps = port_flaps(count, ports, dpid)
+    for index in range(count):
+        event = next(flaps if index % 10 == 0 else learns, None)
+        if not event:
+            return
+        yield event
+
+
+def replay(path):
+    """Replay a recorded stream of faucet events, one json object per line"""
+    with open(path) as event_file:
+        for line in event_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+SCENARIOS = {
+    'learn_storm': learn_storm,
+    'port_flaps': port_flaps,
+    'mixed': mixed
+}
+
+
+class EventServer:
+    """Serves a stream of events to a single client over a UNIX socket"""
+
+    _CHUNK_EVENTS = 256
+    _TICK_SEC = 0.01
+
+    def __init__(self, sock_path, events, rate=0):
+        self._sock_path = sock_path
+        self._events = events
+        self._rate = rate
+        self._server = None
+        self._thread = None
+        self.sent = 0
+
+    def start(self):
+        """Start listening and serving events in the background"""
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._sock_path)
+        self._server.listen(1)
+        self._thread = threading.Thread(target=self._serve, name='evbench', daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        conn, _ = self._server.accept()
+        try:
+            start = time.monotonic()
+            events = iter(self._events)
+            while True:
+                if self._rate:
+                    due = int((time.monotonic() - start) * self._rate) - self.sent
+                    if due <= 0:
+                        time.sleep(self._TICK_SEC)
+                        continue
+                else:
+                    due = self._CHUNK_EVENTS
+                chunk = self._make_chunk(events, due)
+                if not chunk:
+                    break
+                conn.sendall(chunk)
+        except BrokenPipeError:
+            LOGGER.warning('Event client disconnected after %d events', self.sent)
+        finally:
+            conn.close()
+
+    def _make_chunk(self, events, count):
+        lines = []
+        now = time.time()
+        for event in events:
+            event['time'] = now
+            lines.append(json.dumps(event).encode())
+            if len(lines) >= count:
+                break
+        self.sent += len(lines)
+        return b'\n'.join(lines) + b'\n' if lines else None
+
+    def stop(self):
+        """Stop serving events"""
+        self._server.close()
+        self._thread.join()
+
+
+class EventBenchmark:
+    """Drives a FaucetEventClient with a served event stream and measures the event path"""
+
+    _PERCENTILES = (50, 90, 99)
+
+    def __init__(self, config):
+        self._config = config
+        self._batch = config.get('event_batch', False)
+        self._latencies = []
+        self._counts = {kind.name: 0 for kind in EventType}
+        self._handlers = {
+            EventType.PORT_STATE: self._count_event,
+            EventType.PORT_LEARN: self._count_event,
+            EventType.CONFIG_CHANGE: self._count_event
+        }
+
+    def _make_events(self):
+        if self._config.get('replay'):
+            return replay(self._config['replay'])
+        scenario = self._config.get('scenario', 'learn_storm')
+        assert scenario in SCENARIOS, 'Unknown scenario %s' % scenario
+        count = int(self._config.get('count', 10000))
+        ports = int(self._config.get('ports', 24))
+        return SCENARIOS[scenario](count, ports, int(self._config.get('dpid', 2)))
+
+    def _count_event(self, event):
+        self._counts[event.kind.name] += 1
+
+    def _dispatch(self, event):
+        # Mirrors the runner: one table lookup on the decoded kind per event.
+        handler = self._handlers.get(event.kind)
+        if handler:
+            handler(event)
+        else:
+            self._counts[event.kind.name] += 1
+        if event.time:
+            self._latencies.append(time.time() - event.time)
+
+    def _dispatch_all(self, events):
+        if not self._batch:
+            for event in events:
+                self._dispatch(event)
+            return
+        # Same reduction as the runner's batch mode, so only the surviving events count.
+        port_states, port_learns, others = coalesce_port_events(events)
+        for event in others + list(port_states.values()) + list(port_learns.values()):
+            self._dispatch(event)
+
+    @staticmethod
+    def _drain(client):
+        events = []
+        event = client.next_event()
+        while event:
+            events.append(event)
+            event = client.next_event()
+        return events
+
+    def _consume(self, client):
+        while client.has_event(blocking=True):
+            if self._batch:
+                self._dispatch_all(self._drain(client))
+            else:
+                event = client.next_event()
+                if event:
+                    self._dispatch(event)
+        # Stream is closed, so wait out any port events still being debounced.
+        timeout = client.next_timeout()
+        while timeout is not None:
+            time.sleep(timeout)
+            self._dispatch_all(self._drain(client))
+            timeout = client.next_timeout()
+
+    def run(self):
+        """Run the benchmark and return a dict of results"""
+        tmpdir = tempfile.mkdtemp()
+        sock_path = os.path.join(tmpdir, 'faucet_event.sock')
+        server = EventServer(sock_path, self._make_events(), float(self._config.get('rate', 0)))
+        trace_memory = self._config.get('trace_memory', False)
+        client_config = {'port_debounce_sec': self._config.get('port_debounce_sec', 0)}
+        try:
+            server.start()
+            if trace_memory:
+                tracemalloc.start()
+            client = FaucetEventClient(client_config)
+            client.connect(sock_path)
+            start = time.monotonic()
+            self._consume(client)
+            elapsed = time.monotonic() - start
+            client.disconnect()
+            traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            server.stop()
+            shutil.rmtree(tmpdir)
+        return self._results(server.sent, elapsed, traced_peak)
+
+    def _results(self, sent, elapsed, traced_peak):
+        dispatched = sum(self._counts.values())
+        results = {
+            'events_sent': sent,
+            'events_dispatched': dispatched,
+            'event_counts': {kind: count for kind, count in self._counts.items() if count},
+            'elapsed_sec': round(elapsed, 3),
+            'events_per_sec': round(dispatched / elapsed, 1) if elapsed else None,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        if traced_peak is not None:
+            results['traced_peak_kb'] = traced_peak // 1024
+        latencies = sorted(self._latencies)
+        for percentile in self._PERCENTILES:
+            index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+            value = round(latencies[index] * 1000, 3) if latencies else None
+            results['latency_p%d_ms' % percentile] = value
+        results['passed'] = self._check_limits(results)
+        return results
+
+    def _check_limits(self, results):
+        passed = True
+        min_rate = float(self._config.get('min_rate', 0))
+        if min_rate and (results['events_per_sec'] or 0) < min_rate:
+            LOGGER.error('Event rate %s below minimum %s', results['events_per_sec'], min_rate)
+            passed = False
+        max_p99 = float(self._config.get('max_p99_ms', 0))
+        if max_p99 and (results['latency_p99_ms'] or 0) > max_p99:
+            LOGGER.error('Event p99 latency %sms above maximum %s',
+                         results['latency_p99_ms'], max_p99)
+            passed = False
+        return passed
+
+
+if __name__ == '__main__':
+    logger.set_config(format='%(levelname)s:%(message)s', level='INFO')
+    CONFIG = configurator.Configurator().parse_args(sys.argv)
+    RESULTS = EventBenchmark(CONFIG).run()
+    print(json.dumps(RESULTS, indent=2, sort_keys=True))
+    sys.exit(0 if RESULTS['passed'] else 1)
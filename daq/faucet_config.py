@@ -0,0 +1,57 @@
+"""Writing of the faucet behavioral config file"""
+
+import hashlib
+import os
+
+import logger
+
+LOGGER = logger.get_logger('faucetcfg')
+
+
+class FaucetConfigWriter:
+    """Writes faucet configs from network topologies, skipping any that are unchanged"""
+
+    def __init__(self, filename, render):
+        self._filename = filename
+        self._render = render
+        self._topology = None
+        self._config_hash = None
+
+    def write(self, network_topology):
+        """Write the config for the given network topology, returning True if it changed"""
+        # Interface changes are a small part of the topology, and ACL-only changes (in their
+        # own included files) don't touch it at all, so skip rendering when it's unchanged.
+        if network_topology == self._topology:
+            LOGGER.debug('Skipping unchanged faucet network topology')
+            return False
+        tmp_file = self._filename + '.tmp'
+        try:
+            self._render(network_topology, tmp_file)
+        except Exception:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        with open(tmp_file, 'rb') as config_file:
+            config_hash = hashlib.sha256(config_file.read()).hexdigest()
+        if config_hash == self._config_hash:
+            LOGGER.debug('Skipping unchanged faucet config')
+            os.remove(tmp_file)
+            self._topology = network_topology
+            return False
+        # Replace in one step, so faucet never reads a partially written config.
+        os.replace(tmp_file, self._filename)
+        # Only remembered once written, so a failed write is retried with the same topology.
+        self._log_interface_changes(network_topology)
+        self._topology = network_topology
+        self._config_hash = config_hash
+        return True
+
+    def _log_interface_changes(self, network_topology):
+        if not self._topology:
+            return
+        for dp_name, dp_config in network_topology['dps'].items():
+            old_interfaces = self._topology['dps'].get(dp_name, {}).get('interfaces', {})
+            changed = [port for port, interface in dp_config['interfaces'].items()
+                       if old_interfaces.get(port) != interface]
+            if changed:
+                LOGGER.info('Faucet %s interface changes on ports %s', dp_name, changed)
@@ -0,0 +1,249 @@
+"""Shared faucet event bus, fanning out one decoded event stream to many subscribers"""
+
+import collections
+import os
+import socket
+import time
+
+import logger
+from faucet_event_client import EventType, FaucetEventClient
+
+LOGGER = logger.get_logger('evbus')
+
+
+def coalesce_port_events(events):
+    """Reduce a batch of events to the final state, and first subsequent learn, of each port.
+    Returns dicts of (dpid, port) to port state and learn events, and a list of the rest"""
+    port_states = {}
+    port_learns = {}
+    others = []
+    for event in events:
+        if event.dpid is None:
+            continue
+        if event.kind == EventType.PORT_STATE and event.port:
+            port_states[(event.dpid, event.port)] = event
+            # Anything learned before a state change is superseded by it.
+            port_learns.pop((event.dpid, event.port), None)
+        elif event.kind == EventType.PORT_LEARN and event.port:
+            port_learns.setdefault((event.dpid, event.port), event)
+        else:
+            others.append(event)
+    return port_states, port_learns, others
+
+
+class Subscription:
+    """Filtered and bounded queue of events for a single subscriber"""
+
+    OVERFLOW_PAUSE = 'pause'
+    OVERFLOW_DROP = 'drop'
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, bus, name, dpids=None, kinds=None, max_queue=None,
+                 overflow=OVERFLOW_PAUSE, callback=None):
+        assert overflow in (self.OVERFLOW_PAUSE, self.OVERFLOW_DROP), 'bad overflow %s' % overflow
+        self.name = name
+        self._bus = bus
+        self._dpids = set(dpids) if dpids else None
+        self._kinds = set(kinds) if kinds else None
+        self._max_queue = max_queue
+        self._overflow = overflow
+        self._callback = callback
+        self._queue = collections.deque()
+        self.dropped = 0
+
+    def matches(self, event):
+        """Check if the event passes this subscription's filter"""
+        return ((not self._dpids or event.dpid in self._dpids) and
+                (not self._kinds or event.kind in self._kinds))
+
+    def is_full(self):
+        """Check if this subscription can't take any more events"""
+        return self._max_queue is not None and len(self._queue) >= self._max_queue
+
+    def is_pausing(self):
+        """Check if this subscription is full and holding up the bus"""
+        return self._overflow == self.OVERFLOW_PAUSE and self.is_full()
+
+    def deliver(self, event):
+        """Queue an event for this subscriber"""
+        if self.is_full():
+            self._queue.popleft()
+            self.dropped += 1
+            if self.dropped == 1:
+                LOGGER.warning('Subscription %s overflow, dropping oldest events', self.name)
+        self._queue.append(event)
+        if self._callback:
+            self._callback(self)
+
+    def has_event(self):
+        """Check if there are any queued events, pulling from the bus if needed"""
+        if not self._queue:
+            self._bus.pump()
+        return bool(self._queue)
+
+    def next_event(self):
+        """Return the next queued event, or None if none available"""
+        return self._queue.popleft() if self.has_event() else None
+
+    def pop_events(self):
+        """Return all currently queued events, without pulling from the bus"""
+        events = list(self._queue)
+        self._queue.clear()
+        return events
+
+
+class _RelayClient:
+    """Raw faucet event stream forwarded to a single relay client"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, conn, synced):
+        self.conn = conn
+        self.name = 'relay-%d' % conn.fileno()
+        self.pending = bytearray()
+        self.synced = synced
+        self.stalled = None
+
+    def queue(self, data):
+        """Queue raw stream data, starting at a line boundary"""
+        if not self.synced:
+            index = data.find(b'\n')
+            if index < 0:
+                return
+            data = data[index + 1:]
+            self.synced = True
+        self.pending += data
+
+
+class FaucetEventBus:
+    """Holds the faucet event connection and publishes each decoded event to subscribers"""
+
+    _RELAY_BUFFER_SIZE = 4 * 1024 * 1024
+    _RELAY_STALL_SEC = 30
+    _SEND_SIZE = 64 * 1024
+
+    def __init__(self, config):
+        self._client = FaucetEventClient(config)
+        self._subscriptions = []
+        self._source_path = config.get('event_relay_source')
+        self._relay_path = config.get('event_relay_sock')
+        self._relay_buffer = int(config.get('event_relay_buffer', self._RELAY_BUFFER_SIZE))
+        self.relay_sock = None
+        self._relays = {}
+        self._relay_at_line = True
+
+    @property
+    def sock(self):
+        """Underlying faucet event socket"""
+        return self._client.sock
+
+    def connect(self):
+        """Connect to the faucet event socket (or another process's relay of it), and start
+        the relay if configured"""
+        self._client.connect(self._source_path)
+        if self._relay_path:
+            self._start_relay()
+
+    def disconnect(self):
+        """Disconnect from the faucet event socket and any relay clients"""
+        self._client.disconnect()
+        for conn in list(self._relays):
+            self._drop_relay(conn)
+        if self.relay_sock:
+            self.relay_sock.close()
+            self.relay_sock = None
+            os.remove(self._relay_path)
+
+    def subscribe(self, name, **kwargs):
+        """Add a subscription, see Subscription for filtering and queue options"""
+        subscription = Subscription(self, name, **kwargs)
+        self._subscriptions.append(subscription)
+        LOGGER.info('Added event subscription %s', name)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription"""
+        self._subscriptions.remove(subscription)
+        LOGGER.info('Removed event subscription %s', subscription.name)
+
+    def next_timeout(self):
+        """Return seconds until the next debounced event is due, or None if none"""
+        return self._client.next_timeout()
+
+    def pump(self):
+        """Publish available events until there are none or a subscriber is full"""
+        count = 0
+        while not self._is_paused():
+            event = self._client.next_event()
+            if not event:
+                break
+            count += 1
+            for subscription in self._subscriptions:
+                if subscription.matches(event):
+                    subscription.deliver(event)
+        if self._relays:
+            self._flush_relays()
+        return count
+
+    def _is_paused(self):
+        if any(sub.is_pausing() for sub in self._subscriptions):
+            return True
+        if any(len(relay.pending) >= self._relay_buffer for relay in self._relays.values()):
+            self._flush_relays()
+            return any(len(relay.pending) >= self._relay_buffer
+                       for relay in self._relays.values())
+        return False
+
+    def _start_relay(self):
+        if os.path.exists(self._relay_path):
+            os.remove(self._relay_path)
+        self.relay_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.relay_sock.bind(self._relay_path)
+        self.relay_sock.listen()
+        self.relay_sock.setblocking(False)
+        self._client.raw_listener = self._relay_data
+        LOGGER.info('Relaying faucet events on %s', self._relay_path)
+
+    def service_relay(self):
+        """Accept any pending relay clients and send them queued events"""
+        while self.relay_sock:
+            try:
+                conn, _ = self.relay_sock.accept()
+            except BlockingIOError:
+                break
+            conn.setblocking(False)
+            relay = _RelayClient(conn, self._relay_at_line)
+            self._relays[conn] = relay
+            LOGGER.info('Added event relay client %s', relay.name)
+        self._flush_relays()
+
+    def _relay_data(self, data):
+        # Relayed as received, so clients see the same event stream (and do their own
+        # debouncing) as if they were connected to faucet directly.
+        for relay in self._relays.values():
+            relay.queue(data)
+        self._relay_at_line = data.endswith(b'\n')
+
+    def _flush_relays(self):
+        for conn, relay in list(self._relays.items()):
+            try:
+                while relay.pending:
+                    sent = conn.send(relay.pending[:self._SEND_SIZE])
+                    del relay.pending[:sent]
+            except BlockingIOError:
+                pass  # Send the rest later, holding up the bus if it backs up too far.
+            except OSError as e:
+                LOGGER.info('Relay client %s closed: %s', relay.name, e)
+                self._drop_relay(conn)
+                continue
+            if len(relay.pending) < self._relay_buffer:
+                relay.stalled = None
+            elif relay.stalled is None:
+                relay.stalled = time.monotonic()
+            elif time.monotonic() - relay.stalled > self._RELAY_STALL_SEC:
+                LOGGER.warning('Relay client %s stalled, disconnecting', relay.name)
+                self._drop_relay(conn)
+
+    def _drop_relay(self, conn):
+        relay = self._relays.pop(conn)
+        LOGGER.info('Removed event relay client %s', relay.name)
+        conn.close()
@@ -1,40 +1,132 @@
 """Simple client for working with the faucet event socket"""
 
+import collections
+import heapq
 import json
 import os
 import select
 import socket
-import threading
 import time
+from enum import Enum
 
 import logger
 
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = json
+
 LOGGER = logger.get_logger('fevent')
 
+
+class EventType(Enum):
+    """Kinds of decoded faucet events"""
+    PORT_STATE = 'PORT_CHANGE'
+    PORT_LEARN = 'L2_LEARN'
+    PORTS_STATUS = 'PORTS_STATUS'
+    CONFIG_CHANGE = 'CONFIG_CHANGE'
+    OTHER = 'OTHER'
+
+
+class FaucetEvent:
+    """Compact decoded faucet event"""
+    # pylint: disable=too-few-public-methods,too-many-arguments
+
+    __slots__ = ('kind', 'dpid', 'port', 'active', 'mac', 'restart_type', 'status', 'debounced',
+                 'time')
+
+    def __init__(self, kind, dpid, port=None, active=None, mac=None, restart_type=None,
+                 status=None, debounced=False):
+        self.kind = kind
+        self.dpid = dpid
+        self.port = port
+        self.active = active
+        self.mac = mac
+        self.restart_type = restart_type
+        self.status = status
+        self.debounced = debounced
+        self.time = None
+
+    def __repr__(self):
+        values = ('%s=%s' % (slot, getattr(self, slot)) for slot in self.__slots__[1:]
+                  if getattr(self, slot) is not None)
+        return '%s(%s)' % (self.kind.name, ', '.join(values))
+
+
+def _decode_port_change(dpid, body):
+    active = body['status'] and body['reason'] != 'DELETE'
+    return FaucetEvent(EventType.PORT_STATE, dpid, port=int(body['port_no']), active=active)
+
+
+def _decode_port_learn(dpid, body):
+    return FaucetEvent(EventType.PORT_LEARN, dpid, port=int(body['port_no']), mac=body['eth_src'])
+
+
+def _decode_ports_status(dpid, body):
+    return FaucetEvent(EventType.PORTS_STATUS, dpid, status=body)
+
+
+def _decode_config_change(dpid, body):
+    return FaucetEvent(EventType.CONFIG_CHANGE, dpid, restart_type=body.get('restart_type'))
+
+
+_EVENT_DECODERS = {
+    EventType.PORT_STATE.value: _decode_port_change,
+    EventType.PORT_LEARN.value: _decode_port_learn,
+    EventType.PORTS_STATUS.value: _decode_ports_status,
+    EventType.CONFIG_CHANGE.value: _decode_config_change
+}
+
+
+def decode_event(line):
+    """Decode a raw event line into a FaucetEvent"""
+    message = fast_json.loads(bytes(line))
+    for key, decoder in _EVENT_DECODERS.items():
+        if key in message:
+            event = decoder(message['dp_id'], message[key])
+            break
+    else:
+        event = FaucetEvent(EventType.OTHER, message.get('dp_id'))
+    event.time = message.get('time')
+    return event
+
+
 class FaucetEventClient():
     """A general client interface to the FAUCET event API"""
 
     FAUCET_RETRIES = 10
     _PORT_DEBOUNCE_SEC = 5
+    _RECV_SIZE = 64 * 1024
+    _COMPACT_SIZE = 64 * 1024
 
     def __init__(self, config):
         self.config = config
         self.sock = None
-        self.buffer = None
-        self._buffer_lock = threading.Lock()
+        self._buffer = None
+        self._offset = 0
+        self._scan = 0
+        self._base = 0
+        self._prepended = collections.deque()
+        self._appended = collections.deque()
         self.previous_state = None
-        self._port_debounce_sec = int(config.get('port_debounce_sec', self._PORT_DEBOUNCE_SEC))
+        self._port_debounce_sec = float(config.get('port_debounce_sec', self._PORT_DEBOUNCE_SEC))
         self._port_timers = {}
+        self._debounce_heap = []
+        self._debounce_seq = 0
+        self.raw_listener = None
 
-    def connect(self):
-        """Make connection to sock to receive events"""
+    def connect(self, sock_path=None):
+        """Make connection to sock to receive events, by default from FAUCET_EVENT_SOCK"""
 
-        sock_path = os.getenv('FAUCET_EVENT_SOCK')
+        sock_path = sock_path or os.getenv('FAUCET_EVENT_SOCK')
 
         assert sock_path, 'Environment FAUCET_EVENT_SOCK not defined'
 
         self.previous_state = {}
-        self.buffer = ''
+        self._reset_buffer()
 
         retries = self.FAUCET_RETRIES
         while not os.path.exists(sock_path):
@@ -49,42 +141,92 @@ class FaucetEventClient():
         except socket.error as err:
             assert False, "Failed to connect because: %s" % err
 
+    def _reset_buffer(self):
+        self._buffer = bytearray()
+        self._offset = 0
+        self._scan = 0
+        self._base = 0
+        self._prepended.clear()
+        self._appended.clear()
+        self._port_timers.clear()
+        self._debounce_heap = []
+
     def disconnect(self):
         """Disconnect this event socket"""
         self.sock.close()
         self.sock = None
 
-    def has_data(self):
+    def has_data(self, timeout=0):
         """Check to see if the event socket has any data to read"""
-        read, dummy_write, dummy_error = select.select([self.sock], [], [], 0)
+        read, dummy_write, dummy_error = select.select([self.sock], [], [], timeout)
         return read
 
     def has_event(self, blocking=False):
         """Check if there are any queued events"""
         while True:
-            if '\n' in self.buffer:
+            self._expire_debounce()
+            if self._prepended or self._appended or self._has_line():
                 return True
-            if blocking or self.has_data():
-                data = self.sock.recv(1024).decode('utf-8')
-                with self._buffer_lock:
-                    self.buffer += data
-            else:
+            if not self.has_data(self.next_timeout() if blocking else 0):
+                if blocking:
+                    # Woken up by a debounce deadline rather than socket data.
+                    continue
                 return False
+            data = self.sock.recv(self._RECV_SIZE)
+            if not data:
+                LOGGER.warning('Faucet event socket closed')
+                return False
+            self._buffer += data
+            if self.raw_listener:
+                self.raw_listener(data)
+
+    def next_timeout(self):
+        """Return seconds until the next pending debounce event is due, or None if none"""
+        heap = self._debounce_heap
+        while heap and self._port_timers.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return max(0, heap[0][0] - time.monotonic())
+
+    def _has_line(self):
+        """Check for a complete line, remembering where the scan left off"""
+        index = self._buffer.find(b'\n', self._scan)
+        self._scan = len(self._buffer) if index < 0 else index
+        return index >= 0
+
+    def _pop_line(self):
+        """Remove and return the next complete line from the buffer"""
+        index = self._buffer.find(b'\n', self._scan)
+        if index < 0:
+            self._scan = len(self._buffer)
+            return None
+        line = self._buffer[self._offset:index]
+        self._offset = self._scan = index + 1
+        if self._offset >= self._COMPACT_SIZE and self._offset * 2 >= len(self._buffer):
+            del self._buffer[:self._offset]
+            self._base += self._offset
+            self._scan -= self._offset
+            self._offset = 0
+        return line
+
+    def _line_end_position(self):
+        """Stream position just past the last complete line currently in the buffer"""
+        index = self._buffer.rfind(b'\n', self._offset)
+        return self._base + (index + 1 if index >= 0 else self._offset)
 
     def _filter_faucet_event(self, event):
-        (dpid, port, active) = self.as_port_state(event)
-        if dpid and port:
-            if not event.get('debounced'):
-                self._debounce_port_event(dpid, port, active)
-            elif self._process_state_update(dpid, port, active):
+        if event.kind == EventType.PORT_STATE and event.dpid and event.port:
+            if not event.debounced:
+                self._debounce_port_event(event.dpid, event.port, event.active, event.time)
+            elif self._process_state_update(event.dpid, event.port, event.active):
                 return event
             return None
 
-        (dpid, status) = self.as_ports_status(event)
-        if dpid:
-            for port in status:
+        if event.kind == EventType.PORTS_STATUS and event.dpid:
+            for port, active in event.status.items():
                 # Prepend events so they functionally replace the current one in the queue.
-                self._prepend_event(self._make_port_state(dpid, port, status[port]))
+                self._prepend_event(self._make_port_state(event.dpid, port, active))
             return None
         return event
 
@@ -96,103 +238,104 @@ class FaucetEventClient():
         self.previous_state[state_key] = active
         return True
 
-    def _debounce_port_event(self, dpid, port, active):
+    def _debounce_port_event(self, dpid, port, active, event_time=None):
         if not self._port_debounce_sec:
-            self._handle_debounce(dpid, port, active)
+            self._handle_debounce(dpid, port, active, event_time)
             return
         state_key = '%s-%d' % (dpid, port)
-        if state_key in self._port_timers:
+        # Cancellation is lazy: superseded heap entries are dropped when they reach the top.
+        if self._port_timers.pop(state_key, None) is not None:
             LOGGER.debug('Port cancel %s', state_key)
-            self._port_timers[state_key].cancel()
         if active:
-            self._handle_debounce(dpid, port, active)
+            self._handle_debounce(dpid, port, active, event_time)
             return
         LOGGER.debug('Port timer %s = %s', state_key, active)
-        timer = threading.Timer(self._port_debounce_sec,
-                                lambda: self._handle_debounce(dpid, port, active))
-        timer.start()
-        self._port_timers[state_key] = timer
+        self._debounce_seq += 1
+        deadline = time.monotonic() + self._port_debounce_sec
+        entry = (deadline, self._debounce_seq, state_key, dpid, port, active, event_time)
+        heapq.heappush(self._debounce_heap, entry)
+        self._port_timers[state_key] = self._debounce_seq
+
+    def _expire_debounce(self):
+        """Queue any debounced port events whose deadline has passed"""
+        heap = self._debounce_heap
+        now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            (_, seq, state_key, dpid, port, active, event_time) = heapq.heappop(heap)
+            if self._port_timers.get(state_key) == seq:
+                del self._port_timers[state_key]
+                self._handle_debounce(dpid, port, active, event_time)
 
-    def _handle_debounce(self, dpid, port, active):
+    def _handle_debounce(self, dpid, port, active, event_time=None):
         LOGGER.debug('Port handle %s-%s as %s', dpid, port, active)
-        self._append_event(self._make_port_state(dpid, port, active, debounced=True))
+        event = self._make_port_state(dpid, port, active, debounced=True)
+        event.time = event_time
+        self._append_event(event)
 
     def _prepend_event(self, event):
-        with self._buffer_lock:
-            self.buffer = '%s\n%s' % (json.dumps(event), self.buffer)
+        self._prepended.appendleft(event)
 
     def _append_event(self, event):
-        event_str = json.dumps(event)
-        with self._buffer_lock:
-            index = self.buffer.rfind('\n')
-            if index == len(self.buffer) - 1:
-                self.buffer = '%s%s\n' % (self.buffer, event_str)
-            elif index == -1:
-                self.buffer = '%s\n%s' % (event_str, self.buffer)
-            else:
-                self.buffer = '%s\n%s%s' % (self.buffer[:index], event_str, self.buffer[index:])
-            LOGGER.debug('appended %s\n%s*', event_str, self.buffer)
+        # Slot in after any complete lines already received, but before partial data.
+        self._appended.append((self._line_end_position(), event))
+        LOGGER.debug('appended %s', event)
+
+    def _next_queued(self):
+        """Return the next queued event, synthetic or received, or None if unparsable"""
+        if self._prepended:
+            return self._prepended.popleft()
+        if self._appended and self._appended[0][0] <= self._base + self._offset:
+            return self._appended.popleft()[1]
+        line = self._pop_line()
+        try:
+            return decode_event(line)
+        except Exception as e:
+            LOGGER.info('Error (%s) parsing\n%s*', str(e), line)
+            return None
 
     def next_event(self, blocking=False):
         """Return the next event from the queue"""
         while self.has_event(blocking=blocking):
-            with self._buffer_lock:
-                line, remainder = self.buffer.split('\n', 1)
-                self.buffer = remainder
-            try:
-                event = json.loads(line)
-            except Exception as e:
-                LOGGER.info('Error (%s) parsing\n%s*\nwith\n%s*', str(e), line, remainder)
-            event = self._filter_faucet_event(event)
+            event = self._next_queued()
+            event = self._filter_faucet_event(event) if event else None
             if event:
                 return event
         return None
 
     def _make_port_state(self, dpid, port, status, debounced=False):
-        port_change = {}
-        port_change['port_no'] = port
-        port_change['status'] = status
-        port_change['reason'] = 'MODIFY'
-        event = {}
-        event['dp_id'] = dpid
-        event['PORT_CHANGE'] = port_change
-        event['debounced'] = debounced
-        return event
+        return FaucetEvent(EventType.PORT_STATE, dpid, port=int(port), active=status,
+                           debounced=debounced)
 
     def as_config_change(self, event):
         """Convert the event to dp change info, if applicable"""
-        if not event or 'CONFIG_CHANGE' not in event:
+        if not event or event.kind != EventType.CONFIG_CHANGE:
             return (None, None)
-        return (event['dp_id'], event['CONFIG_CHANGE'].get('restart_type'))
+        return (event.dpid, event.restart_type)
 
     def as_ports_status(self, event):
         """Convert the event to port status info, if applicable"""
-        if not event or 'PORTS_STATUS' not in event:
+        if not event or event.kind != EventType.PORTS_STATUS:
             return (None, None)
-        return (event['dp_id'], event['PORTS_STATUS'])
+        return (event.dpid, event.status)
 
     def as_port_state(self, event):
         """Convert event to a port state info, if applicable"""
-        if not event or 'PORT_CHANGE' not in event:
+        if not event or event.kind != EventType.PORT_STATE:
             return (None, None, None)
-        dpid = event['dp_id']
-        port_no = int(event['PORT_CHANGE']['port_no'])
-        reason = event['PORT_CHANGE']['reason']
-        port_active = event['PORT_CHANGE']['status'] and reason != 'DELETE'
-        return (dpid, port_no, port_active)
+        return (event.dpid, event.port, event.active)
 
     def as_port_learn(self, event):
         """Convert to port learning info, if applicable"""
-        if not event or 'L2_LEARN' not in event:
+        if not event or event.kind != EventType.PORT_LEARN:
             return (None, None, None)
-        dpid = event['dp_id']
-        port_no = int(event['L2_LEARN']['port_no'])
-        eth_src = event['L2_LEARN']['eth_src']
-        return (dpid, port_no, eth_src)
+        return (event.dpid, event.port, event.mac)
 
     def close(self):
         """Close the faucet event socket"""
         self.sock.close()
         self.sock = None
-        with self._buffer_lock:
-            self.buffer = None
+        self._buffer = None
+        self._prepended.clear()
+        self._appended.clear()
+        self._port_timers.clear()
+        self._debounce_heap = []
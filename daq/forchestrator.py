@@ -1,11 +1,15 @@
 """Orchestrator component for controlling a Faucet SDN"""
 
+import json
 import sys
+import threading
+import time
 
 import logging
 import configurator
 import faucet_event_client
 import http_server
+from faucet_event_client import EventType
 
 import logger
 LOGGER = logger.get_logger('forch')
@@ -19,6 +23,21 @@ class Forchestrator:
         self._config = config
         self._faucet_events = None
         self._server = None
+        self._event_handlers = {
+            EventType.PORT_STATE: self._port_state_event,
+            EventType.PORT_LEARN: self._port_learn_event,
+            EventType.CONFIG_CHANGE: self._config_change_event
+        }
+        self._state_lock = threading.Lock()
+        self._state_version = 0
+        # Distinguishes etags across restarts, when the version count starts over.
+        self._etag_base = '%x' % int(time.time())
+        self._port_states = {}
+        self._port_macs = {}
+        self._mac_ports = {}
+        self._dp_restarts = {}
+        self._overview = None
+        self._overview_version = None
 
     def initialize(self):
         """Initialize forchestrator instance"""
@@ -29,33 +48,85 @@ class Forchestrator:
     def main_loop(self):
         """Main event processing loop"""
         LOGGER.info('Entering main event loop...')
-        while self._handle_faucet_events():
-            pass
+        # Blocks on the socket, waking up early only when a debounced port event is due.
+        while self._faucet_events.has_event(blocking=True):
+            self._handle_faucet_events()
+        LOGGER.warning('Faucet event stream closed, exiting main event loop.')
 
     def _handle_faucet_events(self):
         while self._faucet_events:
             event = self._faucet_events.next_event()
             LOGGER.debug('Faucet event %s', event)
             if not event:
-                return True
-            (dpid, port, active) = self._faucet_events.as_port_state(event)
-            if dpid and port:
-                LOGGER.info('Port state %s %s %s', dpid, port, active)
-            (dpid, port, target_mac) = self._faucet_events.as_port_learn(event)
-            if dpid and port:
-                LOGGER.info('Port learn %s %s %s', dpid, port, target_mac)
-            (dpid, restart_type) = self._faucet_events.as_config_change(event)
-            if dpid is not None:
-                LOGGER.info('DP restart %d %s', dpid, restart_type)
-        return False
+                return
+            handler = self._event_handlers.get(event.kind)
+            if handler and event.dpid is not None:
+                with self._state_lock:
+                    handler(event)
 
-    def get_overview(self, params):
-        """Get an overview of the system"""
+    def _port_state_event(self, event):
+        if not event.port:
+            return
+        LOGGER.info('Port state %s %s %s', event.dpid, event.port, event.active)
+        self._port_states.setdefault(event.dpid, {})[event.port] = event.active
+        if not event.active:
+            # Faucet flushes hosts learned on a port when it goes down.
+            for mac in self._port_macs.pop((event.dpid, event.port), ()):
+                del self._mac_ports[mac]
+        self._state_version += 1
+
+    def _port_learn_event(self, event):
+        if not event.port:
+            return
+        LOGGER.info('Port learn %s %s %s', event.dpid, event.port, event.mac)
+        key = (event.dpid, event.port)
+        previous = self._mac_ports.get(event.mac)
+        if previous == key:
+            return
+        if previous:
+            self._port_macs[previous].discard(event.mac)
+        self._mac_ports[event.mac] = key
+        self._port_macs.setdefault(key, set()).add(event.mac)
+        self._state_version += 1
+
+    def _config_change_event(self, event):
+        LOGGER.info('DP restart %d %s', event.dpid, event.restart_type)
+        self._dp_restarts[event.dpid] = event.restart_type
+        self._state_version += 1
+
+    def _make_overview(self):
+        dps = {}
+        for dpid, restart_type in self._dp_restarts.items():
+            dps[str(dpid)] = {'ports': {}, 'restart_type': restart_type}
+        for dpid, ports in self._port_states.items():
+            for port, active in ports.items():
+                self._overview_port(dps, dpid, port)['active'] = active
+        for (dpid, port), macs in self._port_macs.items():
+            self._overview_port(dps, dpid, port)['macs'] = sorted(macs)
         return {
-            'hello': 'world',
-            'params': params
+            'version': self._state_version,
+            'learned_macs': len(self._mac_ports),
+            'dps': dps
         }
 
+    def _overview_port(self, dps, dpid, port):
+        dp_info = dps.setdefault(str(dpid), {'ports': {}, 'restart_type': None})
+        return dp_info['ports'].setdefault(str(port), {'active': None, 'macs': []})
+
+    def get_overview_etag(self, params):
+        """Get the etag of the current system overview"""
+        # pylint: disable=unused-argument
+        return '"%s-%d"' % (self._etag_base, self._state_version)
+
+    def get_overview(self, params):
+        """Get an overview of the system"""
+        # pylint: disable=unused-argument
+        with self._state_lock:
+            if self._overview_version != self._state_version:
+                self._overview = json.dumps(self._make_overview(), sort_keys=True)
+                self._overview_version = self._state_version
+            return self._overview
+
 
 if __name__ == '__main__':
     logger.set_config(level=logging.INFO)
@@ -63,6 +134,6 @@ if __name__ == '__main__':
     FORCH = Forchestrator(CONFIG)
     FORCH.initialize()
     HTTP = http_server.HttpServer(CONFIG)
-    HTTP.map_request('overview', FORCH.get_overview)
+    HTTP.map_request('overview', FORCH.get_overview, etag=FORCH.get_overview_etag)
     HTTP.start_server()
     FORCH.main_loop()
@@ -1,6 +1,6 @@
 """Gateway module for device testing"""
 
-import datetime
+import functools
 import os
 import shutil
 
@@ -9,20 +9,18 @@ from clib import tcpdump_helper
 
 import dhcp_monitor
 import logger
+from port_sets import PortSetAllocator
 
 LOGGER = logger.get_logger('gateway')
 
 class Gateway():
     """Gateway collection class for managing testing services"""
 
+    IMAGE_NAME = 'daqf/networking'
     GATEWAY_OFFSET = 0
     DUMMY_OFFSET = 1
     TEST_OFFSET_START = 2
-    NUM_SET_PORTS = 6
-    SET_SPACING = 10
-    _PING_RETRY_COUNT = 5
-
-    TEST_IP_FORMAT = '192.168.84.%d'
+    NUM_SET_PORTS = PortSetAllocator.SET_PORTS
 
     def __init__(self, runner, name, port_set, network):
         self.name = name
@@ -41,6 +39,7 @@ class Gateway():
         self.ready = {}
         self.activated = False
         self.result_linger = False
+        self.failed = False
         self._scan_monitor = None
 
     def initialize(self):
@@ -57,7 +56,7 @@ class Gateway():
         host_port = self._switch_port(self.GATEWAY_OFFSET)
         LOGGER.info('Initializing gateway %s as %s/%d', self.name, host_name, host_port)
         self.tmpdir = self._setup_tmpdir(host_name)
-        cls = docker_host.make_docker_host('daqf/networking', prefix='daq', network='bridge')
+        cls = docker_host.make_docker_host(self.IMAGE_NAME, prefix='daq', network='bridge')
         # Work around an instability in the faucet/clib/docker library, b/152520627.
         if getattr(cls, 'pullImage'):
             setattr(cls, 'pullImage', lambda x: True)
@@ -75,7 +74,7 @@ class Gateway():
         self.dummy = dummy
         LOGGER.info("Added dummy target %s on port %d at %s", dummy_name, dummy_port, dummy.IP())
 
-        self.fake_target = self.TEST_IP_FORMAT % self.port_set
+        self.fake_target = self.network.port_sets.test_ip(self.port_set)
         self.host_intf = self.runner.get_host_interface(host)
         LOGGER.debug('Adding fake target at %s to %s', self.fake_target, self.host_intf)
         host.cmd('ip addr add %s dev %s' % (self.fake_target, self.host_intf))
@@ -86,17 +85,47 @@ class Gateway():
                                                      self._dhcp_callback, log_file)
         self.dhcp_monitor.start()
 
-        ping_retry = self._PING_RETRY_COUNT
-        while not self._ping_test(host, dummy):
-            ping_retry -= 1
-            LOGGER.info('Gateway %s warmup failed at %s with %d',
-                        host_name, datetime.datetime.now(), ping_retry)
-            assert ping_retry, 'warmup ping failure'
+        # All checks run at once, each retrying until its first reply (ARP warmup included).
+        checks = {
+            'dummy ping failed': (host, dummy, None),
+            'host ping failed': (dummy, host, None),
+            'fake ping failed': (dummy, self.fake_target, None),
+            'reverse ping failed': (host, dummy, self.fake_target)
+        }
+        self._ping_checks(checks)
+
+    def reset(self, name):
+        """Reset an idle gateway for reuse by a new device group"""
+        assert not self.targets, 'gw %s has targets %s' % (self.name, self.targets)
+        LOGGER.info('Resetting gateway %d/%s for %s', self.port_set, self.name, name)
+        self.name = name
+        self.ready = {}
+        self.activated = False
+        self.result_linger = False
+        try:
+            self.execute_script('reset_dhcp')
+            self._change_lease_time(self.runner.config.get('initial_dhcp_lease_time'))
+            self._startup_scan(self.host)
+            self._ping_checks({'dummy ping failed': (self.host, self.dummy, None)})
+        except Exception as e:
+            LOGGER.error('Gateway reset failed, terminating: %s', str(e))
+            self.terminate()
+            raise
 
-        assert self._ping_test(host, dummy), 'dummy ping failed'
-        assert self._ping_test(dummy, host), 'host ping failed'
-        assert self._ping_test(dummy, self.fake_target), 'fake ping failed'
-        assert self._ping_test(host, dummy, src_addr=self.fake_target), 'reverse ping failed'
+    def _ping_checks(self, checks):
+        # Results arrive later on the main loop, so a failure then takes down the whole set.
+        self.runner.ping_tests(list(checks.values()),
+                               functools.partial(self._ping_checked, self.name, list(checks)))
+
+    def _ping_checked(self, name, messages, result, exception):
+        if not self.host or self.name != name:
+            LOGGER.debug('Gateway %d ignoring ping checks for %s', self.port_set, name)
+            return
+        if not exception:
+            failed = [message for message, passed in zip(messages, result) if not passed]
+            exception = Exception(', '.join(failed)) if failed else None
+        if exception:
+            self.runner.gateway_error(self.port_set, exception)
 
     def activate(self):
         """Mark this gateway as activated once all hosts are present"""
@@ -126,12 +155,13 @@ class Gateway():
         self.execute_script('new_ip', mac)
 
     def allocate_test_port(self):
-        """Get the test port to use for this gateway setup"""
+        """Get the test port to use for this gateway setup, or None if all are in use"""
         test_port = self._switch_port(self.TEST_OFFSET_START)
         while test_port in self.test_ports:
             test_port = test_port + 1
         limit_port = self._switch_port(self.NUM_SET_PORTS)
-        assert test_port < limit_port, 'no test ports available'
+        if test_port >= limit_port:
+            return None
         self.test_ports[test_port] = True
         return test_port
 
@@ -163,7 +193,7 @@ class Gateway():
         del self.test_ports[test_port]
 
     def _switch_port(self, offset):
-        return self.port_set * self.SET_SPACING + offset
+        return self.network.port_sets.set_base_port(self.port_set) + offset
 
     def _is_target_expected(self, target):
         if not target:
@@ -236,6 +266,3 @@ class Gateway():
             except Exception as e:
                 LOGGER.error('Gateway %s terminating dummy: %s', self.name, e)
                 LOGGER.exception(e)
-
-    def _ping_test(self, src, dst, src_addr=None):
-        return self.runner.ping_test(src, dst, src_addr=src_addr)
@@ -8,7 +8,10 @@ import json
 from datetime import timedelta, datetime
 
 from clib import tcpdump_helper
+from image_manager import ImageManager
+import report
 from report import ResultType, ReportGenerator
+from scheduler import ModuleScheduler
 
 import configurator
 import docker_test
@@ -22,6 +25,7 @@ class _STATE:
     """Host state enum for testing cycle"""
     ERROR = 'Error condition'
     READY = 'Ready but not initialized'
+    SETTLING = 'Waiting for switch port to settle'
     INIT = 'Initialization'
     WAITING = 'Waiting for activation'
     BASE = 'Baseline tests'
@@ -56,15 +60,32 @@ def post_states():
     return ['finish', 'info', 'timer']
 
 
+class _ModuleRun:
+    """Bookkeeping for a single running test module"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, test_name, test_port, exclusive):
+        self.test_name = test_name
+        self.test_port = test_port
+        self.exclusive = exclusive
+        self.start = gcp.get_timestamp()
+        self.test_host = None
+        self.host_name = 'unknown'
+        self.monitor_ref = None
+        self.timeout_timer = None
+
+
 class ConnectedHost:
     """Class managing a device-under-test"""
 
     _STARTUP_MIN_TIME_SEC = 5
+    _OVS_SETTLE_SEC = 2
     _INST_DIR = "inst/"
     _DEVICE_PATH = "device/%s"
     _MODULE_CONFIG = "module_config.json"
     _CONTROL_PATH = "control/port-%s"
     _CORE_TESTS = ['pass', 'fail', 'ping', 'hold']
+    _EXCLUSIVE_TESTS = ['hold']
     _AUX_DIR = "aux/"
     _CONFIG_DIR = "config/"
     _TIMEOUT_EXCEPTION = TimeoutError('Timeout expired')
@@ -88,14 +109,20 @@ class ConnectedHost:
         self.dummy = None
         self.test_name = None
         self.test_start = gcp.get_timestamp()
-        self.test_host = None
-        self.test_port = None
+        self._active_tests = {}
+        self._module_parallelism = int(config.get('module_parallelism', 1))
+        self._warm_count = int(config.get('warm_modules', 0))
+        self._warm_tests = {}
+        self._warm_failed = set()
+        self._base_pending = False
         self._startup_time = None
         self._monitor_scan_sec = int(config.get('monitor_scan_sec', 0))
         _default_timeout_sec = int(config.get('default_timeout_sec', 0))
         self._default_timeout_sec = _default_timeout_sec if _default_timeout_sec else None
         self._finish_hook_script = config.get('finish_hook')
+        self._report_pdf = report.get_pdf_mode(config)
         self._mirror_intf_name = None
+        self._timeout_timer = None
         self._monitor_ref = None
         self._monitor_start = None
         self.target_ip = None
@@ -160,6 +187,10 @@ class ConnectedHost:
             return self._default_timeout_sec
         return test_module.get('timeout_sec', self._default_timeout_sec)
 
+    def _test_exclusive(self, test):
+        test_config = self._loaded_config['modules'].get(test, {})
+        return test_config.get('exclusive', test in self._EXCLUSIVE_TESTS)
+
     def _get_enabled_tests(self):
         return list(filter(self._test_enabled, self.config.get('test_list')))
 
@@ -225,7 +256,23 @@ class ConnectedHost:
         """Fully initialize a new host set"""
         LOGGER.info('Target port %d initializing...', self.target_port)
         # There is a race condition here with ovs assigning ports, so wait a bit.
-        time.sleep(2)
+        self._state_transition(_STATE.SETTLING, _STATE.READY)
+        self.runner.schedule_timer(self._OVS_SETTLE_SEC, self._initialize,
+                                   name='init%02d' % self.target_port)
+
+    def _initialize(self):
+        if self.state != _STATE.SETTLING:
+            LOGGER.info('Target port %d skipping initialization in state %s',
+                        self.target_port, self.state)
+            return
+        self._state_transition(_STATE.READY)
+        try:
+            self._initialize_host()
+        except Exception as e:
+            self._state_transition(_STATE.ERROR)
+            self.runner.target_set_error(self.target_port, e)
+
+    def _initialize_host(self):
         shutil.rmtree(self.devdir, ignore_errors=True)
         os.makedirs(self.scan_base)
         self._initialize_config()
@@ -278,12 +325,9 @@ class ConnectedHost:
         static_ip = self._get_static_ip()
         if static_ip:
             LOGGER.info('Target port %d using static ip', self.target_port)
-            time.sleep(self._STARTUP_MIN_TIME_SEC)
-            self.runner.ip_notify(MODE.NOPE, {
-                'mac': self.target_mac,
-                'ip': static_ip,
-                'delta': -1
-            }, self.gateway.port_set)
+            self.runner.schedule_timer(self._STARTUP_MIN_TIME_SEC,
+                                       functools.partial(self._static_ip_notify, static_ip),
+                                       name='static%02d' % self.target_port)
         else:
             dhcp_mode = self._get_dhcp_mode()
             # enables dhcp response for this device
@@ -294,17 +338,33 @@ class ConnectedHost:
             self.gateway.execute_script('change_dhcp_response_time', self.target_mac, wait_time)
         _ = [listener(self) for listener in self._dhcp_listeners]
 
+    def _static_ip_notify(self, static_ip):
+        if self.state != _STATE.WAITING:
+            LOGGER.info('Target port %d ignoring static ip in state %s',
+                        self.target_port, self.state)
+            return
+        self.runner.ip_notify(MODE.NOPE, {
+            'mac': self.target_mac,
+            'ip': static_ip,
+            'delta': -1
+        }, self.gateway.port_set)
+
     def _aux_module_timeout_handler(self):
         # clean up tcp monitor that could be open
         self._monitor_error(self._TIMEOUT_EXCEPTION, forget=True)
 
-    def _main_module_timeout_handler(self):
-        self.test_host.terminate()
-        self.test_host = None
-        self._docker_callback(exception=self._TIMEOUT_EXCEPTION)
+    def _module_timeout(self, run):
+        LOGGER.error('Monitoring timeout for %s after %ds',
+                     run.test_name, self._get_test_timeout(run.test_name))
+        run.test_host.terminate()
+        run.test_host = None
+        self._docker_callback(run, exception=self._TIMEOUT_EXCEPTION)
 
     def heartbeat(self):
         """Checks module run time for each event loop"""
+        if self._active_tests:
+            self._module_heartbeat()
+            return
         timeout_sec = self._get_test_timeout(self.test_name)
         if not timeout_sec or not self.test_start:
             return
@@ -317,6 +377,28 @@ class ConnectedHost:
                 handler, self.timeout_handler = self.timeout_handler, None
                 handler()
 
+    def _module_heartbeat(self):
+        nowtime = gcp.parse_timestamp(gcp.get_timestamp())
+        for run in list(self._active_tests.values()):
+            timeout_sec = self._get_test_timeout(run.test_name)
+            if not timeout_sec or not run.test_host:
+                continue
+            if nowtime >= gcp.parse_timestamp(run.start) + timedelta(seconds=timeout_sec):
+                self._module_timeout(run)
+
+    def _schedule_timeout(self):
+        """Schedule a heartbeat for exactly when the current test times out"""
+        if self._timeout_timer:
+            self._timeout_timer.cancel()
+            self._timeout_timer = None
+        if self._active_tests:
+            # Running modules each have their own timeout timer.
+            return
+        timeout_sec = self._get_test_timeout(self.test_name)
+        if timeout_sec and self.test_start:
+            self._timeout_timer = self.runner.schedule_timer(
+                timeout_sec, self.heartbeat, name='timeout%02d' % self.target_port)
+
     def register_dhcp_ready_listener(self, callback):
         """Registers callback for when the host is ready for activation"""
         assert callable(callback), "ip listener callback is not callable"
@@ -324,40 +406,83 @@ class ConnectedHost:
 
     def terminate(self, reason, trigger=True):
         """Terminate this host"""
+        running = [run.host_name for run in self._active_tests.values()]
         LOGGER.info('Target port %d terminate, running %s, trigger %s: %s', self.target_port,
-                    self._host_name(), trigger, reason)
+                    running or 'unknown', trigger, reason)
         self._release_config()
         self._state_transition(_STATE.TERM)
+        if self._timeout_timer:
+            self._timeout_timer.cancel()
+            self._timeout_timer = None
         self._monitor_cleanup()
         self.runner.network.delete_mirror_interface(self.target_port)
-        self._report.finalize()
-        json_path = self._report.path + ".json"
-        with open(json_path, 'w') as json_file:
-            json.dump(self._report.get_all_results(), json_file)
-        remote_paths = {}
-        remote_paths["report_path"] = self._upload_file(self._report.path)
-        remote_paths["json_path"] = self._upload_file(json_path)
-        if self._trigger_path:
-            remote_paths["trigger_path"] = self._upload_file(self._trigger_path)
-        self.record_result('terminate', state=MODE.TERM, **remote_paths)
-        if self.test_host:
+        self._finalize_report()
+        self.runner.module_scheduler.cancel(self.target_port)
+        self._discard_warm_modules()
+        for run in list(self._active_tests.values()):
             try:
-                self.test_host.terminate(expected=trigger)
-                self.test_host = None
+                self._module_cleanup(run)
+                if run.test_host:
+                    run.test_host.terminate(expected=trigger)
+                    run.test_host = None
             except Exception as e:
                 LOGGER.error('Target port %d terminating test: %s', self.target_port, e)
                 LOGGER.exception(e)
         if trigger:
             self.runner.target_set_complete(self.target_port,
                                             'Target port %d termination: %s' % (
-                                                self.target_port, self.test_host))
+                                                self.target_port, running or None))
+
+    def _finalize_report(self):
+        self._report.finalize()
+        json_path = self._report.path + ".json"
+        with open(json_path, 'w') as json_file:
+            json.dump(self._report.get_all_results(), json_file)
+        if self._report_pdf == 'on':
+            self.runner.render_report(report.render_pdf, *self._report.get_pdf_args(),
+                                      callback=self._pdf_rendered)
+        elif self._report_pdf == 'lazy':
+            LOGGER.info('Target port %d pdf report on demand with bin/report_pdf %s',
+                        self.target_port, self._report.path)
+        upload_paths = {"report_path": self._report.path, "json_path": json_path}
+        if self._trigger_path:
+            upload_paths["trigger_path"] = self._trigger_path
+        terminated = gcp.get_timestamp()
+        self.runner.run_in_executor(self._upload_files, upload_paths,
+                                    callback=functools.partial(self._reports_uploaded,
+                                                               terminated))
+
+    def _upload_files(self, upload_paths):
+        return {key: self._upload_file(path) for key, path in upload_paths.items()}
+
+    def _pdf_rendered(self, result, exception):
+        if exception:
+            LOGGER.error('Target port %d pdf report failed: %s', self.target_port, exception)
+        else:
+            LOGGER.info('Target port %d pdf report %s', self.target_port, result)
+
+    def _reports_uploaded(self, terminated, result, exception):
+        if exception:
+            LOGGER.error('Target port %d report upload failed: %s', self.target_port, exception)
+        if self.runner.port_targets.get(self.target_port, self) is not self:
+            LOGGER.warning('Target port %d reused, dropping terminate result %s',
+                           self.target_port, result)
+            return
+        self._record_result('terminate', current=terminated, state=MODE.TERM,
+                            started=terminated, **(result or {}))
 
     def idle_handler(self):
         """Trigger events from idle state"""
         if self.state == _STATE.INIT:
+            if self.runner.network.settle_remaining():
+                LOGGER.debug('Target port %d waiting for network to settle', self.target_port)
+                return
             self._prepare()
         elif self.state == _STATE.BASE:
             self._base_start()
+        elif self.state in (_STATE.NEXT, _STATE.TESTING) and self.remaining_tests:
+            # Modules may be waiting for a free test port or concurrency slot.
+            self._run_next_test()
 
     def ip_notify(self, target_ip, state=MODE.DONE, delta_sec=-1):
         """Handle completion of ip subtask"""
@@ -399,12 +524,6 @@ class ConnectedHost:
             self._state_transition(_STATE.BASE, _STATE.WAITING)
         return True
 
-    def _ping_test(self, src, dst, src_addr=None):
-        if not src or not dst:
-            LOGGER.error('Invalid ping test params, src=%s, dst=%s', src, dst)
-            return False
-        return self.runner.ping_test(src, dst, src_addr=src_addr)
-
     def _startup_scan(self):
         self._startup_file = os.path.join(self.scan_base, 'startup.pcap')
         self._startup_time = datetime.now()
@@ -428,15 +547,10 @@ class ConnectedHost:
                                    hangup=functools.partial(self._monitor_timeout, timeout))
 
     def _base_start(self):
+        if self._base_pending:
+            return
         try:
-            success = self._base_tests()
-            self._monitor_cleanup()
-            if not success:
-                LOGGER.warning('Target port %d base tests failed', self.target_port)
-                self._state_transition(_STATE.ERROR)
-                return
-            LOGGER.info('Target port %d done with base.', self.target_port)
-            self._background_scan()
+            self._base_tests()
         except Exception as e:
             self._monitor_cleanup()
             self._monitor_error(e)
@@ -470,6 +584,7 @@ class ConnectedHost:
         LOGGER.info('Target port %d background pcap for %ds',
                     self.target_port, self._monitor_scan_sec)
         self._monitor_scan(monitor_file, timeout=self._monitor_scan_sec)
+        self._warm_modules()
 
     def _monitor_timeout(self, timeout):
         duration = datetime.now() - self._monitor_start
@@ -490,29 +605,67 @@ class ConnectedHost:
 
     def _base_tests(self):
         self.record_result('base', state=MODE.EXEC)
-        if not self._ping_test(self.gateway.host, self.target_ip):
-            LOGGER.debug('Target port %d warmup ping failed', self.target_port)
         try:
-            success1 = self._ping_test(self.gateway.host, self.target_ip), 'simple ping failed'
-            success2 = self._ping_test(self.gateway.host, self.target_ip,
-                                       src_addr=self.fake_target), 'target ping failed'
-            if not success1 or not success2:
-                return False
+            # Both pings run at once, and retry until the first reply to cover warmup.
+            self.runner.ping_tests([(self.gateway.host, self.target_ip, None),
+                                    (self.gateway.host, self.target_ip, self.fake_target)],
+                                   self._base_complete)
+            self._base_pending = True
         except Exception as e:
             self.record_result('base', exception=e)
             self._monitor_cleanup()
             raise
+
+    def _base_complete(self, result, exception):
+        self._base_pending = False
+        if self.state != _STATE.BASE:
+            LOGGER.info('Target port %d base pings done in state %s', self.target_port, self.state)
+            return
+        if exception:
+            self.record_result('base', exception=exception)
+            self._monitor_cleanup()
+            self._monitor_error(exception)
+            return
+        if not all(result):
+            # Not fatal, since some devices don't answer pings from the fake target.
+            LOGGER.warning('Target port %d base pings failed: %s', self.target_port, result)
         self.record_result('base', state=MODE.DONE)
-        return True
+        self._monitor_cleanup()
+        LOGGER.info('Target port %d done with base.', self.target_port)
+        try:
+            self._background_scan()
+        except Exception as e:
+            self._monitor_error(e)
+
+    def _can_start_test(self, test_name):
+        if not self._active_tests:
+            return True
+        if len(self._active_tests) >= self._module_parallelism:
+            return False
+        if self._test_exclusive(test_name):
+            return False
+        return not any(run.exclusive for run in self._active_tests.values())
 
     def _run_next_test(self):
+        scheduler = self.runner.module_scheduler
         try:
-            if self.remaining_tests:
-                LOGGER.debug('Target port %d executing tests %s',
-                             self.target_port, self.remaining_tests)
-                self.timeout_handler = self._main_module_timeout_handler
-                self._docker_test(self.remaining_tests.pop(0))
-            else:
+            while self.remaining_tests and self._can_start_test(self.remaining_tests[0]):
+                if scheduler.is_pending(self.target_port):
+                    # Deferred earlier, so offer it again from its original queue position.
+                    scheduler.dispatch()
+                    if scheduler.is_pending(self.target_port):
+                        break
+                    continue
+                test_name = self.remaining_tests[0]
+                hints = self._loaded_config['modules'].get(test_name, {})
+                scheduler.request(self.target_port, test_name, self._scheduled_test, hints)
+                if self.remaining_tests and self.remaining_tests[0] == test_name:
+                    # Waiting on the scheduler or a test port, idle_handler will retry.
+                    break
+            if self.state not in (_STATE.NEXT, _STATE.TESTING):
+                return
+            self._warm_modules()
+            if not self.remaining_tests and not self._active_tests:
                 self.timeout_handler = self._aux_module_timeout_handler
                 LOGGER.info('Target port %d no more tests remaining', self.target_port)
                 self._state_transition(_STATE.DONE, _STATE.NEXT)
@@ -532,10 +685,83 @@ class ConnectedHost:
             os.makedirs(path)
         return path
 
-    def _docker_test(self, test_name):
-        self.test_name = test_name
-        self.test_start = gcp.get_timestamp()
-        self._state_transition(_STATE.TESTING, _STATE.NEXT)
+    def _scheduled_test(self, test_name):
+        if self.state not in (_STATE.NEXT, _STATE.TESTING) or not self.remaining_tests:
+            return False
+        if self.remaining_tests[0] != test_name:
+            return False
+        image_outcome = self._check_test_image(test_name)
+        if image_outcome is not None:
+            return image_outcome
+        test_host = self._warm_tests.pop(test_name, None)
+        test_port = test_host.port if test_host else self.gateway.allocate_test_port()
+        if not test_port:
+            LOGGER.debug('Target port %d waiting for a test port', self.target_port)
+            return ModuleScheduler.DEFER
+        LOGGER.debug('Target port %d executing tests %s', self.target_port, self.remaining_tests)
+        # Running modules are timed out individually, not through the aux handler.
+        self.timeout_handler = None
+        try:
+            self._docker_test(self.remaining_tests.pop(0), test_port, test_host)
+        except Exception as e:
+            LOGGER.error('Target port %d start error: %s', self.target_port, e)
+            self._state_transition(_STATE.ERROR)
+            self.runner.target_set_error(self.target_port, e)
+            return False
+        return True
+
+    def _check_test_image(self, test_name):
+        """Return the scheduling outcome if the test image isn't ready, or None if it is"""
+        image_status = self._get_image_status(test_name)
+        if image_status == ImageManager.PENDING:
+            LOGGER.debug('Target port %d waiting for %s image', self.target_port, test_name)
+            return ModuleScheduler.DEFER
+        if image_status == ImageManager.MISSING:
+            self.remaining_tests.pop(0)
+            LOGGER.error('Target port %d skipping %s, image not available',
+                         self.target_port, test_name)
+            self.record_result(test_name, state=MODE.MERR,
+                               exception=Exception('test image not available'))
+            return False
+        return None
+
+    def _warm_modules(self):
+        """Create and attach containers for upcoming modules, so they start faster"""
+        for test_name in self.remaining_tests[:self._warm_count]:
+            if test_name in self._warm_tests or test_name in self._warm_failed:
+                continue
+            if self._get_image_status(test_name) not in (ImageManager.READY, None):
+                continue
+            test_port = self.gateway.allocate_test_port()
+            if not test_port:
+                return
+            test_host = docker_test.DockerTest(self.runner, self.target_port, self.devdir,
+                                               test_name)
+            try:
+                test_host.prepare(test_port, self._module_params(test_port))
+            except Exception as e:
+                # Not retried, since this runs every idle pass; the test creates its own.
+                LOGGER.warning('Target port %d warm %s failed: %s', self.target_port, test_name, e)
+                self._warm_failed.add(test_name)
+                self.gateway.release_test_port(test_port)
+                return
+            self._warm_tests[test_name] = test_host
+
+    def _get_image_status(self, test_name):
+        image = docker_test.DockerTest.IMAGE_NAME_FORMAT % test_name
+        return self.runner.image_manager.get_status(image)
+
+    def _discard_warm_modules(self):
+        for test_host in self._warm_tests.values():
+            try:
+                test_host.discard()
+                self.gateway.release_test_port(test_host.port)
+            except Exception as e:
+                LOGGER.error('Target port %d discarding %s: %s',
+                             self.target_port, test_host.host_name, e)
+        self._warm_tests = {}
+
+    def _module_params(self, test_port):
         params = {
             'target_ip': self.target_ip,
             'target_mac': self.target_mac,
@@ -547,72 +773,130 @@ class ConnectedHost:
             'type_base': self._type_aux_path(),
             'scan_base': self.scan_base
         }
-        self.test_host = docker_test.DockerTest(self.runner, self.target_port, self.devdir,
-                                                test_name)
-        self.test_port = self.runner.allocate_test_port(self.target_port)
         if 'ext_loip' in self.config:
             ext_loip = self.config['ext_loip'].replace('@', '%d')
-            params['local_ip'] = ext_loip % self.test_port
+            params['local_ip'] = ext_loip % test_port
             params['switch_ip'] = self.config['ext_addr']
             params['switch_port'] = str(self.target_port)
             params['switch_model'] = self.config['switch_model']
+        return params
+
+    def _docker_test(self, test_name, test_port, test_host=None):
+        run = _ModuleRun(test_name, test_port, self._test_exclusive(test_name))
+        self._active_tests[test_name] = run
+        self.test_name = test_name
+        self.test_start = run.start
+        self._schedule_timeout()
+        timeout_sec = self._get_test_timeout(test_name)
+        if timeout_sec:
+            run.timeout_timer = self.runner.schedule_timer(
+                timeout_sec, self.heartbeat, name='timeout%02d-%s' % (self.target_port, test_name))
+        if self.state != _STATE.TESTING:
+            self._state_transition(_STATE.TESTING, _STATE.NEXT)
+        params = self._module_params(test_port)
+        run.test_host = test_host or docker_test.DockerTest(self.runner, self.target_port,
+                                                            self.devdir, test_name)
+        run.host_name = run.test_host.host_name
 
         try:
-            LOGGER.debug('test_host start %s/%s', test_name, self._host_name())
-            self._set_module_config(self._loaded_config)
+            LOGGER.debug('test_host start %s/%s', test_name, run.host_name)
+            self._set_module_config(run, self._loaded_config)
             self.record_result(test_name, state=MODE.EXEC)
-            self._monitor_scan(os.path.join(self.scan_base, 'test_%s.pcap' % test_name))
-            self.test_host.start(self.test_port, params, self._docker_callback, self._finish_hook)
+            self._module_scan(run)
+            run.test_host.start(test_port, params, functools.partial(self._docker_callback, run),
+                                functools.partial(self._finish_hook, run))
         except:
-            self.test_host = None
+            run.test_host = None
+            self._module_cleanup(run)
             raise
 
-    def _host_name(self):
-        return self.test_host.host_name if self.test_host else 'unknown'
-
-    def _host_dir_path(self):
-        return os.path.join(self.devdir, 'nodes', self._host_name())
-
-    def _host_tmp_path(self):
-        return os.path.join(self._host_dir_path(), 'tmp')
+    def _module_scan(self, run):
+        output_file = os.path.join(self.scan_base, 'test_%s.pcap' % run.test_name)
+        LOGGER.info('Target port %d pcap intf %s for %s output in %s',
+                    self.target_port, self._mirror_intf_name, run.test_name, output_file)
+        helper = tcpdump_helper.TcpdumpHelper(self.runner.network.pri, '', packets=None,
+                                              intf_name=self._mirror_intf_name,
+                                              timeout=None, pcap_out=output_file,
+                                              blocking=False)
+        run.monitor_ref = helper
+        hangup = functools.partial(self._module_scan_error, run, Exception('tcpdump pcap hangup'))
+        self.runner.monitor_stream('tcpdump', helper.stream(), helper.next_line,
+                                   error=functools.partial(self._module_scan_error, run),
+                                   hangup=hangup)
+
+    def _module_scan_error(self, run, exception):
+        LOGGER.error('Target port %d %s monitor error: %s',
+                     self.target_port, run.test_name, exception)
+        self._module_scan_cleanup(run)
+        self.record_result(run.test_name, exception=exception)
+        self._state_transition(_STATE.ERROR)
+        self.runner.target_set_error(self.target_port, exception)
 
-    def _finish_hook(self):
+    def _module_scan_cleanup(self, run):
+        if run.monitor_ref:
+            stream = run.monitor_ref.stream()
+            if stream and not stream.closed:
+                self.runner.monitor_forget(stream)
+                run.monitor_ref.terminate()
+            run.monitor_ref = None
+
+    def _module_cleanup(self, run):
+        """Release everything held by a module run, other than its docker host"""
+        self._active_tests.pop(run.test_name, None)
+        if run.timeout_timer:
+            run.timeout_timer.cancel()
+            run.timeout_timer = None
+        self._module_scan_cleanup(run)
+        if run.test_port:
+            self.gateway.release_test_port(run.test_port)
+            run.test_port = None
+        self.runner.module_scheduler.release(self.target_port, run.test_name)
+
+    def _host_dir_path(self, run):
+        return os.path.join(self.devdir, 'nodes', run.host_name)
+
+    def _host_tmp_path(self, run):
+        return os.path.join(self._host_dir_path(run), 'tmp')
+
+    def _finish_hook(self, run):
         if self._finish_hook_script:
-            finish_dir = os.path.join(self.devdir, 'finish', self._host_name())
+            finish_dir = os.path.join(self.devdir, 'finish', run.host_name)
             shutil.rmtree(finish_dir, ignore_errors=True)
             os.makedirs(finish_dir)
             LOGGER.warning('Executing finish_hook: %s %s', self._finish_hook_script, finish_dir)
             os.system('%s %s 2>&1 > %s/finish.out' %
                       (self._finish_hook_script, finish_dir, finish_dir))
 
-    def _docker_callback(self, return_code=None, exception=None):
-        self.timeout_handler = None # cancel timeout handling
-        host_name = self._host_name()
+    def _docker_callback(self, run, return_code=None, exception=None):
         LOGGER.info('Host callback %s/%s was %s with %s',
-                    self.test_name, host_name, return_code, exception)
-        self._monitor_cleanup()
+                    run.test_name, run.host_name, return_code, exception)
         failed = return_code or exception
         state = MODE.MERR if failed else MODE.DONE
-        report_path = os.path.join(self._host_tmp_path(), 'report.txt')
-        activation_log_path = os.path.join(self._host_dir_path(), 'activate.log')
-        module_config_path = os.path.join(self._host_tmp_path(), self._MODULE_CONFIG)
+        report_path = os.path.join(self._host_tmp_path(run), 'report.txt')
+        activation_log_path = os.path.join(self._host_dir_path(run), 'activate.log')
+        module_config_path = os.path.join(self._host_tmp_path(run), self._MODULE_CONFIG)
         remote_paths = {}
         for result_type, path in ((ResultType.REPORT_PATH, report_path),
                                   (ResultType.ACTIVATION_LOG_PATH, activation_log_path),
                                   (ResultType.MODULE_CONFIG_PATH, module_config_path)):
             if os.path.isfile(path):
-                self._report.accumulate(self.test_name, {result_type: path})
+                self._report.accumulate(run.test_name, {result_type: path})
                 remote_paths[result_type.value] = self._upload_file(path)
-        self.record_result(self.test_name, state=state, code=return_code, exception=exception,
+        self.record_result(run.test_name, state=state, code=return_code, exception=exception,
                            **remote_paths)
-        self.runner.release_test_port(self.target_port, self.test_port)
-        self._state_transition(_STATE.NEXT, _STATE.TESTING)
+        self._module_cleanup(run)
+        if self.state != _STATE.TESTING:
+            LOGGER.info('Target port %d not continuing tests in state %s',
+                        self.target_port, self.state)
+            return
+        if not self._active_tests:
+            self._state_transition(_STATE.NEXT, _STATE.TESTING)
         self._run_next_test()
 
-    def _set_module_config(self, loaded_config):
-        tmp_dir = self._host_tmp_path()
+    def _set_module_config(self, run, loaded_config):
+        tmp_dir = self._host_tmp_path(run)
         configurator.write_config(tmp_dir, self._MODULE_CONFIG, loaded_config)
-        self._record_result(self.test_name, config=self._loaded_config, state=MODE.CONF)
+        self._record_result(run.test_name, config=self._loaded_config, state=MODE.CONF)
 
     def _merge_run_info(self, config):
         config['run_info'] = {
@@ -638,7 +922,9 @@ class ConnectedHost:
             LOGGER.debug('Target port %d report %s start %s',
                          self.target_port, name, current)
             self.test_name = name
-            self.test_start = current
+            run = self._active_tests.get(name)
+            self.test_start = run.start if run else current
+            self._schedule_timeout()
         if name:
             self._record_result(name, current, **kwargs)
             if kwargs.get("exception"):
@@ -25,15 +25,24 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
     # pylint: disable=invalid-name
     def do_GET(self):
         """Handle a basic http request get method"""
-        self.send_response(200)
-        self.end_headers()
         parsed = urllib.parse.urlparse(self.path)
         path = parsed.path[1:]
         opts = {}
         opt_pairs = urllib.parse.parse_qsl(parsed.query)
         for pair in opt_pairs:
             opts[pair[0]] = pair[1]
+        etag = self._context.get_etag(path, opts)
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
         message = str(self._context.get_data(path, opts))
+        self.send_response(200)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
         self.wfile.write(message.encode())
 
 
@@ -43,6 +52,7 @@ class HttpServer():
     def __init__(self, config):
         self._config = config
         self._paths = {}
+        self._etags = {}
         self._server = None
 
     def start_server(self):
@@ -56,9 +66,19 @@ class HttpServer():
         thread.deamon = False
         thread.start()
 
-    def map_request(self, path, target):
-        """Register a request mapping"""
+    def map_request(self, path, target, etag=None):
+        """Register a request mapping, with optional function giving the current etag"""
         self._paths[path] = target
+        if etag:
+            self._etags[path] = etag
+
+    def get_etag(self, path, opts):
+        """Get the current etag for a particular path, if it has one"""
+        try:
+            return self._etags[path](opts) if path in self._etags else None
+        except Exception as e:
+            LOGGER.error('Handling etag %s: %s', path, str(e))
+            return None
 
     def get_data(self, path, opts):
         """Get data for a particular path"""
@@ -0,0 +1,204 @@
+"""Checks, pulls and tracks the docker images needed for a test run"""
+
+import concurrent.futures
+import json
+import os
+import subprocess
+import threading
+import time
+
+import logger
+
+LOGGER = logger.get_logger('images')
+
+
+class ImageManager:
+    """Resolves docker images in the background and keeps an index of their digests"""
+
+    READY = 'ready'
+    PENDING = 'pending'
+    MISSING = 'missing'
+
+    _DEFAULT_INDEX = 'inst/image_index.json'
+    _VERSION_FILE = 'misc/docker_images.ver'
+    _MAX_WORKERS = 8
+    _INDEX_TTL_SEC = 3600
+    _LIST_RETRIES = 3
+    _LIST_RETRY_SEC = 2
+
+    def __init__(self, config):
+        self._index_path = config.get('image_index', self._DEFAULT_INDEX)
+        self._pull = config.get('image_pull', False)
+        self._workers = int(config.get('image_workers', self._MAX_WORKERS))
+        self._index_ttl = float(config.get('image_index_ttl_sec', self._INDEX_TTL_SEC))
+        self._lock = threading.Lock()
+        self._status = {}
+        self._index = self._load_index()
+        self._thread = None
+        self._notify = None
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path) as index_file:
+                return json.load(index_file)
+        except Exception as e:
+            LOGGER.warning('Ignoring bad image index %s: %s', self._index_path, e)
+            return {}
+
+    def _save_index(self):
+        index_dir = os.path.dirname(self._index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        tmp_path = self._index_path + '.tmp'
+        with self._lock:
+            index = dict(self._index)
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._index_path)
+
+    def start(self, images, notify=None):
+        """Start resolving the given images in the background. If given, notify is called
+        from the resolving thread whenever some image status may have changed."""
+        images = sorted(set(images))
+        self._notify = notify or self._notify
+        with self._lock:
+            for image in images:
+                self._status.setdefault(image, self.PENDING)
+        # Chained behind any earlier resolution, so wait() covers them all.
+        self._thread = threading.Thread(target=self._resolve, args=(images, self._thread),
+                                        name='images', daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for all images to be resolved, returning True if done"""
+        if self._thread:
+            self._thread.join(timeout)
+        return not self._thread or not self._thread.is_alive()
+
+    def get_status(self, image):
+        """Get the readiness of an image, or None if it isn't tracked"""
+        with self._lock:
+            return self._status.get(image)
+
+    def get_digest(self, image):
+        """Get the last known digest of an image"""
+        entry = self._index.get(image)
+        return entry and entry['id']
+
+    def invalidate(self, image):
+        """Drop the index entry for an image that failed to run, and check it again"""
+        with self._lock:
+            if self._status.get(image) != self.READY:
+                return
+            LOGGER.warning('Image %s failed to run, checking it again', image)
+            self._status[image] = self.PENDING
+            self._index.pop(image, None)
+        self.start([image])
+
+    def _resolve(self, images, previous=None):
+        if previous:
+            previous.join()
+        start = time.time()
+        try:
+            unchecked = [image for image in images if not self._check_index(image)]
+            if unchecked:
+                self._resolve_unchecked(unchecked)
+                self._save_index()
+        except Exception as e:
+            LOGGER.error('Image resolution failed: %s', e)
+            LOGGER.exception(e)
+        finally:
+            with self._lock:
+                for image in images:
+                    if self._status.get(image) == self.PENDING:
+                        self._status[image] = self.MISSING
+            self._notify_changed()
+        missing = [image for image in images if self.get_status(image) == self.MISSING]
+        LOGGER.info('Resolved %d images in %.1fs, missing %s',
+                    len(images), time.time() - start, missing or 'none')
+
+    def _check_index(self, image):
+        """Mark an image ready if the index has a recent enough check for it"""
+        entry = self._index.get(image)
+        checked = entry.get('checked', 0) if entry else 0
+        if not self._index_ttl or time.time() - checked > self._index_ttl:
+            return False
+        with self._lock:
+            self._status[image] = self.READY
+        return True
+
+    def _resolve_unchecked(self, images):
+        local = self._list_images()
+        if local is None:
+            # Fall back to checking images one by one, which handles failures per image.
+            local = {}
+        missing = [image for image in images if image not in local]
+        for image in images:
+            if image in local:
+                self._set_ready(image, local[image])
+        if missing:
+            LOGGER.info('Resolving %d missing images: %s', len(missing), ', '.join(missing))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for image, digest in zip(missing, executor.map(self._fetch_image, missing)):
+                    self._set_ready(image, digest)
+
+    def _set_ready(self, image, digest):
+        previous = self.get_digest(image)
+        if previous and digest and previous != digest:
+            LOGGER.info('Image %s changed from %s to %s', image, previous, digest)
+        with self._lock:
+            self._status[image] = self.READY if digest else self.MISSING
+            if digest:
+                self._index[image] = {'id': digest, 'checked': time.time()}
+        self._notify_changed()
+
+    def _notify_changed(self):
+        if self._notify:
+            self._notify()
+
+    def _list_images(self):
+        """List local images and their digests, or None if docker couldn't list them"""
+        for attempt in range(self._LIST_RETRIES):
+            if attempt:
+                time.sleep(self._LIST_RETRY_SEC)
+            try:
+                output = self._docker('images', '--no-trunc', '--format',
+                                      '{{.Repository}} {{.Tag}} {{.ID}}')
+            except (OSError, subprocess.CalledProcessError) as e:
+                LOGGER.warning('Listing images failed (attempt %d): %s', attempt + 1, e)
+                continue
+            images = {}
+            for line in output.splitlines():
+                repository, tag, digest = line.split()
+                if tag == 'latest':
+                    images[repository] = digest
+            return images
+        return None
+
+    def _fetch_image(self, image):
+        try:
+            return self._docker('image', 'inspect', '--format', '{{.Id}}', image).strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+        if not self._pull:
+            LOGGER.warning('Image %s not found, and image_pull not enabled', image)
+            return None
+        version = self._get_version()
+        LOGGER.info('Pulling image %s:%s', image, version)
+        try:
+            self._docker('pull', '%s:%s' % (image, version))
+            self._docker('tag', '%s:%s' % (image, version), image)
+            return self._docker('image', 'inspect', '--format', '{{.Id}}', image).strip()
+        except subprocess.CalledProcessError as e:
+            LOGGER.error('Could not pull image %s:%s: %s', image, version, e)
+            return None
+
+    def _get_version(self):
+        with open(self._VERSION_FILE) as version_file:
+            return version_file.read().strip()
+
+    def _docker(self, *args):
+        return subprocess.run(('docker',) + args, check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True).stdout
@@ -1,8 +1,11 @@
 """Networking module"""
 
+import contextlib
 import os
+import time
 
 import logger
+from faucet_config import FaucetConfigWriter
 from topology import FaucetTopology
 
 from mininet import node as mininet_node
@@ -50,7 +53,15 @@ class TestNetwork:
         self.ext_ofpt = int(config.get('ext_ofpt', self.DEFAULT_OF_PORT))
         self.switch_links = {}
         self.topology = FaucetTopology(self.config)
+        self.port_sets = self.topology.port_sets
         self.faucitizer = faucetizer.Faucetizer(None, None)
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self._dirty_since = None
+        self._reload_window_sec = float(config.get('faucet_reload_window_sec', 0))
+        self._config_writer = FaucetConfigWriter(self.OUTPUT_FAUCET_FILE,
+                                                 self._render_faucet_config)
+        self._config_written = None
 
     # pylint: disable=too-many-arguments
     def add_host(self, name, cls=DAQHost, ip_addr=None, env_vars=None, vol_maps=None,
@@ -166,8 +177,7 @@ class TestNetwork:
         self.topology.start()
 
         LOGGER.info("Initializing faucitizer...")
-        self.faucitizer.process_faucet_config(self.topology.get_network_topology())
-        faucetizer.write_behavioral_config(self.faucitizer, self.OUTPUT_FAUCET_FILE)
+        self._write_faucet_config()
 
         target_ip = "127.0.0.1"
         LOGGER.debug("Adding controller at %s", target_ip)
@@ -189,9 +199,70 @@ class TestNetwork:
         dest = target['port_set'] if target else None
         LOGGER.info('Directing traffic for %s on port %s to %s', target_mac, port, dest)
         # TODO: Convert this to use faucitizer to change vlan
-        self.topology.direct_port_traffic(target_mac, port, target)
-        self.faucitizer.process_faucet_config(self.topology.get_network_topology())
-        faucetizer.write_behavioral_config(self.faucitizer, self.OUTPUT_FAUCET_FILE)
+        if not self.topology.direct_port_traffic(target_mac, port, target):
+            return
+        if self._batch_depth or self._reload_window_sec:
+            if not self._batch_dirty:
+                self._batch_dirty = True
+                self._dirty_since = time.monotonic()
+        else:
+            self._update_faucet_config()
+
+    @contextlib.contextmanager
+    def batch_updates(self):
+        """Defer faucet config updates until the end of a batch of port changes"""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty and not self._reload_window_sec:
+                self.flush_updates()
+
+    def get_reload_window(self):
+        """Return the time to collect port traffic changes before applying them, if any"""
+        return self._reload_window_sec
+
+    def has_pending_updates(self):
+        """Check if there are port traffic changes waiting to be applied"""
+        return self._batch_dirty
+
+    def flush_updates(self):
+        """Apply any pending port traffic changes"""
+        if self._batch_dirty:
+            self._batch_dirty = False
+            self._dirty_since = None
+            LOGGER.info('Applying batched port traffic changes')
+            self._update_faucet_config()
+
+    def _update_faucet_config(self):
+        acls_changed = self.topology.update_acls()
+        if self._write_faucet_config() or acls_changed:
+            self._config_written = time.monotonic()
+
+    def _write_faucet_config(self):
+        return self._config_writer.write(self.topology.get_network_topology())
+
+    def _render_faucet_config(self, network_topology, filename):
+        self.faucitizer.process_faucet_config(network_topology)
+        faucetizer.write_behavioral_config(self.faucitizer, filename)
+
+    def config_applied(self):
+        """Note that faucet applied a config change, returning seconds since the last update
+        was written, or None if it was already accounted for"""
+        if self._config_written is None:
+            return None
+        latency = time.monotonic() - self._config_written
+        self._config_written = None
+        return latency
+
+    def settle_remaining(self):
+        """Return the time remaining until the network has settled from the last change"""
+        if self._batch_dirty and not self._batch_depth:
+            # Waiting on the reload window, so not even started settling yet.
+            window_remaining = self._reload_window_sec - (time.monotonic() - self._dirty_since)
+            return max(0, window_remaining, self.topology.settle_remaining())
+        return self.topology.settle_remaining()
 
     def _attach_switch_interface(self, switch_intf_name):
         switch_port = self.topology.switch_port()
@@ -0,0 +1,98 @@
+"""Allocation and address layout of gateway port sets"""
+
+import heapq
+import ipaddress
+
+import logger
+
+LOGGER = logger.get_logger('portsets')
+
+
+class PortSetAllocator:
+    """Allocates port sets from a free-list, and maps them to switch ports, vlans and test ips"""
+
+    SET_PORTS = 6
+    _DEFAULT_SET_SPACING = 10
+    _DEFAULT_MIRROR_BASE = 1000
+    _DEFAULT_VLAN_BASE = 1000
+    _DEFAULT_TEST_IP_BASE = '192.168.84.0'
+    _MAX_VLAN = 4094
+
+    def __init__(self, config, num_sets, set_ports):
+        self.num_sets = num_sets
+        self._set_ports = set_ports
+        self._set_spacing = int(config.get('port_set_spacing', self._DEFAULT_SET_SPACING))
+        self._port_base = int(config.get('port_set_base', 0))
+        self._vlan_base = int(config.get('vlan_base', self._DEFAULT_VLAN_BASE))
+        self._test_ip_base = ipaddress.ip_address(
+            config.get('test_ip_base', self._DEFAULT_TEST_IP_BASE))
+        assert self._set_spacing >= set_ports, (
+            'port_set_spacing %d less than %d set ports' % (self._set_spacing, set_ports))
+        assert self._vlan_base + num_sets <= self._MAX_VLAN, 'vlan_base too high for port sets'
+        gw_end = self.set_base_port(num_sets) + set_ports
+        self._mirror_base = int(config.get('mirror_port_base', self._default_mirror_base(gw_end)))
+        mirror_end = self._mirror_base + num_sets
+        assert self._mirror_base >= gw_end or mirror_end < self.set_base_port(1), (
+            'mirror_port_base %d overlaps gateway ports' % self._mirror_base)
+        self._free = list(range(1, num_sets + 1))
+        self._queued = set(self._free)
+        self._allocated = set()
+        LOGGER.info('Configured %d port sets, gateway ports %d-%d, mirror base %d, vlan base %d',
+                    num_sets, self.set_base_port(1), gw_end - 1, self._mirror_base,
+                    self._vlan_base)
+
+    def _default_mirror_base(self, gw_end):
+        if gw_end <= self._DEFAULT_MIRROR_BASE:
+            return self._DEFAULT_MIRROR_BASE
+        return (gw_end // self._DEFAULT_MIRROR_BASE + 1) * self._DEFAULT_MIRROR_BASE
+
+    def allocate(self, preferred=None):
+        """Allocate a port set, using the preferred one if available, or None if none left"""
+        if preferred and 0 < preferred <= self.num_sets and preferred not in self._allocated:
+            # The free-list entry is left behind, and skipped when it comes up.
+            self._allocated.add(preferred)
+            return preferred
+        while self._free:
+            port_set = heapq.heappop(self._free)
+            self._queued.remove(port_set)
+            if port_set not in self._allocated:
+                self._allocated.add(port_set)
+                return port_set
+        return None
+
+    def release(self, port_set):
+        """Return a port set to the free-list"""
+        assert port_set in self._allocated, 'port set %s not allocated' % port_set
+        self._allocated.remove(port_set)
+        if port_set not in self._queued:
+            self._queued.add(port_set)
+            heapq.heappush(self._free, port_set)
+
+    def port_sets(self):
+        """Return all the port sets that could be allocated"""
+        return range(1, self.num_sets + 1)
+
+    def set_base_port(self, port_set):
+        """First switch port of the given port set"""
+        return self._port_base + port_set * self._set_spacing
+
+    def set_port_list(self, port_set):
+        """All the switch ports of the given port set"""
+        base_port = self.set_base_port(port_set)
+        return list(range(base_port, base_port + self._set_ports))
+
+    def mirror_port(self, input_port):
+        """Switch port to use for mirroring the given device port"""
+        return self._mirror_base + input_port
+
+    def switch_port(self):
+        """Switch port to use for the local switch connection"""
+        return self._mirror_base
+
+    def vlan(self, port_set=None):
+        """Vlan for the given port set, or the base vlan for unassigned ports"""
+        return self._vlan_base + (port_set if port_set else 0)
+
+    def test_ip(self, port_set):
+        """Fake test address used by the gateway of the given port set"""
+        return str(self._test_ip_base + port_set)
@@ -2,21 +2,63 @@
 
 import copy
 import datetime
+import functools
 import os
 import re
 import shutil
+import sys
 from enum import Enum
 
 import pytz
 import jinja2
 
-import pypandoc
+import markdown
 import weasyprint
 
 import logger
 
 LOGGER = logger.get_logger('report')
 
+_REPORT_CSS_PATH = 'misc/device_report.css'
+_MARKDOWN_EXTENSIONS = ['tables', 'fenced_code']
+PDF_MODES = ('on', 'off', 'lazy')
+
+
+def get_pdf_mode(config):
+    """Get the configured report_pdf mode, one of PDF_MODES"""
+    mode = config.get('report_pdf', 'on')
+    assert mode in PDF_MODES, 'Unknown report_pdf %s' % mode
+    return mode
+
+
+@functools.lru_cache(maxsize=None)
+def _get_renderers():
+    """Markdown converter and report stylesheet, created once per process"""
+    return markdown.Markdown(extensions=_MARKDOWN_EXTENSIONS), weasyprint.CSS(_REPORT_CSS_PATH)
+
+
+def render_pdf(md_path, pdf_path=None, alt_pdf_path=None):
+    """Convert a markdown report to html, then pdf, suitable for running in a worker process"""
+    pdf_path = pdf_path or os.path.splitext(md_path)[0] + '.pdf'
+    renderer, css = _get_renderers()
+    LOGGER.info('Rendering pdf report %s', pdf_path)
+    with open(md_path) as md_file:
+        html = renderer.reset().convert(md_file.read())
+    # Write to a temp file first, so a partial pdf is never visible at the final path.
+    tmp_path = pdf_path + '.tmp'
+    try:
+        weasyprint.HTML(string=html, base_url='.').write_pdf(tmp_path, stylesheets=[css])
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, pdf_path)
+    if alt_pdf_path:
+        LOGGER.info('Also copying report to %s', alt_pdf_path)
+        shutil.copyfile(pdf_path, alt_pdf_path)
+    return pdf_path
+
+
 class ResultType(Enum):
     """Enum for all test module info"""
     REPORT_PATH = "report_path"
@@ -30,8 +72,7 @@ class ReportGenerator:
     """Generate a report for device qualification"""
 
     _NAME_FORMAT = "report_%s_%s.%s"
-    _REPORT_CSS_PATH = 'misc/device_report.css'
-    _REPORT_TMP_HTML_PATH = 'inst/last_report_out.html'
+    _jinja_environment = None
     _SIMPLE_FORMAT = "device_report.%s"
     _TEST_SEPARATOR = "\n## %s\n"
     _TEST_SUBHEADER = "\n#### %s\n"
@@ -84,6 +125,7 @@ class ReportGenerator:
         else:
             LOGGER.info('Device report path %s not found', out_path)
             self._alt_path = None
+            self._alt_path_pdf = None
 
         self._all_results = None
         self._result_headers = list(self._module_config.get('report', {}).get('results', []))
@@ -112,29 +154,38 @@ class ReportGenerator:
             return
         LOGGER.info('Adding templated report header from %s', template_file)
         try:
-            undefined_logger = jinja2.make_logging_undefined(logger=LOGGER, base=jinja2.Undefined)
-            environment = jinja2.Environment(loader=jinja2.FileSystemLoader('.'),
-                                             undefined=undefined_logger)
+            environment = self._get_jinja_environment()
             self._writeln(environment.get_template(template_file).render(self._module_config))
         except Exception as e:
             self._writeln('Report generation error: %s' % e)
             self._writeln('Failing data model:\n%s' % str(self._module_config))
             LOGGER.error('Report generation failed: %s', e)
 
+    @classmethod
+    def _get_jinja_environment(cls):
+        # Shared so compiled templates are cached, but still reloaded if the file changes.
+        if not cls._jinja_environment:
+            undefined_logger = jinja2.make_logging_undefined(logger=LOGGER, base=jinja2.Undefined)
+            cls._jinja_environment = jinja2.Environment(loader=jinja2.FileSystemLoader('.'),
+                                                        undefined=undefined_logger,
+                                                        auto_reload=True)
+        return cls._jinja_environment
+
     def finalize(self):
-        """Finalize this report"""
+        """Finalize the markdown report, leaving the pdf to render_pdf with get_pdf_args"""
         LOGGER.info('Finalizing report %s', self._filename)
         self._module_config['clean_mac'] = self._clean_mac
         self._module_config['start_time'] = self._start_time
         self._module_config['end_time'] = datetime.datetime.now(pytz.utc).replace(microsecond=0)
         self._process_results()
         self._write_md_report()
-        self._write_pdf_report()
-        if self._alt_path and self._alt_path_pdf:
+        if self._alt_path:
             LOGGER.info('Copying report to %s', self._alt_path)
             shutil.copyfile(self.path, self._alt_path)
-            LOGGER.info('Also copying report to %s', self._alt_path_pdf)
-            shutil.copyfile(self.path_pdf, self._alt_path_pdf)
+
+    def get_pdf_args(self):
+        """Get the render_pdf arguments for this report"""
+        return self.path, self.path_pdf, self._alt_path_pdf
 
     def get_all_results(self):
         """Get all processed results"""
@@ -172,16 +223,6 @@ class ReportGenerator:
             self._writeln(self._TEST_SEPARATOR % self._REPORT_COMPLETE)
         self._file = None
 
-    def _write_pdf_report(self):
-        """Convert the markdown report to html, then pdf"""
-        LOGGER.info('Generating HTML for writing pdf report...')
-        pypandoc.convert_file(self.path, 'html',
-                              outputfile=self._REPORT_TMP_HTML_PATH,
-                              extra_args=['-V', 'geometry:margin=1.5cm', '--columns', '1000'])
-        LOGGER.info('Metamorphosising HTML to PDF...')
-        weasyprint.HTML(self._REPORT_TMP_HTML_PATH) \
-            .write_pdf(self.path_pdf, stylesheets=[weasyprint.CSS(self._REPORT_CSS_PATH)])
-
     def _write_table(self, items):
         stripped_items = map(str.strip, items)
         self._writeln(self._TABLE_MARK + self._TABLE_MARK.join(stripped_items) + self._TABLE_MARK)
@@ -315,3 +356,9 @@ class ReportGenerator:
         if test_name not in self._reports:
             self._reports[test_name] = dict()
         self._reports[test_name] = {**self._reports[test_name], **result_dict}
+
+
+if __name__ == '__main__':
+    logger.set_config(format='%(asctime)s %(levelname)-8s %(message)s', level='INFO')
+    for REPORT_PATH in sys.argv[1:]:
+        render_pdf(REPORT_PATH)
@@ -1,20 +1,28 @@
 """Main test runner for DAQ"""
 
+import concurrent.futures
 import copy
+import functools
+import logging
+import multiprocessing
 import os
 import re
-import threading
 import time
 import traceback
 import uuid
 
 import configurator
-import faucet_event_client
+import coordinator
+import docker_test
+import faucet_event_bus
 import gateway as gateway_manager
 import gcp
 import host as connected_host
+import image_manager
 import network
+import scheduler
 import stream_monitor
+from faucet_event_client import EventType
 from wrappers import DaqException
 import logger
 
@@ -26,11 +34,20 @@ class DAQRunner:
     faucet events, connected hosts (to test), and gcp for logging. This
     class owns the main event loop and shards out work to subclasses."""
 
-    MAX_GATEWAYS = 10
+    PING_DEADLINE_SEC = 10
+    _PING_INTERVAL_SEC = 0.2
+    _EVENT_ENGINES = {
+        'epoll': stream_monitor.StreamMonitor,
+        'asyncio': stream_monitor.AsyncStreamMonitor
+    }
     _MODULE_CONFIG = 'module_config.json'
     _RUNNER_CONFIG_PATH = 'runner/setup'
     _DEFAULT_TESTS_FILE = 'misc/host_tests.conf'
     _RESULT_LOG_FILE = 'inst/result.log'
+    _SYSTEM_SETTLE_SEC = 3
+    _COORDINATOR_HEARTBEAT_SEC = 10
+    _DEFAULT_REPORT_WORKERS = 2
+    _FINALIZE_WAIT_SEC = 120
 
     def __init__(self, config):
         self.config = config
@@ -41,10 +58,11 @@ class DAQRunner:
         self._active_ports = {}
         self._device_groups = {}
         self._gateway_sets = {}
+        self._idle_gateways = {}
+        self._gateway_linger_sec = int(config.get('gateway_linger_sec', 0))
         self._target_mac_ip = {}
-        self._callback_queue = []
-        self._callback_lock = threading.Lock()
-        self.gcp = gcp.GcpManager(self.config, self._queue_callback)
+        self.stream_monitor = self._make_stream_monitor()
+        self.gcp = gcp.GcpManager(self.config, self.stream_monitor.call_soon_threadsafe)
         self._base_config = self._load_base_config()
         self.description = config.get('site_description', '').strip('\"')
         self._daq_version = os.environ['DAQ_VERSION']
@@ -53,12 +71,12 @@ class DAQRunner:
         self.network = network.TestNetwork(config)
         self.result_linger = config.get('result_linger', False)
         self._linger_exit = 0
-        self.faucet_events = None
+        self._init_faucet_events(config)
         self.single_shot = config.get('single_shot', False)
         self.event_trigger = config.get('event_trigger', False)
         self.fail_mode = config.get('fail_mode', False)
         self.run_tests = True
-        self.stream_monitor = None
+        self._system_settled = False
         self.exception = None
         self.run_count = 0
         self.run_limit = int(config.get('run_limit', 0))
@@ -71,21 +89,58 @@ class DAQRunner:
         if logging_client:
             logger.set_stackdriver_client(logging_client,
                                           labels={"daq_run_id": str(self._daq_run_id)})
-        test_list = self._get_test_list(config.get('host_tests', self._DEFAULT_TESTS_FILE), [])
-        if self.config.get('keep_hold'):
-            LOGGER.info('Appending test_hold to master test list')
-            test_list.append('hold')
-        config['test_list'] = test_list
+        self._init_scheduling(config)
+        self._init_coordinator(config)
+        self._init_reports(config)
         LOGGER.info('DAQ RUN id: %s' % self._daq_run_id)
         LOGGER.info('Configured with tests %s' % ', '.join(config['test_list']))
         LOGGER.info('DAQ version %s' % self._daq_version)
         LOGGER.info('LSB release %s' % self._lsb_release)
         LOGGER.info('system uname %s' % self._sys_uname)
 
+    def _init_faucet_events(self, config):
+        self.faucet_events = None
+        self._faucet_queue = None
+        self._debounce_wakeup = None
+        self._reload_timer = None
+        self._faucet_handlers = {
+            EventType.PORT_STATE: self._port_state_event,
+            EventType.PORT_LEARN: self._port_learn_event,
+            EventType.CONFIG_CHANGE: self._config_change_event
+        }
+        self._event_batch = config.get('event_batch', False)
+
+    def _init_scheduling(self, config):
+        test_list = self._get_test_list(config.get('host_tests', self._DEFAULT_TESTS_FILE), [])
+        if config.get('keep_hold'):
+            LOGGER.info('Appending test_hold to master test list')
+            test_list.append('hold')
+        config['test_list'] = test_list
+        self.module_scheduler = scheduler.ModuleScheduler(config)
+        self.image_manager = image_manager.ImageManager(config)
+
+    def _init_coordinator(self, config):
+        self._coordinator = None
+        if config.get('coordinator_sock'):
+            self._coordinator = coordinator.CoordinatorClient(config)
+        self._unassigned_ports = {}
+
+    def _init_reports(self, config):
+        self._report_workers = int(config.get('report_workers', self._DEFAULT_REPORT_WORKERS))
+        self._report_pool = None
+
+    def _make_stream_monitor(self):
+        engine = self.config.get('event_engine', 'epoll')
+        assert engine in self._EVENT_ENGINES, 'Unknown event_engine %s' % engine
+        LOGGER.info('Using %s event engine', engine)
+        return self._EVENT_ENGINES[engine](idle_handler=self._handle_system_idle,
+                                           loop_hook=self._loop_hook,
+                                           timeout_sec=20)  # Max poll interval
+
     def _flush_faucet_events(self):
         LOGGER.info('Flushing faucet event queue...')
         if self.faucet_events:
-            while self.faucet_events.next_event():
+            while self._faucet_queue.next_event():
                 pass
 
     def _open_result_log(self):
@@ -120,17 +175,30 @@ class DAQRunner:
         self._send_heartbeat()
         self._publish_runner_config(self._base_config)
 
+        self.image_manager.start(self._get_test_images(), notify=self._images_changed)
         self.network.initialize()
 
         LOGGER.debug('Attaching event channel...')
-        self.faucet_events = faucet_event_client.FaucetEventClient(self.config)
+        self.faucet_events = faucet_event_bus.FaucetEventBus(self.config)
+        kinds = set(self._faucet_handlers)
+        self._faucet_queue = self.faucet_events.subscribe('runner', kinds=kinds)
         self.faucet_events.connect()
-
-        LOGGER.info('Waiting for system to settle...')
-        time.sleep(3)
+        if self.faucet_events.relay_sock:
+            self.monitor_stream('relay', self.faucet_events.relay_sock,
+                                self.faucet_events.service_relay)
+        if self._coordinator:
+            self._coordinator.connect()
+            self.monitor_stream('coordinator', self._coordinator.sock, self._handle_coordinator,
+                                hangup=lambda: self._coordinator_lost(forget=False))
+            self._coordinator_heartbeat()
 
         LOGGER.debug('Done with initialization')
 
+    def _get_test_images(self):
+        images = [docker_test.DockerTest.IMAGE_NAME_FORMAT % test
+                  for test in self.config['test_list']]
+        return images + [gateway_manager.Gateway.IMAGE_NAME]
+
     def cleanup(self):
         """Cleanup instance"""
         try:
@@ -141,6 +209,10 @@ class DAQRunner:
         if self.result_log:
             self.result_log.close()
             self.result_log = None
+        if self._report_pool:
+            self._report_pool.shutdown(wait=True)
+            self._report_pool = None
+        self.stream_monitor.close()
         LOGGER.info('Done with runner.')
 
     def add_host(self, *args, **kwargs):
@@ -156,20 +228,74 @@ class DAQRunner:
         return self.network.get_host_interface(host)
 
     def _handle_faucet_events(self):
-        while self.faucet_events:
-            event = self.faucet_events.next_event()
+        if self._event_batch:
+            self._handle_faucet_batch()
+        else:
+            self._handle_faucet_stream()
+        self._schedule_debounce_wakeup()
+
+    def _schedule_debounce_wakeup(self):
+        """Make sure the loop wakes up when the next debounced port event is due"""
+        wakeup = self._debounce_wakeup
+        if not self.faucet_events:
+            if wakeup:
+                wakeup.cancel()
+            return
+        timeout = self.faucet_events.next_timeout()
+        if timeout is None or not self._system_settled:
+            return
+        if wakeup and not wakeup.cancelled():
+            if wakeup.deadline <= time.monotonic() + timeout:
+                # An early wakeup just reschedules for the remaining time.
+                return
+            wakeup.cancel()
+        self._debounce_wakeup = self.schedule_timer(timeout, self._handle_faucet_events,
+                                                    name='debounce')
+
+    def _handle_faucet_stream(self):
+        while self.faucet_events and self._system_settled:
+            event = self._faucet_queue.next_event()
             if not event:
                 break
-            (dpid, port, active) = self.faucet_events.as_port_state(event)
-            if dpid and port:
-                LOGGER.debug('port_state: %s %s', dpid, port)
-                self._handle_port_state(dpid, port, active)
-            (dpid, port, target_mac) = self.faucet_events.as_port_learn(event)
-            if dpid and port:
-                self._handle_port_learn(dpid, port, target_mac)
-            (dpid, restart_type) = self.faucet_events.as_config_change(event)
-            if dpid is not None:
-                LOGGER.debug('dp_id %d restart %s', dpid, restart_type)
+            handler = self._faucet_handlers.get(event.kind)
+            if handler and event.dpid is not None:
+                handler(event)
+
+    def _port_state_event(self, event):
+        if event.port:
+            LOGGER.debug('port_state: %s %s', event.dpid, event.port)
+            self._handle_port_state(event.dpid, event.port, event.active)
+
+    def _port_learn_event(self, event):
+        if event.port:
+            self._handle_port_learn(event.dpid, event.port, event.mac)
+
+    def _config_change_event(self, event):
+        LOGGER.debug('dp_id %d restart %s', event.dpid, event.restart_type)
+        latency = self.network.config_applied()
+        if latency is not None:
+            LOGGER.info('Faucet config change applied %.3fs after update', latency)
+
+    def _handle_faucet_batch(self):
+        events = []
+        while self.faucet_events and self._system_settled:
+            event = self._faucet_queue.next_event()
+            if not event:
+                break
+            events.append(event)
+        if not events:
+            return
+        port_states, port_learns, others = faucet_event_bus.coalesce_port_events(events)
+        LOGGER.debug('Faucet batch of %d events, %d port states, %d learns',
+                     len(events), len(port_states), len(port_learns))
+        for event in others:
+            if event.kind == EventType.CONFIG_CHANGE:
+                self._config_change_event(event)
+        with self.network.batch_updates():
+            for event in port_states.values():
+                self._handle_port_state(event.dpid, event.port, event.active)
+            for event in port_learns.values():
+                self._handle_port_learn(event.dpid, event.port, event.mac)
 
     def _handle_port_state(self, dpid, port, active):
         if self.network.is_system_port(dpid, port):
@@ -179,6 +305,10 @@ class DAQRunner:
         if not self.network.is_device_port(dpid, port):
             LOGGER.debug('Unknown port %s on dpid %s is active %s', port, dpid, active)
             return
+        if not self._owns_port(dpid, port):
+            LOGGER.debug('Unassigned port %s on dpid %s is active %s', port, dpid, active)
+            self._unassigned_ports[(dpid, port)] = (active, None)
+            return
 
         if active != (port in self._active_ports):
             LOGGER.info('Port %s dpid %s is now active %s', port, dpid, active)
@@ -188,12 +318,15 @@ class DAQRunner:
             if not self._active_ports.get(port):
                 self._activate_port(port, True)
         else:
-            if port in self.port_targets:
-                self.target_set_complete(port, 'port not active')
-            if port in self._active_ports:
-                if self._active_ports[port] is not True:
-                    self._direct_port_traffic(self._active_ports[port], port, None)
-                self._activate_port(port, None)
+            self._deactivate_port(port, 'port not active')
+
+    def _deactivate_port(self, port, reason):
+        if port in self.port_targets:
+            self.target_set_complete(port, reason)
+        if port in self._active_ports:
+            if self._active_ports[port] is not True:
+                self._direct_port_traffic(self._active_ports[port], port, None)
+            self._activate_port(port, None)
 
     def _activate_port(self, port, state):
         if state:
@@ -203,28 +336,83 @@ class DAQRunner:
 
     def _direct_port_traffic(self, mac, port, target):
         self.network.direct_port_traffic(mac, port, target)
+        reload_window = self.network.get_reload_window()
+        if reload_window and self.network.has_pending_updates() and not self._reload_timer:
+            self._reload_timer = self.schedule_timer(reload_window, self._apply_network_updates,
+                                                     name='reload')
+        self._schedule_network_settle()
+
+    def _apply_network_updates(self):
+        self._reload_timer = None
+        self.network.flush_updates()
+        self._schedule_network_settle()
+
+    def _schedule_network_settle(self):
+        settle_sec = self.network.settle_remaining()
+        if settle_sec:
+            self.schedule_timer(settle_sec, self._network_settled, name='settle')
+
+    def _network_settled(self):
+        # Nothing to do directly, as hosts waiting on the network continue from the idle handler.
+        LOGGER.debug('Network settle time expired')
 
     def _handle_port_learn(self, dpid, port, target_mac):
-        if self.network.is_device_port(dpid, port):
+        if self.network.is_device_port(dpid, port) and not self._owns_port(dpid, port):
+            LOGGER.debug('Unassigned port %s dpid %s learned %s', port, dpid, target_mac)
+            self._unassigned_ports[(dpid, port)] = (True, target_mac)
+        elif self.network.is_device_port(dpid, port):
             LOGGER.info('Port %s dpid %s learned %s', port, dpid, target_mac)
             self._activate_port(port, target_mac)
             self._target_set_trigger(port)
         else:
             LOGGER.debug('Port %s dpid %s learned %s', port, dpid, target_mac)
 
-    def _queue_callback(self, callback):
-        with self._callback_lock:
-            LOGGER.debug('Register callback')
-            self._callback_queue.append(callback)
+    def _owns_port(self, dpid, port):
+        return not self._coordinator or self._coordinator.owns_port(dpid, port)
+
+    def _handle_coordinator(self):
+        previous = set(self._coordinator.ports)
+        if not self._coordinator.receive():
+            self._coordinator_lost()
+            return
+        for dpid, port in sorted(previous - self._coordinator.ports):
+            if not self.network.is_device_port(dpid, port):
+                continue
+            LOGGER.info('Port %s dpid %s reassigned by coordinator', port, dpid)
+            target_mac = self._active_ports.get(port)
+            if target_mac:
+                learned_mac = None if target_mac is True else target_mac
+                self._unassigned_ports[(dpid, port)] = (True, learned_mac)
+            self._deactivate_port(port, 'port reassigned')
+        for dpid, port in sorted(self._coordinator.ports - previous):
+            if (dpid, port) in self._unassigned_ports:
+                # Replay the last known state of newly assigned ports.
+                active, target_mac = self._unassigned_ports.pop((dpid, port))
+                self._handle_port_state(dpid, port, active)
+                if target_mac:
+                    self._handle_port_learn(dpid, port, target_mac)
+
+    def _coordinator_lost(self, forget=True):
+        # Keep testing the assigned ports, since another worker won't pick them up until
+        # the coordinator comes back and reassigns everything.
+        LOGGER.error('Lost connection to coordinator, keeping ports %s',
+                     sorted(self._coordinator.ports))
+        if forget:
+            self.monitor_forget(self._coordinator.sock)
+        self._coordinator.disconnect()
+
+    def _coordinator_heartbeat(self):
+        if not self._coordinator.sock:
+            return
+        dpid = int(self.network.sec_dpid)
+        states = {port: target.state for port, target in self.port_targets.items()}
+        self._coordinator.send_heartbeat([(dpid, port) for port in self.port_targets], states)
+        self.schedule_timer(self._COORDINATOR_HEARTBEAT_SEC, self._coordinator_heartbeat,
+                            name='coordinator')
 
-    def _handle_queued_events(self):
-        with self._callback_lock:
-            callbacks = self._callback_queue
-            self._callback_queue = []
-            if callbacks:
-                LOGGER.debug('Processing %d callbacks', len(callbacks))
-            for callback in callbacks:
-                callback()
+    def _images_changed(self):
+        # Called on the image thread, so wake the main loop to retry modules deferred on images.
+        self.stream_monitor.call_soon_threadsafe(self.module_scheduler.dispatch)
 
     def _handle_system_idle(self):
         # Some synthetic faucet events don't come in on the socket, so process them here.
@@ -260,18 +448,23 @@ class DAQRunner:
         ports = list(self._active_ports.keys())
         for port in ports:
             self._activate_port(port, False)
+        for gateway_set in list(self._idle_gateways):
+            self._retire_idle_gateway(gateway_set)
         self.monitor_forget(self.faucet_events.sock)
+        if self.faucet_events.relay_sock:
+            self.monitor_forget(self.faucet_events.relay_sock)
         self.faucet_events.disconnect()
         self.faucet_events = None
+        if self._coordinator and self._coordinator.sock:
+            self.monitor_forget(self._coordinator.sock)
+            self._coordinator.disconnect()
         count = self.stream_monitor.log_monitors(as_info=True)
         LOGGER.warning('No active ports remaining (%d monitors), ending test run.', count)
 
     def _loop_hook(self):
-        self._handle_queued_events()
-        states = {}
-        for key in self.port_targets:
-            states[key] = self.port_targets[key].state
-        LOGGER.debug('Active target sets/state: %s', states)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            states = {key: target.state for key, target in self.port_targets.items()}
+            LOGGER.debug('Active target sets/state: %s', states)
 
     def _terminate(self):
         target_set_keys = list(self.port_targets.keys())
@@ -287,17 +480,12 @@ class DAQRunner:
         """Run main loop to execute tests"""
 
         try:
-            monitor = stream_monitor.StreamMonitor(idle_handler=self._handle_system_idle,
-                                                   loop_hook=self._loop_hook,
-                                                   timeout_sec=20)  # Polling rate
-            self.stream_monitor = monitor
-            self.monitor_stream('faucet', self.faucet_events.sock, self._handle_faucet_events)
-            if self.event_trigger:
-                self._flush_faucet_events()
+            LOGGER.info('Waiting %ds for system to settle...', self._SYSTEM_SETTLE_SEC)
+            self.schedule_timer(self._SYSTEM_SETTLE_SEC, self._system_settle_complete,
+                                name='system')
             LOGGER.info('Entering main event loop.')
             LOGGER.info('See docs/troubleshooting.md if this blocks for more than a few minutes.')
-            while self.stream_monitor.event_loop():
-                self._module_heartbeat()
+            self.stream_monitor.run(self._module_heartbeat)
         except Exception as e:
             LOGGER.error('Event loop exception: %s', e)
             LOGGER.exception(e)
@@ -312,6 +500,15 @@ class DAQRunner:
             self.network.cli()
 
         self._terminate()
+        LOGGER.info('Waiting for report rendering and uploads...')
+        self.stream_monitor.drain(self._FINALIZE_WAIT_SEC)
+
+    def _system_settle_complete(self):
+        LOGGER.info('System settled, attaching faucet event stream')
+        self._system_settled = True
+        self.monitor_stream('faucet', self.faucet_events.sock, self._handle_faucet_events)
+        if self.event_trigger:
+            self._flush_faucet_events()
 
     def _target_set_trigger(self, target_port):
         assert target_port in self._active_ports, 'Target port %d not active' % target_port
@@ -402,22 +599,15 @@ class DAQRunner:
                 line = file.readline()
         return test_list
 
-    def allocate_test_port(self, target_port):
-        """Get the test port for the given target_port"""
-        gateway = self.port_gateways[target_port]
-        return gateway.allocate_test_port()
-
-    def release_test_port(self, target_port, test_port):
-        """Release the given test port"""
-        gateway = self.port_gateways[target_port]
-        return gateway.release_test_port(test_port)
-
     def _activate_device_group(self, group_name, target_port):
         if group_name in self._device_groups:
             existing = self._device_groups[group_name]
             LOGGER.debug('Gateway for existing device group %s is %s', group_name, existing.name)
             return existing
-        set_num = self._find_gateway_set(target_port)
+        idle_gateway = self._reuse_idle_gateway(group_name, target_port)
+        if idle_gateway:
+            return idle_gateway
+        set_num = self._allocate_gateway_set(target_port)
         LOGGER.info('Gateway for device group %s not found, initializing base %d...',
                     group_name, set_num)
         gateway = gateway_manager.Gateway(self, group_name, set_num, self.network)
@@ -431,9 +621,42 @@ class DAQRunner:
                          target_port, set_num, group_name)
             del self._gateway_sets[set_num]
             del self._device_groups[group_name]
+            self.network.port_sets.release(set_num)
             raise
         return gateway
 
+    def _reuse_idle_gateway(self, group_name, target_port):
+        if not self._idle_gateways:
+            return None
+        set_num = target_port if target_port in self._idle_gateways else min(self._idle_gateways)
+        gateway, timer = self._idle_gateways.pop(set_num)
+        timer.cancel()
+        LOGGER.info('Reusing idle gateway %d for device group %s', set_num, group_name)
+        try:
+            gateway.reset(group_name)
+        except Exception as e:
+            LOGGER.error('Could not reuse gateway %d: %s', set_num, e)
+            self.network.port_sets.release(set_num)
+            return None
+        self._gateway_sets[set_num] = group_name
+        self._device_groups[group_name] = gateway
+        return gateway
+
+    def _linger_gateway(self, gateway):
+        LOGGER.info('Gateway %d idle, lingering for %ds',
+                    gateway.port_set, self._gateway_linger_sec)
+        timer = self.schedule_timer(self._gateway_linger_sec,
+                                    functools.partial(self._retire_idle_gateway, gateway.port_set),
+                                    name='gw%02d' % gateway.port_set)
+        self._idle_gateways[gateway.port_set] = (gateway, timer)
+
+    def _retire_idle_gateway(self, gateway_set):
+        gateway, timer = self._idle_gateways.pop(gateway_set)
+        timer.cancel()
+        LOGGER.info('Retiring idle gateway %d', gateway_set)
+        gateway.terminate()
+        self.network.port_sets.release(gateway_set)
+
     def ip_notify(self, state, target, gateway_set, exception=None):
         """Handle a DHCP / Static IP notification"""
         if exception:
@@ -523,40 +746,73 @@ class DAQRunner:
         return gateway, ready_devices
 
     def _terminate_gateway_set(self, gateway_set):
+        if gateway_set in self._idle_gateways:
+            self._retire_idle_gateway(gateway_set)
+            return
         if gateway_set not in self._gateway_sets:
             LOGGER.warning('Gateway set %s not found in %s', gateway_set, self._gateway_sets)
             return
         group_name = self._gateway_sets[gateway_set]
         gateway = self._device_groups[group_name]
+        gateway.failed = True
         ports = [target['port'] for target in gateway.get_targets()]
         LOGGER.info('Terminating gateway group %s set %s, ports %s', group_name, gateway_set, ports)
         for target_port in ports:
             self.port_targets[target_port].terminate('_gateway_terminate')
             self.target_set_error(target_port, DaqException('terminated'))
 
-    def _find_gateway_set(self, target_port):
-        if target_port not in self._gateway_sets:
-            return target_port
-        for entry in range(1, self.MAX_GATEWAYS):
-            if entry not in self._gateway_sets:
-                return entry
-        raise Exception('Could not allocate open gateway set')
+    def gateway_error(self, gateway_set, exception):
+        """Handle an asynchronous failure of an initialized gateway"""
+        LOGGER.error('Gateway gw%02d failed: %s', gateway_set, exception)
+        self._terminate_gateway_set(gateway_set)
+
+    def _allocate_gateway_set(self, target_port):
+        # Idle gateways keep their port set allocated until they are retired.
+        gateway_set = self.network.port_sets.allocate(preferred=target_port)
+        if not gateway_set:
+            raise Exception('Could not allocate open gateway set')
+        return gateway_set
+
+    def ping_tests(self, checks, callback, deadline_sec=None):
+        """Start (src, dst, src_addr) ping checks all at once, calling callback(results, exception)
+        on the main loop once they finish. Each check probes until its first reply, so this
+        normally takes one round trip, and the main loop never waits on a failing check."""
+        deadline_sec = deadline_sec or self.PING_DEADLINE_SEC
+        procs = []
+        for src, dst, src_addr in checks:
+            dst_name = dst if isinstance(dst, str) else dst.name
+            dst_ip = dst if isinstance(dst, str) else dst.IP()
+            from_msg = ' from %s' % src_addr if src_addr else ''
+            LOGGER.info('Test ping %s->%s%s', src.name, dst_name, from_msg)
+            assert dst_ip != "0.0.0.0", "IP address not assigned, can't ping"
+            ping_opt = ['-I', src_addr] if src_addr else []
+            ping_cmd = ['ping', '-c1', '-i%s' % self._PING_INTERVAL_SEC, '-w%d' % deadline_sec]
+            try:
+                # Started here since mininet isn't thread safe, then only waited on elsewhere.
+                procs.append(src.popen(*(ping_cmd + ping_opt + [dst_ip])))
+            except Exception as e:
+                LOGGER.info('Test ping failure: %s', e)
+                procs.append(None)
+        self.run_in_executor(self._ping_results, procs, time.time(), deadline_sec + 1,
+                             callback=callback)
+
+    @classmethod
+    def _ping_results(cls, procs, start, wait_sec):
+        results = [cls._ping_result(proc, start + wait_sec) for proc in procs]
+        LOGGER.info('Test pings %s in %.3fs', results, time.time() - start)
+        return results
 
     @staticmethod
-    def ping_test(src, dst, src_addr=None):
-        """Test ping between hosts"""
-        dst_name = dst if isinstance(dst, str) else dst.name
-        dst_ip = dst if isinstance(dst, str) else dst.IP()
-        from_msg = ' from %s' % src_addr if src_addr else ''
-        LOGGER.info('Test ping %s->%s%s', src.name, dst_name, from_msg)
-        failure = "ping FAILED"
-        assert dst_ip != "0.0.0.0", "IP address not assigned, can't ping"
-        ping_opt = '-I %s' % src_addr if src_addr else ''
+    def _ping_result(proc, wait_until):
+        if not proc:
+            return False
         try:
-            output = src.cmd('ping -c2', ping_opt, dst_ip, '> /dev/null 2>&1 || echo ', failure)
-            return output.strip() != failure
+            proc.communicate(timeout=max(wait_until - time.time(), 0))
+            return proc.returncode == 0
         except Exception as e:
             LOGGER.info('Test ping failure: %s', e)
+            proc.kill()
+            proc.communicate()
             return False
 
     def target_set_error(self, target_port, exception):
@@ -590,6 +846,8 @@ class DAQRunner:
         if self.result_log:
             self.result_log.write('%02d: %s\n' % (target_port, results))
             self.result_log.flush()
+        if self._coordinator:
+            self._coordinator.send_result(int(self.network.sec_dpid), target_port, results)
 
         suppress_tests = self.fail_mode or self.result_linger
         if results and suppress_tests:
@@ -640,7 +898,12 @@ class DAQRunner:
             group_name = self.network.device_group_for(target_mac)
             del self._device_groups[group_name]
             del self._gateway_sets[target_gateway.port_set]
-            target_gateway.terminate()
+            reusable = not target_gateway.failed and not target_gateway.result_linger
+            if self._gateway_linger_sec and reusable and self.run_tests:
+                self._linger_gateway(target_gateway)
+            else:
+                target_gateway.terminate()
+                self.network.port_sets.release(target_gateway.port_set)
 
     def monitor_stream(self, *args, **kwargs):
         """Monitor a stream"""
@@ -650,6 +913,23 @@ class DAQRunner:
         """Forget monitoring a stream"""
         return self.stream_monitor.forget(stream)
 
+    def render_report(self, func, *args, callback=None):
+        """Run a cpu-bound report function in the bounded report process pool"""
+        if not self._report_pool:
+            # Spawn rather than fork, since forking a process with live threads isn't safe.
+            self._report_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._report_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.stream_monitor.run_in_executor(func, *args, callback=callback,
+                                                   executor=self._report_pool)
+
+    def schedule_timer(self, delay_sec, callback, name=None):
+        """Schedule a callback on the main event loop, returning a cancelable handle"""
+        return self.stream_monitor.schedule(delay_sec, callback, name=name)
+
+    def run_in_executor(self, func, *args, callback=None):
+        """Run a blocking (non-mininet) function off the main event loop thread"""
+        return self.stream_monitor.run_in_executor(func, *args, callback=callback)
+
     def _combine_results(self):
         results = []
         for result_set_key in self.result_sets:
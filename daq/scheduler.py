@@ -0,0 +1,149 @@
+"""Global scheduler for test module runs across all connected hosts"""
+
+import time
+
+import logger
+
+LOGGER = logger.get_logger('sched')
+
+
+class _ModuleRequest:
+    """A module run that is waiting for, or holding, scheduler resources"""
+    # pylint: disable=too-few-public-methods,too-many-arguments
+
+    def __init__(self, seq, target_port, test_name, callback, cpu, mem_mb, runtime_sec):
+        self.seq = seq
+        self.target_port = target_port
+        self.test_name = test_name
+        self.callback = callback
+        self.cpu = cpu
+        self.mem_mb = mem_mb
+        self.runtime_sec = runtime_sec
+        self.queued = time.time()
+        self.started = None
+        self.deferred = False
+
+
+class ModuleScheduler:
+    """Queues module runs from all hosts, and starts them within the configured budgets"""
+
+    POLICY_FAIR = 'fair'
+    POLICY_SJF = 'sjf'
+    DEFER = 'defer'
+    _DEFAULT_RUNTIME_SEC = 60
+    _RUNTIME_SMOOTHING = 0.3
+    _STARVATION_SEC = 300
+
+    def __init__(self, config):
+        self._max_modules = int(config.get('module_slots', 0))
+        self._cpu_budget = float(config.get('module_cpu_budget', 0))
+        self._mem_budget_mb = float(config.get('module_mem_budget_mb', 0))
+        self._policy = config.get('module_schedule', self.POLICY_FAIR)
+        assert self._policy in (self.POLICY_FAIR, self.POLICY_SJF), (
+            'Unknown module_schedule %s' % self._policy)
+        self._pending = []
+        self._running = {}
+        self._runtimes = {}
+        self._seq = 0
+
+    def request(self, target_port, test_name, callback, hints=None):
+        """Queue a module run, calling callback(test_name) when it may start. The callback
+        returns False if the run could not be started after all, releasing its resources,
+        or DEFER to keep its place in the queue until the next dispatch."""
+        hints = hints or {}
+        self._seq += 1
+        runtime_sec = self._runtimes.get(test_name, hints.get('runtime_sec',
+                                                              self._DEFAULT_RUNTIME_SEC))
+        request = _ModuleRequest(self._seq, target_port, test_name, callback,
+                                 float(hints.get('cpu', 1)), float(hints.get('mem_mb', 0)),
+                                 float(runtime_sec))
+        self._pending.append(request)
+        self.dispatch()
+
+    def release(self, target_port, test_name):
+        """Release the resources held by a finished module run"""
+        request = self._running.pop((target_port, test_name), None)
+        if not request:
+            return
+        runtime = time.time() - request.started
+        previous = self._runtimes.get(test_name)
+        if previous is None:
+            self._runtimes[test_name] = runtime
+        else:
+            smoothing = self._RUNTIME_SMOOTHING
+            self._runtimes[test_name] = smoothing * runtime + (1 - smoothing) * previous
+        self.dispatch()
+
+    def cancel(self, target_port):
+        """Drop all pending module runs for a target port"""
+        self._pending = [req for req in self._pending if req.target_port != target_port]
+
+    def is_pending(self, target_port):
+        """Check if the target port has a module run waiting to be scheduled"""
+        return any(req.target_port == target_port for req in self._pending)
+
+    def dispatch(self):
+        """Start as many pending module runs as the budgets allow, in policy order"""
+        for request in self._pending:
+            request.deferred = False
+        # Re-sorts after every start, since callbacks may queue or release other runs.
+        while self._dispatch_next():
+            pass
+
+    def _dispatch_next(self):
+        for request in sorted(self._pending, key=self._sort_key):
+            if request.deferred:
+                continue
+            if self._fits(request):
+                self._pending.remove(request)
+                self._start(request)
+                return True
+            if time.time() - request.queued > self._STARVATION_SEC:
+                # Don't let smaller runs keep backfilling ahead of a long-waiting one.
+                LOGGER.debug('Holding for starved module %s on port %d',
+                             request.test_name, request.target_port)
+                return False
+        return False
+
+    def _start(self, request):
+        running = len(self._running)
+        key = (request.target_port, request.test_name)
+        request.started = time.time()
+        self._running[key] = request
+        try:
+            started = request.callback(request.test_name)
+        except Exception:
+            self._running.pop(key, None)
+            raise
+        if started is self.DEFER:
+            self._running.pop(key, None)
+            request.deferred = True
+            self._pending.append(request)
+            LOGGER.debug('Deferred %s on port %d', request.test_name, request.target_port)
+        elif started is False:
+            self._running.pop(key, None)
+        else:
+            LOGGER.info('Scheduled %s on port %d after %.1fs, %d running',
+                        request.test_name, request.target_port,
+                        request.started - request.queued, running)
+
+    def _sort_key(self, request):
+        if self._policy == self.POLICY_SJF:
+            return (request.runtime_sec, request.seq)
+        port_running = sum(1 for req in self._running.values()
+                           if req.target_port == request.target_port)
+        return (port_running, request.seq)
+
+    def _fits(self, request):
+        if not self._running:
+            # Always let one run through, even if it is bigger than the whole budget.
+            return True
+        if self._max_modules and len(self._running) >= self._max_modules:
+            return False
+        used_cpu = sum(req.cpu for req in self._running.values())
+        if self._cpu_budget and used_cpu + request.cpu > self._cpu_budget:
+            return False
+        used_mem = sum(req.mem_mb for req in self._running.values())
+        if self._mem_budget_mb and used_mem + request.mem_mb > self._mem_budget_mb:
+            return False
+        return True
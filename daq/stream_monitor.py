@@ -1,22 +1,68 @@
 """Utility class to monitor a bunch of input streams and trigger events"""
 
+import asyncio
+import collections
+import concurrent.futures
 import fcntl
+import heapq
+import itertools
+import logging
 import os
 import select
+import threading
+import time
 
 import logger
 
 LOGGER = logger.get_logger('stream')
 
+
+class TimerHandle:
+    """Handle for a timer callback scheduled on a StreamMonitor"""
+
+    def __init__(self, deadline, callback, name):
+        self.deadline = deadline
+        self.name = name
+        self._callback = callback
+
+    def cancel(self):
+        """Cancel this timer, if it has not already fired"""
+        self._callback = None
+
+    def cancelled(self):
+        """Return True if this timer will no longer fire"""
+        return self._callback is None
+
+    def fire(self):
+        """Fire this timer callback, at most once"""
+        callback, self._callback = self._callback, None
+        if callback:
+            callback()
+
+
 class StreamMonitor:
     """Monitor set of stream objects"""
 
+    _POLL_MASK = select.EPOLLIN
+
     def __init__(self, timeout_sec=None, idle_handler=None, loop_hook=None):
         self.timeout_sec = timeout_sec
         self.idle_handler = idle_handler
         self.loop_hook = loop_hook
-        self.poller = select.poll()
+        self.poller = select.epoll()
         self.callbacks = {}
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._executor = None
+        self._futures = set()
+        self._pending_calls = collections.deque()
+        self._wakeup_lock = threading.Lock()
+        self._closed = False
+        self._idle_due = True
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self.poller.register(self._wakeup_read, self._POLL_MASK)
 
     def get_fd(self, target):
         """Return the fd from a stream object, or fd directly"""
@@ -34,9 +80,66 @@ class StreamMonitor:
             callback = lambda: self.copy_data(name, desc, copy_to)
         LOGGER.debug('Monitoring start %s fd %d', name, fd)
         self.callbacks[fd] = (name, callback, hangup, error, desc)
-        self.poller.register(fd, select.POLLHUP | select.POLLIN)
+        self.poller.register(fd, self._POLL_MASK)
         self.log_monitors()
 
+    def schedule(self, delay_sec, callback, name=None):
+        """Schedule a callback to run after the given delay, returning a cancelable handle"""
+        deadline = time.monotonic() + max(delay_sec, 0)
+        handle = TimerHandle(deadline, callback, name)
+        heapq.heappush(self._timers, (deadline, next(self._timer_seq), handle))
+        LOGGER.debug('Monitoring timer %s in %.3fs', name, delay_sec)
+        return handle
+
+    def call_soon_threadsafe(self, callback):
+        """Queue a callback from any thread to run on the event loop thread. Callbacks
+        queued after the monitor has been closed are dropped."""
+        with self._wakeup_lock:
+            if self._closed:
+                LOGGER.debug('Monitoring dropping callback queued after close')
+                return
+            self._pending_calls.append(callback)
+            try:
+                os.write(self._wakeup_write, b'\0')
+            except BlockingIOError:
+                pass  # Wakeup already pending.
+
+    def run_in_executor(self, func, *args, callback=None, executor=None):
+        """Run a blocking function on a worker thread (or the given executor), with
+        callback(result, exception) delivered back on the event loop thread"""
+        if not executor and not self._executor:
+            self._executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix='monitor')
+        future = (executor or self._executor).submit(func, *args)
+        if callback:
+            self._futures.add(future)
+            future.add_done_callback(
+                lambda done: self.call_soon_threadsafe(lambda: self._future_done(done, callback)))
+        return future
+
+    def drain(self, timeout_sec=None):
+        """Wait for outstanding executor work, running its callbacks on this thread.
+        Returns False if some work was still outstanding after timeout_sec."""
+        deadline = None if timeout_sec is None else time.monotonic() + timeout_sec
+        while True:
+            self._drain_wakeup()
+            self._run_pending_calls()
+            if not self._futures:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                LOGGER.warning('Monitoring abandoning %d executor tasks', len(self._futures))
+                return False
+            concurrent.futures.wait(list(self._futures), timeout=remaining,
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if any(future.done() for future in self._futures):
+                # Done callbacks are queued just after the future completes.
+                select.select([self._wakeup_read], [], [], remaining)
+
+    def _future_done(self, future, callback):
+        self._futures.discard(future)
+        exception = future.exception()
+        callback(result=None if exception else future.result(), exception=exception)
+
     def copy_data(self, name, data_source, data_sink):
         """Function to just copy data to a given sink"""
         LOGGER.debug('Monitoring copying data for %s from fd %d to fd %d',
@@ -57,20 +160,22 @@ class StreamMonitor:
         assert fd in self.callbacks, 'Missing descriptor fd %d' % fd
         LOGGER.debug('Monitoring forget fd %d', fd)
         del self.callbacks[fd]
-        self.poller.unregister(fd)
+        try:
+            self.poller.unregister(fd)
+        except (OSError, ValueError) as e:
+            # epoll drops descriptors automatically when they are closed.
+            LOGGER.debug('Monitoring unregister fd %d: %s', fd, e)
         self.log_monitors()
 
     def log_monitors(self, as_info=False):
         """Log all active monitors"""
-        log_str = ''
-        count = 0
-        for fd in self.callbacks:
-            name = self.callbacks[fd][0]
-            log_str = log_str + ', %s fd %d' % (name, fd)
-            count += 1
+        count = len(self.callbacks)
+        if not as_info and not LOGGER.isEnabledFor(logging.DEBUG):
+            return count
 
+        log_str = ', '.join('%s fd %d' % (self.callbacks[fd][0], fd) for fd in self.callbacks)
         log_func = LOGGER.info if as_info else LOGGER.debug
-        log_func('Monitoring %d fds %s', count, log_str[2:])
+        log_func('Monitoring %d fds %s', count, log_str)
 
         return count
 
@@ -96,9 +201,11 @@ class StreamMonitor:
         name = self.callbacks[fd][0]
         callback = self.callbacks[fd][2]
         on_error = self.callbacks[fd][3]
-        self.callbacks[fd][4].close()
+        desc = self.callbacks[fd][4]
         try:
+            # Forget before close, since a closed fd can't be removed from epoll.
             self.forget(fd)
+            desc.close()
             if callback:
                 LOGGER.debug('Monitoring hangup because %d (%s)', event, name)
                 callback()
@@ -124,34 +231,197 @@ class StreamMonitor:
 
     def process_poll_result(self, event, fd):
         """Process an individual poll result"""
-        if event & select.POLLNVAL:
-            assert False, 'POLLNVAL on fd %d' % fd
-        elif event & select.POLLIN:
+        if event & select.EPOLLIN:
             self.trigger_callback(fd)
-        elif event & (select.POLLHUP | select.POLLERR):
+        elif event & (select.EPOLLHUP | select.EPOLLERR):
             self.trigger_hangup(fd, event)
         else:
             assert False, "Unknown event type %d on fd %d" % (event, fd)
 
-    def event_loop(self):
-        """Main event loop. Returns True if there are active streams to monitor."""
-        fds = self.poller.poll(0)
+    def _next_timer(self):
+        """Return the next pending timer, discarding any cancelled ones"""
+        while self._timers and self._timers[0][2].cancelled():
+            heapq.heappop(self._timers)
+        return self._timers[0][2] if self._timers else None
+
+    def _poll_timeout(self):
+        timeout = self.timeout_sec
+        timer = self._next_timer()
+        if timer:
+            delay = max(timer.deadline - time.monotonic(), 0)
+            timeout = delay if timeout is None else min(timeout, delay)
+        return -1 if timeout is None else timeout
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_read, 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run_pending_calls(self):
+        while self._pending_calls:
+            callback = self._pending_calls.popleft()
+            try:
+                callback()
+            except Exception as e:
+                LOGGER.error('Monitoring queued callback exception: %s', e)
+                self.error_handler(e, 'queued', None)
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while True:
+            timer = self._next_timer()
+            if not timer or timer.deadline > now:
+                return
+            heapq.heappop(self._timers)
+            try:
+                LOGGER.debug('Monitoring timer %s fire', timer.name)
+                timer.fire()
+            except Exception as e:
+                LOGGER.error('Monitoring timer exception (%s): %s', timer.name, e)
+                self.error_handler(e, timer.name, None)
+
+    def is_active(self):
+        """Return True if there are active streams, pending timers, or pending callbacks"""
+        return bool(self.callbacks) or self._next_timer() is not None or bool(self._futures)
+
+    def _service(self):
+        """Run the idle and loop hooks, returning False if nothing is left to monitor"""
         try:
-            if not fds and self.idle_handler:
+            if self.idle_handler:
                 self.idle_handler()
                 # Check corner case when idle_handler removes all callbacks.
-                if not self.callbacks:
+                if not self.is_active():
                     return False
             if self.loop_hook:
                 self.loop_hook()
         except Exception as e:
             LOGGER.error('Monitoring exception in callback: %s', e)
             LOGGER.exception(e)
-        self.log_monitors()
-        fds = self.poller.poll(self.timeout_sec * 10e3 if self.timeout_sec else None)
+        return True
+
+    def _dispatch(self, fds):
         LOGGER.debug('Monitoring found fds %s', fds)
-        if fds:
-            for fd, event in fds:
-                if fd in self.callbacks: # Monitoring set could be modified
-                    self.process_poll_result(event, fd)
-        return len(self.callbacks) > 0
+        for fd, event in fds:
+            if fd == self._wakeup_read:
+                self._drain_wakeup()
+            elif fd in self.callbacks: # Monitoring set could be modified
+                self.process_poll_result(event, fd)
+        self._run_pending_calls()
+        self._run_timers()
+
+    def event_loop(self):
+        """Main event loop. Returns True if there are active streams or timers to monitor.
+        Idle work runs only once a poll finds nothing ready, so after each burst of activity
+        (checked without blocking) and whenever the blocking poll times out."""
+        fds = self.poller.poll(0 if self._idle_due else self._poll_timeout())
+        self._dispatch(fds)
+        self._idle_due = bool(fds)
+        if not fds and not self._service():
+            return False
+        return self.is_active()
+
+    def run(self, loop_callback=None):
+        """Run the event loop until there is nothing left to monitor"""
+        while self.event_loop():
+            if loop_callback:
+                loop_callback()
+
+    def close(self):
+        """Release all resources held by this monitor"""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._wakeup_lock:
+            self._closed = True
+            self._pending_calls.clear()
+            self.poller.close()
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+
+
+class AsyncStreamMonitor(StreamMonitor):
+    """Stream monitor that runs all stream, timer, and thread callbacks on one asyncio loop.
+    The underlying epoll set is itself watched by the loop, so stream semantics (including
+    hangup detection) are the same as for the base class."""
+
+    def __init__(self, timeout_sec=None, idle_handler=None, loop_hook=None):
+        super().__init__(timeout_sec=timeout_sec, idle_handler=idle_handler,
+                         loop_hook=loop_hook)
+        self._loop = asyncio.new_event_loop()
+        self._loop.add_reader(self.poller.fileno(), self._dispatch_ready)
+        self._activity = None
+
+    def _dispatch_ready(self):
+        self._dispatch(self.poller.poll(0))
+        self._notify()
+
+    def _dispatch_timers(self):
+        self._run_timers()
+        self._notify()
+
+    def _notify(self):
+        if self._activity:
+            self._activity.set()
+
+    def schedule(self, delay_sec, callback, name=None):
+        handle = super().schedule(delay_sec, callback, name=name)
+        self._loop.call_at(handle.deadline, self._dispatch_timers)
+        return handle
+
+    def run_in_executor(self, func, *args, callback=None, executor=None):
+        future = self._loop.run_in_executor(executor, func, *args)
+        if callback:
+            self._futures.add(future)
+            future.add_done_callback(lambda done: self._future_done(done, callback))
+            future.add_done_callback(lambda done: self._notify())
+        return future
+
+    def drain(self, timeout_sec=None):
+        self._run_pending_calls()
+        pending = set(self._futures)
+        if pending:
+            _, pending = self._loop.run_until_complete(asyncio.wait(pending, timeout=timeout_sec))
+            # Let the done callbacks queued by the completed futures run.
+            self._loop.run_until_complete(asyncio.sleep(0))
+        self._drain_wakeup()
+        self._run_pending_calls()
+        if pending:
+            LOGGER.warning('Monitoring abandoning %d executor tasks', len(pending))
+        return not pending
+
+    def event_loop(self):
+        """Run a single pass of the asyncio loop."""
+        return self._loop.run_until_complete(self._main(once=True))
+
+    def run(self, loop_callback=None):
+        self._loop.run_until_complete(self._main(loop_callback=loop_callback))
+
+    async def _main(self, loop_callback=None, once=False):
+        self._activity = asyncio.Event()
+        while True:
+            if self._idle_due:
+                # Let any ready readers and timers run, without blocking.
+                await asyncio.sleep(0)
+            else:
+                try:
+                    await asyncio.wait_for(self._activity.wait(), self.timeout_sec)
+                except asyncio.TimeoutError:
+                    pass
+            self._idle_due = self._activity.is_set()
+            self._activity.clear()
+            if not self._idle_due and not self._service():
+                return False
+            if once or not self.is_active():
+                return self.is_active()
+            if loop_callback:
+                loop_callback()
+
+    def close(self):
+        self._loop.remove_reader(self.poller.fileno())
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        if hasattr(self._loop, 'shutdown_default_executor'):
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+        self._loop.close()
+        super().close()
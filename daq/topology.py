@@ -1,22 +1,86 @@
 """Faucet-specific topology module"""
 
 import copy
+import hashlib
 import os
 import time
 import yaml
 
-from gateway import Gateway
+from port_sets import PortSetAllocator
 
 import logger
 
 LOGGER = logger.get_logger('topology')
 
+
+class _AclTemplate:
+    """ACL template compiled from its file, with placeholder fields indexed"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, template_acl, device_type, mtime):
+        self.mtime = mtime
+        # An empty template file is kept (for its mtime), but treated as no template.
+        self.empty = not template_acl
+        acls = template_acl['acls'] if template_acl else {}
+        from_acls = acls.get(FaucetTopology.FROM_ACL_KEY_FORMAT % device_type)
+        self.from_rules = None if from_acls is None else [
+            self._compile_from(acl) for acl in from_acls]
+        self.to_rules = {}
+        for acl in acls.get(FaucetTopology.TO_ACL_KEY_FORMAT % device_type, []):
+            nw_src = acl['rule'].get('nw_src')
+            if nw_src and nw_src.startswith(FaucetTopology.CTL_PREFIX):
+                controller = nw_src[len(FaucetTopology.CTL_PREFIX):]
+                self.to_rules.setdefault(controller, []).append(acl['rule'])
+
+    @staticmethod
+    def _compile_from(acl):
+        """Return the acl with fixed placeholders resolved, if dl_src is the device mac,
+        and the original nw_dst"""
+        acl = copy.deepcopy(acl)
+        rule = acl['rule']
+        dl_src = rule.get('dl_src')
+        mac_src = bool(dl_src and dl_src.startswith(FaucetTopology.MAC_PREFIX))
+        if dl_src and not mac_src and dl_src.startswith(FaucetTopology.PLACEHOLDER_PREFIXES):
+            del rule['dl_src']
+        nw_dst = rule.get('nw_dst')
+        if nw_dst and nw_dst.startswith(FaucetTopology.MAC_PREFIX):
+            rule['nw_dst'] = None
+        elif nw_dst and nw_dst.startswith(FaucetTopology.PLACEHOLDER_PREFIXES):
+            del rule['nw_dst']
+        return acl, mac_src, nw_dst
+
+
+class _DeviceSpecIndex:
+    """Lookup indexes over the device_specs macAddrs map"""
+
+    def __init__(self, device_specs):
+        self._group_members = {}
+        self._controlees = {}
+        for target_mac, device_info in device_specs['macAddrs'].items():
+            if 'group' in device_info:
+                self._group_members.setdefault(device_info['group'], []).append(target_mac)
+            for controller, controller_info in device_info.get('controllers', {}).items():
+                middle = controller_info['controlees']
+                if controller in middle:
+                    self._controlees[(target_mac, controller)] = list(
+                        middle[controller]['mac_addrs'])
+
+    def group_members(self, group_name):
+        """Return the macs of all devices in the given group"""
+        return self._group_members.get(group_name, [])
+
+    def controlees(self, target_mac, controller):
+        """Return the macs controlled by the device for the given controller, if any"""
+        return self._controlees.get((target_mac, controller))
+
+
 class FaucetTopology:
     """Topology manager specific to FAUCET configs"""
 
     MAC_PREFIX = "@mac:"
     DNS_PREFIX = "@dns:"
     CTL_PREFIX = "@ctrl:"
+    PLACEHOLDER_PREFIXES = (DNS_PREFIX, CTL_PREFIX)
     INST_FILE_PREFIX = "inst/"
     BROADCAST_MAC = "ff:ff:ff:ff:ff:ff"
     IPV4_DL_TYPE = "0x0800"
@@ -32,12 +96,10 @@ class FaucetTopology:
     PORTSET_ACL_FORMAT = "dp_%s_portset_%d_acl"
     LOCAL_ACL_FORMAT = "dp_%s_local_acl"
     _MIRROR_IFACE_FORMAT = "mirror-%d"
-    _MIRROR_PORT_BASE = 1000
-    _SWITCH_LOCAL_PORT = _MIRROR_PORT_BASE
-    _VLAN_BASE = 1000
     _NETWORK_SETTLE_SEC = 5
     PRI_STACK_PORT = 1
     _NO_VLAN = "0x0000/0x1000"
+    MIRROR_MODES = ('pair', 'group')
 
     def __init__(self, config):
         self.config = config
@@ -46,10 +108,28 @@ class FaucetTopology:
         self.sec_port = int(config.get('sec_port', "7"), 0)
         self.sec_name = 'sec'
         self.sec_dpid = int(config.get('ext_dpid', "2"), 0)
+        self._event_source = config.get('event_relay_source')
         self._settle_sec = int(config.get('settle_sec', self._NETWORK_SETTLE_SEC))
+        self._settle_deadline = 0
+        self._mirror_mode = config.get('mirror_mode', 'pair')
+        assert self._mirror_mode in self.MIRROR_MODES, 'Unknown mirror_mode %s' % self._mirror_mode
         self._device_specs = self._load_device_specs()
+        self._spec_index = _DeviceSpecIndex(self._device_specs) if self._device_specs else None
         self._port_targets = {}
+        self._mac_ports = {}
+        self._set_targets = {}
+        self.port_sets = PortSetAllocator(config, self.sec_port - 1, PortSetAllocator.SET_PORTS)
         self.topology = None
+        self._dirty_ports = set(range(1, self.sec_port))
+        self._dirty_port_sets = set(self.port_sets.port_sets())
+        self._mac_dependents = {}
+        self._portset_acls = {}
+        self._incoming_rules = {}
+        self._file_hashes = {}
+        self._acls_changed = False
+        self._acl_templates = {}
+        self._port_templates = {}
+        self._template_usage = None
 
     def initialize(self, pri):
         """Initialize this topology"""
@@ -61,6 +141,10 @@ class FaucetTopology:
 
     def start(self):
         """Start this instance"""
+        if self._event_source:
+            LOGGER.info("Using faucet events relayed on %s, not starting faucet",
+                        self._event_source)
+            return
         LOGGER.info("Starting faucet...")
         output = self.pri.cmd('cmd/faucet && echo SUCCESS')
         if not output.strip().endswith('SUCCESS'):
@@ -69,6 +153,8 @@ class FaucetTopology:
 
     def stop(self):
         """Stop this instance"""
+        if self._event_source:
+            return
         LOGGER.debug("Stopping faucet...")
         self.pri.cmd('docker kill daq-faucet')
 
@@ -103,21 +189,48 @@ class FaucetTopology:
         return device_intfs
 
     def direct_port_traffic(self, target_mac, port_no, target):
-        """Direct traffic from a port to specified port set"""
+        """Direct traffic from a port to specified port set. Returns True if anything changed,
+        in which case update_acls() needs to be called to apply the change."""
         if target is None and port_no in self._port_targets:
-            del self._port_targets[port_no]
+            old_target = self._port_targets.pop(port_no)
+            del self._set_targets[old_target['port_set']][port_no]
+            if self._mac_ports.get(old_target['mac']) == port_no:
+                del self._mac_ports[old_target['mac']]
+            self._mark_dirty(port_no, old_target)
         elif target is not None and port_no not in self._port_targets:
             self._port_targets[port_no] = target
+            self._set_targets.setdefault(target['port_set'], {})[port_no] = target
+            self._mac_ports[target['mac']] = port_no
+            self._mark_dirty(port_no, target)
         else:
             assert self._port_targets[port_no] == target
             LOGGER.debug('Ignoring no-change in port status for %s', port_no)
-            return
-        self._generate_acls()
+            return False
         port_set = target['port_set'] if target else None
         self._update_port_vlan(port_no, port_set)
+        return True
+
+    def _mark_dirty(self, port_no, target):
+        self._dirty_ports.add(port_no)
+        self._dirty_port_sets.add(target['port_set'])
+        # Other devices' ACLs that allow traffic to this one (by controller) change too.
+        for dependent_mac in self._mac_dependents.get(target['mac'], ()):
+            if dependent_mac in self._mac_ports:
+                self._dirty_ports.add(self._mac_ports[dependent_mac])
+
+    def update_acls(self):
+        """Regenerate ACLs to reflect changes in port traffic direction, returning True if
+        any ACL file changed"""
+        self._acls_changed = False
+        self._generate_acls()
         if self._settle_sec:
-            LOGGER.info('Waiting %ds for network to settle', self._settle_sec)
-            time.sleep(self._settle_sec)
+            LOGGER.info('Allowing %ds for network to settle', self._settle_sec)
+            self._settle_deadline = time.monotonic() + self._settle_sec
+        return self._acls_changed
+
+    def settle_remaining(self):
+        """Return the time remaining until the network has settled from the last change"""
+        return max(self._settle_deadline - time.monotonic(), 0)
 
     def _ensure_entry(self, root, key, value):
         if key not in root:
@@ -138,11 +251,11 @@ class FaucetTopology:
 
     def mirror_port(self, input_port):
         """Network port to use for mirroring interface"""
-        return self._MIRROR_PORT_BASE + input_port
+        return self.port_sets.mirror_port(input_port)
 
     def switch_port(self):
         """Network port to use for local switch connection"""
-        return self._SWITCH_LOCAL_PORT
+        return self.port_sets.switch_port()
 
     def _make_mirror_interface(self, input_port):
         interface = {}
@@ -153,7 +266,7 @@ class FaucetTopology:
     def _make_switch_interface(self):
         interface = {}
         interface['name'] = 'local_switch'
-        interface['native_vlan'] = self._VLAN_BASE
+        interface['native_vlan'] = self.port_sets.vlan()
         interface['acl_in'] = self.LOCAL_ACL_FORMAT % (self.pri_name)
         return interface
 
@@ -168,7 +281,7 @@ class FaucetTopology:
         interface['native_vlan'] = self._port_set_vlan(port_set)
 
     def _port_set_vlan(self, port_set=None):
-        return self._VLAN_BASE + (port_set if port_set else 0)
+        return self.port_sets.vlan(port_set)
 
     def _make_pri_stack_interface(self):
         interface = {}
@@ -199,12 +312,12 @@ class FaucetTopology:
     def _make_pri_interfaces(self):
         interfaces = {}
         interfaces[self.PRI_STACK_PORT] = self._make_pri_stack_interface()
-        for port_set in range(1, self.sec_port):
+        for port_set in self.port_sets.port_sets():
             for port in self._get_gw_ports(port_set):
                 interfaces[port] = self._make_gw_interface(port_set)
             mirror_port = self.mirror_port(port_set)
             interfaces[mirror_port] = self._make_mirror_interface(port_set)
-        interfaces[self._SWITCH_LOCAL_PORT] = self._make_switch_interface()
+        interfaces[self.switch_port()] = self._make_switch_interface()
         return interfaces
 
     def _make_sec_interfaces(self):
@@ -259,90 +372,90 @@ class FaucetTopology:
         return copy.deepcopy(self.topology)
 
     def _generate_acls(self):
+        self._refresh_acl_templates()
         self._generate_main_acls()
         self._generate_port_acls()
 
     def _get_gw_ports(self, port_set):
-        base_port = Gateway.SET_SPACING * port_set
-        end_port = base_port + Gateway.NUM_SET_PORTS
-        return list(range(base_port, end_port))
+        return self.port_sets.set_port_list(port_set)
 
     def _get_bcast_ports(self, port_set):
-        return [1, self._SWITCH_LOCAL_PORT] + self._get_gw_ports(port_set)
-
-    def _generate_switch_local_acls(self, portset_acls, local_acl):
-        local_net_dst = self.config.get('ext_ofip')
+        return [1, self.switch_port()] + self._get_gw_ports(port_set)
 
+    def _make_local_acl(self):
+        local_acl = []
         all_ports = []
-        if local_net_dst:
-            for port_set in range(1, self.sec_port):
-                self._add_acl_rule(portset_acls[port_set], ports=[self._SWITCH_LOCAL_PORT],
-                                   ipv4_dst=local_net_dst, dl_type=self.IPV4_DL_TYPE)
+        if self.config.get('ext_ofip'):
+            for port_set in self.port_sets.port_sets():
                 all_ports += self._get_gw_ports(port_set)
-
         self._add_acl_rule(local_acl, ports=all_ports)
+        return local_acl
 
-    def _generate_port_target_acls(self, portset_acls):
-        port_set_mirrors = {}
-        for target in self._port_targets.values():
-            port_no = target['port']
-            port_set = target['port_set']
-            target_mac = target['mac']
-            mirror_port = self.mirror_port(port_no)
-            port_set_mirrors.setdefault(port_set, []).append((target_mac, mirror_port))
-            self._add_acl_rule(portset_acls[port_set], dl_dst=target_mac,
-                               ports=[mirror_port], allow=1)
+    def _make_portset_acl(self, port_set, targets):
+        portset_acl = []
+        local_net_dst = self.config.get('ext_ofip')
+        if local_net_dst:
+            self._add_acl_rule(portset_acl, ports=[self.switch_port()],
+                               ipv4_dst=local_net_dst, dl_type=self.IPV4_DL_TYPE)
+        for target in targets:
+            mirror_port = self.mirror_port(target['port'])
+            self._add_acl_rule(portset_acl, dl_dst=target['mac'], ports=[mirror_port], allow=1)
             LOGGER.debug("mirror %s to %s for %s set %s",
-                         target_mac, mirror_port, port_no, port_set)
-        return port_set_mirrors
-
-    def _generate_mirror_acls(self, port_set_mirrors, incoming_acl, portset_acls):
-        for port_set in port_set_mirrors:
-            mirror_tuples = port_set_mirrors[port_set]
-            mirror_ports = [tuple[1] for tuple in mirror_tuples]
-            vlan = self._port_set_vlan(port_set)
-            LOGGER.debug("mirroring vlan %s to %s", vlan, mirror_ports)
-            for src_mac, src_mirror in mirror_tuples:
-                self._add_acl_rule(incoming_acl, dl_src=src_mac, dl_dst=self.BROADCAST_MAC,
-                                   vlan_vid=self._NO_VLAN, ports=copy.copy(mirror_ports))
-                for dst_mac, dst_mirror in mirror_tuples:
-                    if dst_mac != src_mac:
-                        self._add_acl_rule(incoming_acl, dl_src=src_mac, dl_dst=dst_mac,
-                                           vlan_vid=self._NO_VLAN, ports=[src_mirror, dst_mirror])
-                self._add_acl_rule(incoming_acl, dl_src=src_mac,
-                                   vlan_vid=self._NO_VLAN, ports=[src_mirror])
-
-            bcast_mirror_ports = mirror_ports + [self._SWITCH_LOCAL_PORT]
-            self._add_acl_rule(portset_acls[port_set], dl_dst=self.BROADCAST_MAC,
+                         target['mac'], mirror_port, target['port'], port_set)
+        if targets:
+            bcast_mirror_ports = [self.mirror_port(target['port']) for target in targets]
+            bcast_mirror_ports.append(self.switch_port())
+            self._add_acl_rule(portset_acl, dl_dst=self.BROADCAST_MAC,
                                ports=bcast_mirror_ports, allow=1)
+        self._add_acl_rule(portset_acl, allow=1)
+        return portset_acl
+
+    def _make_incoming_rules(self, port_set, targets):
+        incoming_rules = []
+        mirror_tuples = [(target['mac'], self.mirror_port(target['port'])) for target in targets]
+        mirror_ports = [mirror_tuple[1] for mirror_tuple in mirror_tuples]
+        if mirror_ports:
+            LOGGER.debug("mirroring vlan %s to %s", self._port_set_vlan(port_set), mirror_ports)
+        if self._mirror_mode == 'group':
+            # One rule per device: every device in the set sees all of the set's traffic.
+            for src_mac, _ in mirror_tuples:
+                self._add_acl_rule(incoming_rules, dl_src=src_mac, vlan_vid=self._NO_VLAN,
+                                   ports=copy.copy(mirror_ports))
+            return incoming_rules
+        for src_mac, src_mirror in mirror_tuples:
+            self._add_acl_rule(incoming_rules, dl_src=src_mac, dl_dst=self.BROADCAST_MAC,
+                               vlan_vid=self._NO_VLAN, ports=copy.copy(mirror_ports))
+            for dst_mac, dst_mirror in mirror_tuples:
+                if dst_mac != src_mac:
+                    self._add_acl_rule(incoming_rules, dl_src=src_mac, dl_dst=dst_mac,
+                                       vlan_vid=self._NO_VLAN, ports=[src_mirror, dst_mirror])
+            self._add_acl_rule(incoming_rules, dl_src=src_mac,
+                               vlan_vid=self._NO_VLAN, ports=[src_mirror])
+        return incoming_rules
 
     def _generate_main_acls(self):
-        incoming_acl = []
-        portset_acls = {}
-        secondary_acl = []
-        local_acl = []
-        acls = {}
-
-        for port_set in range(1, self.sec_port):
-            portset_acls[port_set] = []
-
-        self._generate_switch_local_acls(portset_acls, local_acl)
-
-        port_set_mirrors = self._generate_port_target_acls(portset_acls)
-
-        self._generate_mirror_acls(port_set_mirrors, incoming_acl, portset_acls)
+        for port_set in self._dirty_port_sets:
+            targets = list(self._set_targets.get(port_set, {}).values())
+            self._portset_acls[port_set] = self._make_portset_acl(port_set, targets)
+            self._incoming_rules[port_set] = self._make_incoming_rules(port_set, targets)
+        self._dirty_port_sets.clear()
 
+        acls = {}
+        incoming_acl = []
+        for port_set in sorted(self._incoming_rules):
+            incoming_acl.extend(self._incoming_rules[port_set])
         self._add_acl_rule(incoming_acl, allow=1)
         acls[self.INCOMING_ACL_FORMAT % self.pri_name] = incoming_acl
 
+        secondary_acl = []
         self._add_acl_rule(secondary_acl, allow=1)
         acls[self.INCOMING_ACL_FORMAT % self.sec_name] = secondary_acl
 
-        for port_set in range(1, self.sec_port):
-            self._add_acl_rule(portset_acls[port_set], allow=1)
-            acls[self.PORTSET_ACL_FORMAT % (self.pri_name, port_set)] = portset_acls[port_set]
+        for port_set in self.port_sets.port_sets():
+            acls[self.PORTSET_ACL_FORMAT % (self.pri_name, port_set)] = \
+                self._portset_acls[port_set]
 
-        acls[self.LOCAL_ACL_FORMAT % (self.pri_name)] = local_acl
+        acls[self.LOCAL_ACL_FORMAT % (self.pri_name)] = self._make_local_acl()
 
         pri_acls = {}
         pri_acls["acls"] = acls
@@ -354,10 +467,20 @@ class FaucetTopology:
         self._write_acl_file(filename, pri_acls)
 
     def _write_acl_file(self, filename, pri_acls):
+        # Unchanged files are left alone, so faucet doesn't see a config change.
+        contents = yaml.safe_dump(pri_acls)
+        file_hash = hashlib.sha256(contents.encode()).hexdigest()
+        if self._file_hashes.get(filename) == file_hash:
+            LOGGER.debug('Skipping unchanged acl file %s', filename)
+            return
         directory = os.path.dirname(filename)
         os.makedirs(directory, exist_ok=True)
-        with open(filename, "w") as output_stream:
-            yaml.safe_dump(pri_acls, stream=output_stream)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, "w") as output_stream:
+            output_stream.write(contents)
+        os.replace(tmp_filename, filename)
+        self._file_hashes[filename] = file_hash
+        self._acls_changed = True
 
     def _maybe_apply(self, target, keyword, origin, source=None):
         source_keyword = source if source else keyword
@@ -404,8 +527,15 @@ class FaucetTopology:
         acl.insert(0, self._make_acl_rule(**kwargs))
 
     def _generate_port_acls(self):
-        for port in range(1, self.sec_port):
-            self._generate_port_acl(port)
+        for port in sorted(self._dirty_ports):
+            # Track which templates each port uses, so a template change only dirties those.
+            self._template_usage = set()
+            try:
+                self._generate_port_acl(port)
+            finally:
+                self._port_templates[port] = self._template_usage
+                self._template_usage = None
+        self._dirty_ports.clear()
 
     def _generate_port_acl(self, port):
         target_mac = None
@@ -435,10 +565,7 @@ class FaucetTopology:
         acls[acl_name] = rules
         port_acl = {}
         port_acl['acls'] = acls
-        directory = os.path.dirname(filename)
-        os.makedirs(directory, exist_ok=True)
-        with open(filename, "w") as output_stream:
-            yaml.safe_dump(port_acl, stream=output_stream)
+        self._write_acl_file(filename, port_acl)
 
     def _get_device_type(self, target_mac):
         device_macs = self._device_specs['macAddrs']
@@ -467,14 +594,9 @@ class FaucetTopology:
 
     def device_group_size(self, group_name):
         """Return the size of the device group"""
-        if not self._device_specs:
+        if not self._spec_index:
             return 1
-        mac_map = self._device_specs['macAddrs']
-        count = 0
-        for target_mac in mac_map:
-            if mac_map[target_mac].get('group') == group_name:
-                count += 1
-        return count if count else 1
+        return len(self._spec_index.group_members(group_name)) or 1
 
     def _make_default_allow_rule(self):
         actions = {'allow': 1}
@@ -518,22 +640,45 @@ class FaucetTopology:
             acl = {'rule': subrule}
             self._append_augmented_rule(rules, acl)
 
+    def _file_mtime(self, filename):
+        try:
+            return os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh_acl_templates(self):
+        # Checked once per generation pass, so template lookups themselves do no file I/O.
+        for filename, template in list(self._acl_templates.items()):
+            if self._file_mtime(filename) != template.mtime:
+                LOGGER.info('Reloading changed acl template %s', filename)
+                del self._acl_templates[filename]
+                self._dirty_ports.update(port for port, templates in self._port_templates.items()
+                                         if filename in templates)
+
     def _get_acl_template(self, device_type):
         filename = self.TEMPLATE_FILE_FORMAT % device_type
         if not self._device_specs:
             return None
-        return self._load_file(filename)
+        if self._template_usage is not None:
+            self._template_usage.add(filename)
+        if filename not in self._acl_templates:
+            mtime = self._file_mtime(filename)
+            template_acl = self._load_file(filename)
+            self._acl_templates[filename] = _AclTemplate(template_acl, device_type, mtime)
+        template = self._acl_templates[filename]
+        return None if template.empty else template
 
     def _append_acl_template(self, rules, device_type, target_mac=None):
-        template_acl = self._get_acl_template(device_type)
-        if not template_acl:
+        template = self._get_acl_template(device_type)
+        if not template:
             return False
         template_key = self.FROM_ACL_KEY_FORMAT % device_type
-        for acl in template_acl['acls'][template_key]:
-            new_rule = acl['rule']
-            self._resolve_template_field(new_rule, 'dl_src', target_mac=target_mac)
-            target = self._resolve_template_field(new_rule, 'nw_dst')
-            targets = self._resolve_targets(target, target_mac, new_rule)
+        assert template.from_rules is not None, 'Missing %s in acl template' % template_key
+        for acl, mac_src, target in template.from_rules:
+            if mac_src:
+                # Cached rules are shared, so copy before filling in the device mac.
+                acl = dict(acl, rule=dict(acl['rule'], dl_src=target_mac))
+            targets = self._resolve_targets(target, target_mac, acl['rule'])
             self._append_augmented_rule(rules, acl, targets)
         return True
 
@@ -541,47 +686,33 @@ class FaucetTopology:
         if not target or not target.startswith(self.CTL_PREFIX):
             return None
         controller = target[len(self.CTL_PREFIX):]
-        bridge = self._device_specs['macAddrs'][src_mac]
-        if 'controllers' not in bridge:
-            return None
-        if controller not in bridge['controllers']:
-            return None
-        middle = bridge['controllers'][controller]['controlees']
-        if controller not in middle:
+        target_macs = self._spec_index.controlees(src_mac, controller)
+        if target_macs is None:
             return None
-        target_macs = middle[controller]['mac_addrs']
         target_ports = []
         for target_mac in target_macs:
-            if self._allow_target_mac(target_mac, src_rule, controller):
-                LOGGER.debug('allow_target %s', target_mac)
-                for port_target in self._port_targets.values():
-                    if port_target['mac'] == target_mac:
-                        LOGGER.debug('allow_target %s on %s', target_mac, port_target['port'])
-                        target_ports.append(port_target)
+            self._mac_dependents.setdefault(target_mac, set()).add(src_mac)
+            if target_mac in self._mac_ports and \
+                    self._allow_target_mac(target_mac, src_rule, controller):
+                port_target = self._port_targets[self._mac_ports[target_mac]]
+                LOGGER.debug('allow_target %s on %s', target_mac, port_target['port'])
+                target_ports.append(port_target)
         return target_ports
 
     def _allow_target_mac(self, target_mac, src_rule, controller):
         device_type = self._get_device_type(target_mac)
-        template_acl = self._get_acl_template(device_type)
-        if not template_acl:
+        template = self._get_acl_template(device_type)
+        if not template:
             return False
-        device_macs = self._device_specs['macAddrs']
-        if target_mac not in device_macs:
+        if target_mac not in self._device_specs['macAddrs']:
             return False
-        device_info = device_macs[target_mac]
-        device_type = device_info['type'] if 'type' in device_info else 'default'
-        template_key = self.TO_ACL_KEY_FORMAT % device_type
-        for acl in template_acl['acls'][template_key]:
-            target_rule = acl['rule']
+        for target_rule in template.to_rules.get(controller, []):
             if self._rule_match(src_rule, target_rule, controller):
                 return True
         return False
 
     def _rule_match(self, src_rule, dst_rule, controller):
         LOGGER.debug('Checking rule match for controller %s', controller)
-        dst_ctl = self.CTL_PREFIX + controller
-        if dst_rule.get('nw_src') != dst_ctl:
-            return False
         match = self._conditional_match(src_rule, dst_rule, 'udp_src')
         match = match and self._conditional_match(src_rule, dst_rule, 'udp_dst')
         match = match and self._conditional_match(src_rule, dst_rule, 'tcp_src')
@@ -594,15 +725,3 @@ class FaucetTopology:
         if src and dst:
             return src == dst
         return True
-
-    def _resolve_template_field(self, rule, field, target_mac=None):
-        if field not in rule:
-            return None
-        placeholder = rule[field]
-        if placeholder.startswith(self.MAC_PREFIX):
-            rule[field] = target_mac
-        elif placeholder.startswith(self.DNS_PREFIX):
-            del rule[field]
-        elif placeholder.startswith(self.CTL_PREFIX):
-            del rule[field]
-        return placeholder
@@ -8,7 +8,8 @@ cd $BASEDIR
 
 $BASEDIR/venv/bin/coverage erase
 
-PYTHONPATH=$BASEDIR/daq $BASEDIR/venv/bin/coverage run \
+PYTHONPATH=$BASEDIR/daq:$BASEDIR/faucet:$BASEDIR/forch:$BASEDIR/mininet \
+    $BASEDIR/venv/bin/coverage run \
     --source $BASEDIR/daq \
     -m unittest discover \
     -s $TESTDIR/unit/ \
@@ -0,0 +1,133 @@
+"""Unit tests for the worker coordinator"""
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from daq.coordinator import Coordinator, CoordinatorClient, _LineChannel
+
+
+class TestCoordinator(unittest.TestCase):
+    """Test class for Coordinator with local workers"""
+
+    _WAIT_SEC = 5
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._sock_path = os.path.join(self._tmpdir, 'coordinator.sock')
+        self._coordinator = Coordinator({
+            'coordinator_sock': self._sock_path,
+            'coordinator_ports': '1-4, 3:1-2',
+            'coordinator_result_log': os.path.join(self._tmpdir, 'result.log'),
+            'coordinator_status': os.path.join(self._tmpdir, 'status.json')
+        })
+        self._coordinator.start()
+        self._clients = []
+
+    def tearDown(self):
+        for client in self._clients:
+            client.disconnect()
+        self._coordinator.stop()
+        shutil.rmtree(self._tmpdir)
+
+    def _worker(self, name, capacity=0):
+        client = CoordinatorClient({
+            'coordinator_sock': self._sock_path,
+            'worker_name': name,
+            'worker_capacity': capacity
+        })
+        client.connect()
+        self._clients.append(client)
+        return client
+
+    def _result_lines(self):
+        with open(os.path.join(self._tmpdir, 'result.log')) as result_log:
+            return result_log.readlines()
+
+    def _service_until(self, workers, check):
+        deadline = time.time() + self._WAIT_SEC
+        while not check():
+            self.assertLess(time.time(), deadline, 'condition not reached')
+            self._coordinator.service(0.01)
+            for worker in workers:
+                worker.receive()
+
+    def test_assignment(self):
+        """Test that ports are spread over workers, respecting capacity"""
+        workers = [self._worker('a'), self._worker('b'), self._worker('c', capacity=1)]
+        self._service_until(workers, lambda: all(worker.ports for worker in workers))
+        self._service_until(workers, lambda: len(workers[2].ports) == 1)
+        self.assertEqual(sorted(len(worker.ports) for worker in workers[:2]), [2, 3])
+        owned = [port for worker in workers for port in worker.ports]
+        self.assertEqual(sorted(owned), [(2, 1), (2, 2), (2, 3), (2, 4), (3, 1), (3, 2)])
+        self.assertTrue(workers[2].owns_port(*workers[2].ports.copy().pop()))
+        self.assertFalse(workers[2].owns_port(4, 1))
+        self.assertEqual(self._coordinator.get_status()['unassigned'], [])
+
+    def test_worker_death(self):
+        """Test that a dead worker's ports are reassigned, but active ports stay put"""
+        first = self._worker('a')
+        self._service_until([first], lambda: len(first.ports) == 6)
+        first.send_heartbeat([(2, 1), (2, 2), (2, 3), (2, 4), (3, 1)])
+        second = self._worker('b')
+        self._service_until([first, second], lambda: second.ports)
+        self.assertEqual(second.ports, {(3, 2)})
+        second.disconnect()
+        self._service_until([first], lambda: 'b' not in self._coordinator.get_assignments())
+        self._service_until([first], lambda: len(first.ports) == 6)
+
+    def test_results(self):
+        """Test that results from all workers are aggregated"""
+        workers = [self._worker('a'), self._worker('b')]
+        self._service_until(workers, lambda: all(worker.ports for worker in workers))
+        workers[0].send_result(2, 1, None)
+        workers[1].send_result(3, 2, 'exception')
+        self._service_until(workers, lambda: len(self._result_lines()) == 2)
+        self.assertEqual(self._result_lines(), ['a 2:01: None\n', 'b 3:02: exception\n'])
+
+    def test_malformed_messages(self):
+        """Test that bad worker messages are dropped without killing the coordinator"""
+        worker = self._worker('a')
+        self._service_until([worker], lambda: worker.ports)
+        worker.sock.sendall(b'{"type": "result", "port": \n[1, 2]\n')
+        worker.sock.sendall(b'{"type": "heartbeat", "active": [{}]}\n')
+        worker.sock.sendall(b'{"type": "heartbeat", "active": [3]}\n')
+        worker.sock.sendall(b'{"type": "result", "port": 3, "result": "bare port"}\n')
+        worker.send_result(2, 'one', 'bad port')
+        worker.send_result(2, 3, 'good')
+        self._service_until([worker], lambda: self._result_lines())
+        self.assertEqual(self._result_lines(), ['a 2:03: good\n'])
+        self.assertEqual(list(self._coordinator.get_assignments()), ['a'])
+
+
+class TestLineChannel(unittest.TestCase):
+    """Test class for the newline-delimited message channel"""
+
+    def setUp(self):
+        local, remote = socket.socketpair()
+        self._local = _LineChannel(local)
+        self._remote = _LineChannel(remote)
+
+    def tearDown(self):
+        self._local.close()
+        self._remote.close()
+
+    def test_backed_up_send(self):
+        """Test that a send the socket can't take is buffered, not truncated"""
+        payload = 'x' * 4096
+        for index in range(64):
+            self.assertTrue(self._local.send({'index': index, 'payload': payload}))
+        self.assertTrue(self._local.sending)
+        received = []
+        while self._local.sending or len(received) < 64:
+            self.assertTrue(self._local.flush())
+            received.extend(self._remote.receive())
+        self.assertEqual([message['index'] for message in received], list(range(64)))
+        self.assertTrue(all(message['payload'] == payload for message in received))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Unit tests for the faucet event benchmark harness"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from daq.event_bench import EventBenchmark, mixed
+
+
+class TestEventBenchmark(unittest.TestCase):
+    """Test class for EventBenchmark"""
+
+    def test_learn_storm(self):
+        """Test that every synthetic learn is dispatched and timed"""
+        results = EventBenchmark({'scenario': 'learn_storm', 'count': 2000}).run()
+        self.assertEqual(results['events_sent'], 2000)
+        self.assertEqual(results['event_counts'], {'PORT_LEARN': 2000})
+        self.assertIsNotNone(results['latency_p99_ms'])
+        self.assertTrue(results['passed'])
+
+    def test_port_flaps_debounced(self):
+        """Test that debounced flaps collapse to one change per port"""
+        config = {'scenario': 'port_flaps', 'count': 40, 'ports': 4,
+                  'port_debounce_sec': 0.05, 'event_batch': True}
+        results = EventBenchmark(config).run()
+        self.assertEqual(results['events_sent'], 40)
+        self.assertEqual(results['event_counts'], {'PORT_STATE': 4})
+
+    def test_batch_coalesced(self):
+        """Test that batch mode only dispatches the events that survive coalescing"""
+        config = {'scenario': 'learn_storm', 'count': 2000, 'ports': 4, 'event_batch': True}
+        results = EventBenchmark(config).run()
+        self.assertEqual(results['events_sent'], 2000)
+        # At most one learn per port in each batch, and batches hold many events.
+        self.assertLessEqual(results['event_counts']['PORT_LEARN'], 400)
+        config['scenario'] = 'mixed'
+        results = EventBenchmark(config).run()
+        # Port states queue up behind the learns in a batch, so supersede most of them.
+        self.assertLessEqual(results['event_counts']['PORT_STATE'], 200)
+        self.assertLessEqual(results['event_counts'].get('PORT_LEARN', 0), 400)
+
+    def test_mixed_stream(self):
+        """Test that the mixed scenario interleaves one flap per ten events"""
+        events = list(mixed(30, 4, 2))
+        self.assertEqual([event.get('PORT_CHANGE', {}).get('port_no') for event in events[::10]],
+                         [1, 2, 3])
+        self.assertEqual(sum('L2_LEARN' in event for event in events), 27)
+        self.assertEqual(len(list(mixed(30, 4, 2))), 30)
+
+    def test_replay_limits(self):
+        """Test replay of a recorded stream and failing on a rate limit"""
+        events = [{'dp_id': 1, 'CONFIG_CHANGE': {'restart_type': 'warm'}},
+                  {'dp_id': 1, 'L2_EXPIRE': {'port_no': 1}}]
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as event_file:
+            event_file.write('\n'.join(json.dumps(event) for event in events) + '\n')
+        try:
+            results = EventBenchmark({'replay': event_file.name, 'min_rate': 1e12}).run()
+        finally:
+            os.remove(event_file.name)
+        self.assertEqual(results['event_counts'], {'CONFIG_CHANGE': 1, 'OTHER': 1})
+        self.assertFalse(results['passed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
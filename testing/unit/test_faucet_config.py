@@ -0,0 +1,96 @@
+"""Unit tests for writing faucet configs"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+from daq.faucet_config import FaucetConfigWriter
+
+
+def _topology(vlan, description='device'):
+    return {'dps': {'pri': {'interfaces': {1: {'native_vlan': vlan,
+                                               'description': description}}}}}
+
+
+class TestFaucetConfigWriter(unittest.TestCase):
+    """Test class for FaucetConfigWriter"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._tmpdir, 'faucet.yaml')
+        self._rendered = []
+        self._render_error = None
+        self._writer = FaucetConfigWriter(self._filename, self._render)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _render(self, network_topology, filename):
+        """Render a config that, like faucet's, leaves out interface descriptions"""
+        self._rendered.append(filename)
+        if self._render_error:
+            with open(filename, 'w') as config_file:
+                config_file.write('partial')
+            raise self._render_error
+        interfaces = network_topology['dps']['pri']['interfaces']
+        config = {port: interface['native_vlan'] for port, interface in interfaces.items()}
+        with open(filename, 'w') as config_file:
+            yaml.safe_dump(config, config_file)
+
+    def _write(self, network_topology):
+        with mock.patch('os.replace', wraps=os.replace) as replace:
+            changed = self._writer.write(network_topology)
+        self.assertEqual(os.listdir(self._tmpdir), ['faucet.yaml'])
+        return changed, [call[0] for call in replace.call_args_list]
+
+    def _read(self):
+        with open(self._filename) as config_file:
+            return yaml.safe_load(config_file)
+
+    def test_write(self):
+        """Test that changed configs are rendered to a temp file and moved into place"""
+        tmp_file = self._filename + '.tmp'
+        self.assertEqual(self._write(_topology(1001)), (True, [(tmp_file, self._filename)]))
+        self.assertEqual(self._read(), {1: 1001})
+        self.assertEqual(self._write(_topology(1002)), (True, [(tmp_file, self._filename)]))
+        self.assertEqual(self._read(), {1: 1002})
+        self.assertEqual(self._rendered, [tmp_file, tmp_file])
+
+    def test_unchanged_topology(self):
+        """Test that an unchanged topology isn't rendered again"""
+        self._write(_topology(1001))
+        self.assertEqual(self._write(_topology(1001)), (False, []))
+        self.assertEqual(len(self._rendered), 1)
+
+    def test_unchanged_config(self):
+        """Test that a topology change with no config change leaves the file alone"""
+        self._write(_topology(1001))
+        stat = os.stat(self._filename)
+        self.assertEqual(self._write(_topology(1001, 'renamed')), (False, []))
+        self.assertEqual(len(self._rendered), 2)
+        self.assertEqual(os.stat(self._filename).st_ino, stat.st_ino)
+        self.assertEqual(os.stat(self._filename).st_mtime_ns, stat.st_mtime_ns)
+        self.assertEqual(self._write(_topology(1002, 'renamed')),
+                         (True, [(self._filename + '.tmp', self._filename)]))
+
+    def test_render_failure(self):
+        """Test that a failed render leaves the old config, and is retried for the same topology"""
+        self._write(_topology(1001))
+        self._render_error = ValueError('bad topology')
+        with self.assertRaises(ValueError):
+            self._writer.write(_topology(1002))
+        self.assertEqual(self._read(), {1: 1001})
+        self.assertEqual(os.listdir(self._tmpdir), ['faucet.yaml'])
+        self._render_error = None
+        self.assertEqual(self._write(_topology(1002)),
+                         (True, [(self._filename + '.tmp', self._filename)]))
+        self.assertEqual(self._read(), {1: 1002})
+        self.assertEqual(len(self._rendered), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
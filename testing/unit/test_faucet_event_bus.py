@@ -0,0 +1,214 @@
+"""Unit tests for faucet event bus"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from daq.faucet_event_bus import EventType, FaucetEventBus, Subscription, coalesce_port_events
+from daq.faucet_event_client import FaucetEvent, FaucetEventClient
+
+
+class TestFaucetEventBus(unittest.TestCase):
+    """Test class for FaucetEventBus"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        sock_path = os.path.join(self._tmpdir, 'faucet_event.sock')
+        self._relay_path = os.path.join(self._tmpdir, 'relay.sock')
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(sock_path)
+        self._server.listen(1)
+        os.environ['FAUCET_EVENT_SOCK'] = sock_path
+        self.bus = FaucetEventBus({'port_debounce_sec': 0, 'event_relay_sock': self._relay_path,
+                                   'event_relay_buffer': 4096})
+        self.bus.connect()
+        self._sender, _ = self._server.accept()
+
+    def tearDown(self):
+        if self.bus.sock:
+            self.bus.disconnect()
+        self._sender.close()
+        self._server.close()
+        shutil.rmtree(self._tmpdir)
+
+    def _send(self, *events):
+        self._sender.sendall(b''.join(json.dumps(event).encode() + b'\n' for event in events))
+
+    def _learn(self, dpid, port):
+        return {'dp_id': dpid, 'L2_LEARN': {'port_no': port, 'eth_src': 'm%d' % port}}
+
+    def test_filtered_fanout(self):
+        """Test that each subscriber gets the events matching its filter"""
+        everything = self.bus.subscribe('all')
+        learns = self.bus.subscribe('learns', dpids=[2], kinds=[EventType.PORT_LEARN])
+        self._send(self._learn(1, 1), self._learn(2, 2),
+                   {'dp_id': 2, 'CONFIG_CHANGE': {'restart_type': 'cold'}})
+        self.assertTrue(everything.has_event())
+        self.assertEqual([(event.dpid, event.kind) for event in everything.pop_events()],
+                         [(1, EventType.PORT_LEARN), (2, EventType.PORT_LEARN),
+                          (2, EventType.CONFIG_CHANGE)])
+        self.assertEqual([event.port for event in learns.pop_events()], [2])
+
+    def test_backpressure(self):
+        """Test that a full pausing subscriber holds up the bus, and dropping ones drop"""
+        slow = self.bus.subscribe('slow', max_queue=2)
+        lossy = self.bus.subscribe('lossy', max_queue=1, overflow=Subscription.OVERFLOW_DROP)
+        self._send(*[self._learn(1, port) for port in range(1, 6)])
+        self.assertTrue(slow.has_event())
+        self.assertEqual([event.port for event in slow.pop_events()], [1, 2])
+        self.assertEqual([event.port for event in lossy.pop_events()], [2])
+        self.assertTrue(slow.has_event())
+        self.assertEqual([event.port for event in slow.pop_events()], [3, 4])
+        self.assertEqual(slow.next_event().port, 5)
+        self.assertIsNone(slow.next_event())
+        self.assertEqual((slow.dropped, lossy.dropped), (0, 3))
+        self.assertEqual([event.port for event in lossy.pop_events()], [5])
+
+    def test_relay(self):
+        """Test that relayed events can be consumed by a regular event client"""
+        client = FaucetEventClient({'port_debounce_sec': 0})
+        client.connect(self._relay_path)
+        try:
+            self.bus.service_relay()
+            self._send(self._learn(3, 4),
+                       {'dp_id': 3, 'PORT_CHANGE': {'port_no': 4, 'status': True, 'reason': 'ADD'}})
+            runner = self.bus.subscribe('runner')
+            while len(runner.pop_events()) < 2 and runner.has_event():
+                pass
+            event = client.next_event(blocking=True)
+            self.assertEqual(client.as_port_learn(event), (3, 4, 'm4'))
+            event = client.next_event(blocking=True)
+            self.assertEqual(client.as_port_state(event), (3, 4, True))
+        finally:
+            client.disconnect()
+
+    def test_relay_source(self):
+        """Test that another bus can take its events from the relay instead of faucet"""
+        worker = FaucetEventBus({'port_debounce_sec': 0, 'event_relay_source': self._relay_path})
+        worker.connect()
+        try:
+            learns = worker.subscribe('learns', kinds=[EventType.PORT_LEARN])
+            self.bus.service_relay()
+            self._send(self._learn(3, 4), {'dp_id': 3, 'CONFIG_CHANGE': {}}, self._learn(3, 5))
+            events = []
+            deadline = time.time() + 5
+            while len(events) < 2:
+                self.assertLess(time.time(), deadline, 'relayed events not received')
+                self.bus.pump()
+                worker.pump()
+                events.extend(learns.pop_events())
+            self.assertEqual([(event.dpid, event.port) for event in events], [(3, 4), (3, 5)])
+        finally:
+            worker.disconnect()
+
+    def _relay_client(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self._relay_path)
+        conn.settimeout(5)
+        self.bus.service_relay()
+        return conn
+
+    def _read_lines(self, conn, count, pending=b''):
+        data = b''
+        while data.count(b'\n') < count:
+            if pending:
+                try:
+                    pending = pending[self._sender.send(pending):]
+                except BlockingIOError:
+                    pass
+            self.bus.pump()
+            data += conn.recv(64 * 1024)
+        return data.splitlines()
+
+    def test_relay_raw(self):
+        """Test that relayed events are passed on unchanged, including ones the bus drops"""
+        self._sender.sendall(b'{"dp_id": 1, "L2_LEA')
+        runner = self.bus.subscribe('runner')
+        self.bus.pump()
+        conn = self._relay_client()
+        try:
+            events = [
+                {'dp_id': 1, 'PORT_CHANGE': {'port_no': 2, 'status': True, 'reason': 'ADD'}},
+                {'dp_id': 1, 'PORTS_STATUS': {'1': True}},
+                {'dp_id': 1, 'STACK_TOPO_CHANGE': {'stack_root': 'sw1'}, 'event_id': 7}
+            ]
+            self._sender.sendall(b'RN": {}}\n')
+            self._send(*events)
+            lines = self._read_lines(conn, len(events))
+            self.assertEqual([json.loads(line) for line in lines], events)
+            self.assertEqual(sorted(event.kind.name for event in runner.pop_events()),
+                             ['OTHER', 'PORT_STATE', 'PORT_STATE'])
+        finally:
+            conn.close()
+
+    def test_relay_backpressure(self):
+        """Test that a backed up relay client holds up the bus rather than losing events"""
+        conn = self._relay_client()
+        try:
+            runner = self.bus.subscribe('runner')
+            count = 20000
+            self._sender.setblocking(False)
+            pending = b''.join(json.dumps(self._learn(1, port)).encode() + b'\n'
+                               for port in range(1, count + 1))
+            for _ in range(100):
+                try:
+                    pending = pending[self._sender.send(pending):]
+                except BlockingIOError:
+                    pass
+                self.bus.pump()
+            self.assertLess(len(runner.pop_events()), count)
+            lines = self._read_lines(conn, count, pending)
+            ports = [json.loads(line)['L2_LEARN']['port_no'] for line in lines]
+            self.assertEqual(ports, list(range(1, count + 1)))
+        finally:
+            conn.close()
+
+class TestCoalescePortEvents(unittest.TestCase):
+    """Test class for coalescing a batch of port events"""
+
+    @staticmethod
+    def _state(dpid, port, active):
+        return FaucetEvent(EventType.PORT_STATE, dpid, port, active=active)
+
+    @staticmethod
+    def _learn(dpid, port, mac):
+        return FaucetEvent(EventType.PORT_LEARN, dpid, port, mac=mac)
+
+    @staticmethod
+    def _summary(port_events):
+        return [(key, event.active if event.kind == EventType.PORT_STATE else event.mac)
+                for key, event in port_events.items()]
+
+    def test_port_order(self):
+        """Test that ports come out in first-seen order, with each port's final state"""
+        events = [self._state(1, 3, True), self._state(1, 1, True), self._state(2, 3, False),
+                  self._state(1, 3, False), self._state(1, 1, False), self._state(1, 3, True)]
+        port_states, port_learns, others = coalesce_port_events(events)
+        self.assertEqual(self._summary(port_states),
+                         [((1, 3), True), ((1, 1), False), ((2, 3), False)])
+        self.assertIs(port_states[(1, 3)], events[5])
+        self.assertEqual((port_learns, others), ({}, []))
+
+    def test_mixed_kinds(self):
+        """Test that learns before a port's last state change are dropped, keeping the first
+        learn after it, and other events pass through in order"""
+        config = FaucetEvent(EventType.CONFIG_CHANGE, 1, restart_type='warm')
+        expire = FaucetEvent(EventType.OTHER, 1)
+        events = [
+            self._learn(1, 1, 'mac1'), self._learn(1, 2, 'mac2'),
+            self._state(1, 1, False), config, self._state(1, 1, True),
+            self._learn(1, 1, 'mac3'), self._learn(1, 1, 'mac4'), expire,
+            self._state(None, 2, False), self._learn(1, None, 'mac5'), self._learn(1, 2, 'mac6')
+        ]
+        port_states, port_learns, others = coalesce_port_events(events)
+        self.assertEqual(self._summary(port_states), [((1, 1), True)])
+        self.assertEqual(self._summary(port_learns), [((1, 2), 'mac2'), ((1, 1), 'mac3')])
+        self.assertEqual(others, [config, expire, events[9]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""Unit tests for faucet event client"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from daq.faucet_event_client import EventType, FaucetEventClient, decode_event
+
+
+class TestFaucetEventClient(unittest.TestCase):
+    """Test class for FaucetEventClient"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        sock_path = os.path.join(self._tmpdir, 'faucet_event.sock')
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(sock_path)
+        self._server.listen(1)
+        os.environ['FAUCET_EVENT_SOCK'] = sock_path
+        self._connect(port_debounce_sec=0)
+
+    def _connect(self, **config):
+        self.client = FaucetEventClient(config)
+        self.client.connect()
+        self._sender, _ = self._server.accept()
+
+    def tearDown(self):
+        self.client.disconnect()
+        self._sender.close()
+        self._server.close()
+        shutil.rmtree(self._tmpdir)
+
+    def _send(self, *events, partial=b''):
+        data = b''.join(json.dumps(event).encode() + b'\n' for event in events)
+        self._sender.sendall(data + partial)
+
+    def _drain(self):
+        events = []
+        event = self.client.next_event()
+        while event:
+            events.append(event)
+            event = self.client.next_event()
+        return events
+
+    def test_learn_burst(self):
+        """Test that a large burst of events is returned in order"""
+        count = 5000
+        events = [{'dp_id': 2, 'L2_LEARN': {'port_no': index % 20 + 1, 'eth_src': 'z'}}
+                  for index in range(count)]
+        sender = threading.Thread(target=self._send, args=events)
+        sender.start()
+        ports = []
+        while len(ports) < count:
+            event = self.client.next_event(blocking=True)
+            ports.append(self.client.as_port_learn(event)[1])
+        sender.join()
+        self.assertEqual(ports, [index % 20 + 1 for index in range(count)])
+        self.assertIsNone(self.client.next_event())
+
+    def test_partial_line(self):
+        """Test that a partial line is held until it is complete"""
+        learn = json.dumps({'dp_id': 2, 'L2_LEARN': {'port_no': 3, 'eth_src': 'x'}}).encode()
+        self._send(partial=learn[:10])
+        self.assertIsNone(self.client.next_event())
+        self._sender.sendall(learn[10:] + b'\n')
+        event = self.client.next_event(blocking=True)
+        self.assertEqual(self.client.as_port_learn(event), (2, 3, 'x'))
+
+    def test_ports_status_expansion(self):
+        """Test that port status is expanded into debounced port changes"""
+        self._send({'dp_id': 2, 'PORTS_STATUS': {'1': True, '2': False}},
+                   {'dp_id': 2, 'L2_LEARN': {'port_no': 1, 'eth_src': 'y'}})
+        self.client.has_event(blocking=True)
+        events = self._drain()
+        # Debounced changes are queued behind lines that were already received.
+        self.assertEqual(self.client.as_port_learn(events[0]), (2, 1, 'y'))
+        self.assertEqual([self.client.as_port_state(event) for event in events[1:]],
+                         [(2, 2, False), (2, 1, True)])
+
+    def test_port_change_dedup(self):
+        """Test that repeated port states are filtered out"""
+        change = {'dp_id': 2, 'PORT_CHANGE': {'port_no': 4, 'status': True, 'reason': 'ADD'}}
+        self._send(change, change)
+        self.client.has_event(blocking=True)
+        events = self._drain()
+        self.assertEqual([self.client.as_port_state(event) for event in events], [(2, 4, True)])
+
+    def test_port_debounce(self):
+        """Test that a port down is delayed, and cancelled by a port up"""
+        self.client.disconnect()
+        self._sender.close()
+        self._connect(port_debounce_sec=0.1)
+        down = {'dp_id': 2, 'PORT_CHANGE': {'port_no': 5, 'status': False, 'reason': 'MODIFY'}}
+        up = {'dp_id': 2, 'PORT_CHANGE': {'port_no': 6, 'status': True, 'reason': 'MODIFY'}}
+        self._send(down, up)
+        event = self.client.next_event(blocking=True)
+        self.assertEqual(self.client.as_port_state(event), (2, 6, True))
+        self.assertGreater(self.client.next_timeout(), 0)
+        event = self.client.next_event(blocking=True)
+        self.assertEqual(self.client.as_port_state(event), (2, 5, False))
+        self.assertIsNone(self.client.next_timeout())
+
+        flap = dict(down, PORT_CHANGE=dict(down['PORT_CHANGE'], status=True))
+        self._send(down, flap)
+        event = self.client.next_event(blocking=True)
+        self.assertEqual(self.client.as_port_state(event), (2, 5, True))
+        self.assertIsNone(self.client.next_timeout())
+
+    def test_decode_event(self):
+        """Test decoding of raw event lines into typed records"""
+        event = decode_event(b'{"dp_id": 3, "L2_LEARN": {"port_no": "7", "eth_src": "m"}}')
+        self.assertEqual((event.kind, event.dpid, event.port, event.mac),
+                         (EventType.PORT_LEARN, 3, 7, 'm'))
+        event = decode_event(b'{"dp_id": 3, "PORT_CHANGE": '
+                             b'{"port_no": 1, "status": true, "reason": "DELETE"}}')
+        self.assertEqual((event.kind, event.port, event.active),
+                         (EventType.PORT_STATE, 1, False))
+        event = decode_event(b'{"dp_id": 3, "L2_EXPIRE": {}}')
+        self.assertEqual((event.kind, event.dpid), (EventType.OTHER, 3))
+
+    def test_bad_line(self):
+        """Test that an unparsable line is skipped"""
+        self._sender.sendall(b'not json\n')
+        self._send({'dp_id': 1, 'CONFIG_CHANGE': {'restart_type': 'cold'}})
+        self.client.has_event(blocking=True)
+        events = self._drain()
+        self.assertEqual([self.client.as_config_change(event) for event in events],
+                         [(1, 'cold')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Unit tests for forchestrator"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from daq.forchestrator import Forchestrator
+
+
+class TestForchestrator(unittest.TestCase):
+    """Test class for Forchestrator"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        sock_path = os.path.join(self._tmpdir, 'faucet_event.sock')
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(sock_path)
+        self._server.listen(1)
+        os.environ['FAUCET_EVENT_SOCK'] = sock_path
+        self.forch = Forchestrator({'port_debounce_sec': 0})
+        self.forch.initialize()
+        self._sender, _ = self._server.accept()
+
+    def tearDown(self):
+        self._server.close()
+        shutil.rmtree(self._tmpdir)
+
+    def _run_events(self, *events):
+        self._sender.sendall(b''.join(json.dumps(event).encode() + b'\n' for event in events))
+        self._sender.close()
+        self.forch.main_loop()
+
+    def test_overview_state(self):
+        """Test that the overview reflects port state and learned addresses"""
+        etag = self.forch.get_overview_etag({})
+        self._run_events(
+            {'dp_id': 2, 'PORT_CHANGE': {'port_no': 1, 'status': True, 'reason': 'ADD'}},
+            {'dp_id': 2, 'PORT_CHANGE': {'port_no': 2, 'status': True, 'reason': 'ADD'}},
+            {'dp_id': 2, 'L2_LEARN': {'port_no': 1, 'eth_src': 'a'}},
+            {'dp_id': 2, 'L2_LEARN': {'port_no': 2, 'eth_src': 'b'}},
+            {'dp_id': 2, 'L2_LEARN': {'port_no': 1, 'eth_src': 'b'}},
+            {'dp_id': 2, 'PORT_CHANGE': {'port_no': 2, 'status': False, 'reason': 'MODIFY'}},
+            {'dp_id': 2, 'CONFIG_CHANGE': {'restart_type': 'warm'}})
+        self.assertNotEqual(self.forch.get_overview_etag({}), etag)
+        overview = json.loads(self.forch.get_overview({}))
+        self.assertEqual(overview['learned_macs'], 2)
+        self.assertEqual(overview['dps']['2'], {
+            'restart_type': 'warm',
+            'ports': {
+                '1': {'active': True, 'macs': ['a', 'b']},
+                '2': {'active': False, 'macs': []}
+            }
+        })
+        etag = self.forch.get_overview_etag({})
+        self.assertIs(self.forch.get_overview({}), self.forch.get_overview({}))
+        self.assertEqual(self.forch.get_overview_etag({}), etag)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Unit tests for the connected host module scheduling"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from daq import host
+from daq.image_manager import ImageManager
+
+_TESTS = ['pass', 'ping', 'hold']
+
+
+class TestWarmModules(unittest.TestCase):
+    """Test class for warming module containers ahead of their turn"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmpdir = tempfile.mkdtemp()
+        os.chdir(self._tmpdir)
+        patches = [
+            mock.patch.object(host, 'ReportGenerator'),
+            mock.patch.object(host, 'tcpdump_helper'),
+            mock.patch.object(host.docker_test, 'DockerTest', side_effect=self._docker_test)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self._prepare_error = None
+        self._docker_tests = []
+        self._test_ports = iter(range(10, 20))
+        runner = mock.Mock()
+        runner.get_base_config.return_value = {'modules': {}}
+        runner.get_run_info.return_value = {}
+        runner.image_manager.get_status.return_value = ImageManager.READY
+        runner.module_scheduler.is_pending.return_value = False
+        runner.module_scheduler.request.side_effect = self._scheduler_request
+        gateway = mock.Mock()
+        gateway.allocate_test_port.side_effect = lambda: next(self._test_ports)
+        self.gateway = gateway
+        target = {'port': 1, 'mac': '9a:02:57:1e:8f:01', 'fake': '10.20.0.2'}
+        config = {'test_list': _TESTS, 'warm_modules': 2, 'site_path': 'site'}
+        self.host = host.ConnectedHost(runner, gateway, target, config)
+        self.host.state = host._STATE.NEXT  # pylint: disable=protected-access
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmpdir)
+
+    def _docker_test(self, runner, target_port, tmpdir, test_name):
+        test_host = mock.Mock(test_name=test_name, host_name='%s%02d' % (test_name, target_port),
+                              port=None)
+
+        def prepare(port, params):
+            if self._prepare_error:
+                raise self._prepare_error
+            test_host.port = port
+        test_host.prepare.side_effect = prepare
+        self._docker_tests.append(test_host)
+        return test_host
+
+    def _scheduler_request(self, target_port, test_name, callback, hints):
+        callback(test_name)
+
+    def _warmed(self):
+        # pylint: disable=protected-access
+        return {name: test_host.port for name, test_host in self.host._warm_tests.items()}
+
+    def test_warm_start(self):
+        """Test that a warmed container is started in place of a new one"""
+        self.host._warm_modules()  # pylint: disable=protected-access
+        self.assertEqual(self._warmed(), {'pass': 10, 'ping': 11})
+        warm_pass = self._docker_tests[0]
+        self.host._run_next_test()  # pylint: disable=protected-access
+        self.assertEqual(self.host.remaining_tests, ['ping', 'hold'])
+        warm_pass.start.assert_called_once()
+        self.assertEqual(warm_pass.start.call_args[0][0], 10)
+        # Only the next test beyond the warm window gets a new container.
+        self.assertEqual(self._warmed(), {'ping': 11, 'hold': 12})
+        self.assertEqual(len(self._docker_tests), 3)
+
+    def test_discard(self):
+        """Test that warmed containers are discarded and their test ports released"""
+        self.host._warm_modules()  # pylint: disable=protected-access
+        self.host._discard_warm_modules()  # pylint: disable=protected-access
+        self.assertEqual(self._warmed(), {})
+        for test_host in self._docker_tests:
+            test_host.discard.assert_called_once_with()
+        released = [call[0][0] for call in self.gateway.release_test_port.call_args_list]
+        self.assertEqual(released, [10, 11])
+
+    def test_prepare_failure(self):
+        """Test that a failed warm isn't retried on every pass"""
+        self._prepare_error = Exception('no container')
+        self.host._warm_modules()  # pylint: disable=protected-access
+        self.assertEqual(self._warmed(), {})
+        self.gateway.release_test_port.assert_called_once_with(10)
+        self._prepare_error = None
+        self.host._warm_modules()  # pylint: disable=protected-access
+        self.host._warm_modules()  # pylint: disable=protected-access
+        self.assertEqual(self._warmed(), {'ping': 11})
+        self.assertEqual([test_host.test_name for test_host in self._docker_tests],
+                         ['pass', 'ping'])
+
+
+if __name__ == '__main__':
+    unittest.main()
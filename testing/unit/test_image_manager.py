@@ -0,0 +1,157 @@
+"""Unit tests for the docker image manager"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from daq.image_manager import ImageManager
+
+
+class _FakeDockerImages(ImageManager):
+    """Image manager with a canned docker command line"""
+
+    _LIST_RETRY_SEC = 0
+
+    def __init__(self, config, local, remote, list_failures=0):
+        super().__init__(config)
+        self.local = local
+        self.remote = remote
+        self.commands = []
+        self.list_failures = list_failures
+
+    def _get_version(self):
+        return '1.2.0'
+
+    def _docker(self, *args):
+        self.commands.append(args[:2])
+        if args[0] == 'images':
+            if self.list_failures:
+                self.list_failures -= 1
+                raise subprocess.CalledProcessError(1, args)
+            return ''.join('%s latest %s\n' % item for item in self.local.items())
+        if args[0] == 'pull':
+            image = args[1].split(':')[0]
+            if image not in self.remote:
+                raise subprocess.CalledProcessError(1, args)
+            self.local[image] = self.remote[image]
+            return ''
+        if args[0] == 'tag':
+            return ''
+        image = args[-1]
+        if image not in self.local:
+            raise subprocess.CalledProcessError(1, args)
+        return self.local[image] + '\n'
+
+
+class TestImageManager(unittest.TestCase):
+    """Test class for ImageManager"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._index = os.path.join(self._tmpdir, 'inst', 'image_index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_check_only(self):
+        """Test that local images are ready and others missing without pulls"""
+        images = _FakeDockerImages({'image_index': self._index},
+                                   {'daqf/test_pass': 'sha256:aa'}, {'daqf/test_ping': 'sha:bb'})
+        self.assertIsNone(images.get_status('daqf/test_pass'))
+        images.start(['daqf/test_pass', 'daqf/test_ping'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertEqual(images.get_status('daqf/test_ping'), ImageManager.MISSING)
+        self.assertNotIn(('pull', 'daqf/test_ping:1.2.0'), images.commands)
+        with open(self._index) as index_file:
+            self.assertEqual(json.load(index_file)['daqf/test_pass']['id'], 'sha256:aa')
+
+    def test_pull(self):
+        """Test that missing images are pulled and indexed, and unknown ones stay missing"""
+        config = {'image_index': self._index, 'image_pull': True}
+        images = _FakeDockerImages(config, {}, {'daqf/test_ping': 'sha256:bb'})
+        images.start(['daqf/test_ping', 'daqf/test_nope'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_ping'), ImageManager.READY)
+        self.assertEqual(images.get_status('daqf/test_nope'), ImageManager.MISSING)
+        reloaded = ImageManager({'image_index': self._index})
+        self.assertEqual(reloaded.get_digest('daqf/test_ping'), 'sha256:bb')
+        self.assertIsNone(reloaded.get_digest('daqf/test_nope'))
+
+    def test_index_reuse(self):
+        """Test that recently checked images are ready from the index, without docker"""
+        local = {'daqf/test_pass': 'sha256:aa', 'daqf/test_ping': 'sha256:bb'}
+        images = _FakeDockerImages({'image_index': self._index}, dict(local), {})
+        images.start(['daqf/test_pass'])
+        self.assertTrue(images.wait(5))
+        images = _FakeDockerImages({'image_index': self._index}, dict(local), {})
+        images.start(['daqf/test_pass', 'daqf/test_ping'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertEqual(images.get_status('daqf/test_ping'), ImageManager.READY)
+        self.assertEqual(images.commands, [('images', '--no-trunc')])
+        images = _FakeDockerImages({'image_index': self._index}, {}, {})
+        images.start(['daqf/test_pass', 'daqf/test_ping'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.commands, [])
+        images = _FakeDockerImages({'image_index': self._index, 'image_index_ttl_sec': 0},
+                                   {}, {})
+        images.start(['daqf/test_pass'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.MISSING)
+
+    def test_list_failure(self):
+        """Test that a failing image listing is retried, then falls back to single checks"""
+        local = {'daqf/test_pass': 'sha256:aa'}
+        images = _FakeDockerImages({'image_index': self._index}, dict(local), {},
+                                   list_failures=1)
+        images.start(['daqf/test_pass'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertEqual(images.commands, [('images', '--no-trunc')] * 2)
+        images = _FakeDockerImages({'image_index': self._index, 'image_index_ttl_sec': 0},
+                                   dict(local), {}, list_failures=3)
+        images.start(['daqf/test_pass', 'daqf/test_ping'])
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertEqual(images.get_status('daqf/test_ping'), ImageManager.MISSING)
+
+    def test_notify(self):
+        """Test that status changes are signalled from the resolving thread"""
+        notified = []
+        images = _FakeDockerImages({'image_index': self._index}, {}, {})
+        images.start(['daqf/test_pass'], notify=lambda: notified.append(
+            (images.get_status('daqf/test_pass'), threading.current_thread())))
+        self.assertTrue(images.wait(5))
+        self.assertTrue(notified)
+        self.assertEqual(notified[-1][0], ImageManager.MISSING)
+        self.assertTrue(all(thread is not threading.current_thread() for _, thread in notified))
+
+    def test_invalidate(self):
+        """Test that an indexed image which fails to run is checked again, and pulled"""
+        local = {'daqf/test_pass': 'sha256:aa'}
+        images = _FakeDockerImages({'image_index': self._index}, dict(local), {})
+        images.start(['daqf/test_pass'])
+        self.assertTrue(images.wait(5))
+        config = {'image_index': self._index, 'image_pull': True}
+        images = _FakeDockerImages(config, {}, {'daqf/test_pass': 'sha256:bb'})
+        images.start(['daqf/test_pass', 'daqf/test_ping'])
+        images.invalidate('daqf/test_ping')
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertNotIn(('pull', 'daqf/test_pass:1.2.0'), images.commands)
+        images.invalidate('daqf/test_pass')
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.PENDING)
+        self.assertTrue(images.wait(5))
+        self.assertEqual(images.get_status('daqf/test_pass'), ImageManager.READY)
+        self.assertIn(('pull', 'daqf/test_pass:1.2.0'), images.commands)
+        reloaded = ImageManager({'image_index': self._index})
+        self.assertEqual(reloaded.get_digest('daqf/test_pass'), 'sha256:bb')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Unit tests for port set allocation and layout"""
+
+import unittest
+
+from daq.port_sets import PortSetAllocator
+
+
+class TestPortSetAllocator(unittest.TestCase):
+    """Test class for PortSetAllocator"""
+
+    def test_default_layout(self):
+        """Test that the default layout matches the fixed small-switch numbering"""
+        port_sets = PortSetAllocator({}, 6, 6)
+        self.assertEqual(port_sets.set_port_list(2), [20, 21, 22, 23, 24, 25])
+        self.assertEqual(port_sets.mirror_port(3), 1003)
+        self.assertEqual(port_sets.switch_port(), 1000)
+        self.assertEqual((port_sets.vlan(), port_sets.vlan(4)), (1000, 1004))
+        self.assertEqual(port_sets.test_ip(5), '192.168.84.5')
+
+    def test_large_layout(self):
+        """Test that a layout with hundreds of sets keeps mirrors clear of gateway ports"""
+        port_sets = PortSetAllocator({'test_ip_base': '10.100.0.0'}, 300, 6)
+        self.assertEqual(port_sets.set_base_port(300), 3000)
+        self.assertEqual(port_sets.switch_port(), 4000)
+        self.assertEqual(port_sets.test_ip(300), '10.100.1.44')
+        with self.assertRaises(AssertionError):
+            PortSetAllocator({'mirror_port_base': 1000}, 300, 6)
+        with self.assertRaises(AssertionError):
+            PortSetAllocator({'port_set_spacing': 4}, 6, 6)
+
+    def test_allocation(self):
+        """Test preferred and free-list allocation, and release"""
+        port_sets = PortSetAllocator({}, 4, 6)
+        self.assertEqual(port_sets.allocate(preferred=3), 3)
+        self.assertEqual(port_sets.allocate(preferred=3), 1)
+        self.assertEqual(port_sets.allocate(preferred=9), 2)
+        self.assertEqual(port_sets.allocate(), 4)
+        self.assertIsNone(port_sets.allocate())
+        port_sets.release(3)
+        port_sets.release(1)
+        self.assertEqual(port_sets.allocate(), 1)
+        self.assertEqual(port_sets.allocate(preferred=2), 3)
+        with self.assertRaises(AssertionError):
+            port_sets.release(5)
+
+    def test_preferred_reuse(self):
+        """Test that repeated preferred allocation doesn't grow the free-list"""
+        port_sets = PortSetAllocator({}, 4, 6)
+        for _ in range(100):
+            self.assertEqual(port_sets.allocate(preferred=2), 2)
+            port_sets.release(2)
+        self.assertLessEqual(len(port_sets._free), 4)  # pylint: disable=protected-access
+        self.assertEqual([port_sets.allocate() for _ in range(5)], [1, 2, 3, 4, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Unit tests for device report rendering"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from daq import report
+
+
+class _FakeHtml:
+    """Stand-in for weasyprint.HTML that records its input instead of laying out a pdf"""
+
+    rendered = []
+    fail = False
+
+    def __init__(self, string, base_url):
+        self._html = string
+        assert base_url == '.'
+
+    def write_pdf(self, target, stylesheets):
+        """Write the html as the 'pdf', or fail part way through"""
+        assert stylesheets
+        with open(target, 'w') as pdf_file:
+            pdf_file.write(self._html)
+            if self.fail:
+                raise IOError('disk full')
+        self.rendered.append(target)
+
+
+class TestRenderPdf(unittest.TestCase):
+    """Test class for render_pdf and the pdf report modes"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._md_path = os.path.join(self._tmpdir, 'report.md')
+        with open(self._md_path, 'w') as md_file:
+            md_file.write('# Report\n\n|a|b|\n|-|-|\n|1|2|\n')
+        _FakeHtml.rendered = []
+        _FakeHtml.fail = False
+        patches = [mock.patch.object(report.weasyprint, 'HTML', _FakeHtml),
+                   mock.patch.object(report.weasyprint, 'CSS', mock.Mock())]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        report._get_renderers.cache_clear()  # pylint: disable=protected-access
+        self.addCleanup(report._get_renderers.cache_clear)  # pylint: disable=protected-access
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_render(self):
+        """Test that the pdf is written via a temp file, and reuses the renderers"""
+        alt_path = os.path.join(self._tmpdir, 'alt.pdf')
+        pdf_path = report.render_pdf(self._md_path, alt_pdf_path=alt_path)
+        self.assertEqual(pdf_path, os.path.join(self._tmpdir, 'report.pdf'))
+        self.assertEqual(_FakeHtml.rendered, [pdf_path + '.tmp'])
+        with open(pdf_path) as pdf_file:
+            html = pdf_file.read()
+        self.assertIn('<h1>Report</h1>', html)
+        self.assertIn('<table>', html)
+        with open(alt_path) as alt_file:
+            self.assertEqual(alt_file.read(), html)
+        self.assertEqual(sorted(os.listdir(self._tmpdir)), ['alt.pdf', 'report.md', 'report.pdf'])
+        report.render_pdf(self._md_path)
+        self.assertEqual(report.weasyprint.CSS.call_count, 1)
+
+    def test_render_failure(self):
+        """Test that a failed render leaves any previous pdf in place, and no temp file"""
+        pdf_path = os.path.join(self._tmpdir, 'report.pdf')
+        with open(pdf_path, 'w') as pdf_file:
+            pdf_file.write('previous')
+        _FakeHtml.fail = True
+        with self.assertRaises(IOError):
+            report.render_pdf(self._md_path)
+        with open(pdf_path) as pdf_file:
+            self.assertEqual(pdf_file.read(), 'previous')
+        self.assertEqual(sorted(os.listdir(self._tmpdir)), ['report.md', 'report.pdf'])
+
+    def test_pdf_mode(self):
+        """Test the report_pdf modes"""
+        self.assertEqual(report.get_pdf_mode({}), 'on')
+        for mode in report.PDF_MODES:
+            self.assertEqual(report.get_pdf_mode({'report_pdf': mode}), mode)
+        with self.assertRaises(AssertionError):
+            report.get_pdf_mode({'report_pdf': 'sometimes'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+"""Unit tests for the DAQ runner event handling"""
+
+import collections
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from daq import runner
+from daq.coordinator import Coordinator, CoordinatorClient
+from daq.faucet_event_client import FaucetEvent
+# The runner's own EventType, as it compares against the enum it imported itself.
+from daq.runner import EventType
+
+_DPID = 2
+
+
+class _FakeQueue:
+    """Subscription stand-in handing out a fixed list of events"""
+
+    def __init__(self, events=()):
+        self.events = collections.deque(events)
+
+    def next_event(self):
+        """Return the next event, or None when there are none left"""
+        return self.events.popleft() if self.events else None
+
+
+class RunnerTestBase(unittest.TestCase):
+    """Base class for tests of a DAQRunner with its network, gcp and hosts mocked out"""
+
+    _CONFIG = {}
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmpdir = tempfile.mkdtemp()
+        os.chdir(self._tmpdir)
+        os.makedirs('inst')
+        environ = {'DAQ_VERSION': 'test', 'DAQ_LSB_RELEASE': 'test', 'DAQ_SYS_UNAME': 'test'}
+        patches = [
+            mock.patch.dict(os.environ, environ),
+            mock.patch.object(runner.gcp, 'GcpManager',
+                              **{'return_value.get_logging_client.return_value': None}),
+            mock.patch.object(runner.network, 'TestNetwork'),
+            mock.patch.object(runner.DAQRunner, '_load_base_config', return_value={})
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        config = dict({'no_test': True, 'event_batch': True}, **self._CONFIG)
+        self.runner = runner.DAQRunner(config)
+        self.network = self.runner.network
+        self.network.sec_dpid = str(_DPID)
+        self.network.is_system_port.return_value = False
+        self.network.is_device_port.side_effect = lambda dpid, port: dpid == _DPID
+        self.network.get_reload_window.return_value = 0
+        self.network.settle_remaining.return_value = 0
+        self.network.config_applied.return_value = None
+        self.runner._target_set_trigger = mock.Mock()  # pylint: disable=protected-access
+
+    def tearDown(self):
+        self.runner.cleanup()
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmpdir)
+
+    @staticmethod
+    def _state(port, active, dpid=_DPID):
+        return FaucetEvent(EventType.PORT_STATE, dpid, port, active=active)
+
+    @staticmethod
+    def _learn(port, mac, dpid=_DPID):
+        return FaucetEvent(EventType.PORT_LEARN, dpid, port, mac=mac)
+
+    def _deliver(self, *events):
+        # pylint: disable=protected-access
+        self.runner.faucet_events = mock.Mock()
+        self.runner.faucet_events.next_timeout.return_value = None
+        self.runner._faucet_queue = _FakeQueue(events)
+        self.runner._system_settled = True
+        self.runner._handle_faucet_events()
+
+    def _triggered(self):
+        trigger = self.runner._target_set_trigger  # pylint: disable=protected-access
+        ports = [call[0][0] for call in trigger.call_args_list]
+        trigger.reset_mock()
+        return ports
+
+    def _active_ports(self):
+        return dict(self.runner._active_ports)  # pylint: disable=protected-access
+
+
+class TestFaucetBatch(RunnerTestBase):
+    """Test class for batched faucet event handling"""
+
+    def test_coalesced_batch(self):
+        """Test that a batch applies each port's final state and learn in one network batch"""
+        config_change = FaucetEvent(EventType.CONFIG_CHANGE, _DPID, restart_type='warm')
+        self._deliver(self._state(1, True), self._learn(1, 'mac1'), self._state(2, True),
+                      self._state(1, False), config_change, self._state(1, True),
+                      self._learn(1, 'mac2'), self._learn(1, 'mac3'), self._learn(3, 'mac4', 9))
+        self.assertEqual(self._active_ports(), {1: 'mac2', 2: True})
+        self.assertEqual(self._triggered(), [1])
+        self.assertEqual(self.network.batch_updates.call_count, 1)
+        self.assertEqual(self.network.config_applied.call_count, 1)
+
+    def test_final_state(self):
+        """Test that a port which ends a batch down is deactivated, despite earlier learns"""
+        self._deliver(self._state(1, True), self._learn(1, 'mac1'))
+        self.assertEqual(self._active_ports(), {1: 'mac1'})
+        self._deliver(self._learn(1, 'mac2'), self._state(1, False), self._state(2, True),
+                      self._state(2, False))
+        self.assertEqual(self._active_ports(), {})
+        self.network.direct_port_traffic.assert_called_once_with('mac1', 1, None)
+
+
+class TestPingTests(RunnerTestBase):
+    """Test class for the concurrent connectivity pings"""
+
+    @staticmethod
+    def _host(name, exit_code):
+        host = mock.Mock(IP=mock.Mock(return_value='10.0.0.1'))
+        host.name = name
+        host.popen.side_effect = lambda *cmd: subprocess.Popen(['sh', '-c', 'exit %d' % exit_code])
+        return host
+
+    def test_results_callback(self):
+        """Test that ping results are delivered to the callback rather than returned"""
+        callback = mock.Mock()
+        good, bad = self._host('good', 0), self._host('bad', 1)
+        self.runner.ping_tests([(good, bad, None), (bad, '10.0.0.2', '10.0.0.3')], callback)
+        callback.assert_not_called()
+        self.assertTrue(self.runner.stream_monitor.drain(timeout_sec=10))
+        callback.assert_called_once_with(result=[True, False], exception=None)
+        self.assertEqual(bad.popen.call_args[0][-3:], ('-I', '10.0.0.3', '10.0.0.2'))
+
+
+class TestImageNotify(RunnerTestBase):
+    """Test class for image resolution waking the main loop"""
+
+    def test_images_changed(self):
+        """Test that an image change on another thread re-dispatches modules on the loop"""
+        images_changed = self.runner._images_changed  # pylint: disable=protected-access
+        with mock.patch.object(self.runner.module_scheduler, 'dispatch') as dispatch:
+            thread = threading.Thread(target=images_changed)
+            thread.start()
+            thread.join()
+            dispatch.assert_not_called()
+            self.runner.stream_monitor.event_loop()
+            dispatch.assert_called_once_with()
+
+
+class TestCoordinatedPorts(RunnerTestBase):
+    """Test class for a runner only testing the switch ports a coordinator assigns it"""
+
+    _CONFIG = {'coordinator_sock': 'coordinator.sock', 'worker_name': 'a'}
+    _WAIT_SEC = 5
+
+    def setUp(self):
+        self._coordinator = Coordinator({
+            'coordinator_sock': 'coordinator.sock',
+            'coordinator_ports': '1-3, 9:1',
+            'coordinator_result_log': 'result.log',
+            'coordinator_status': 'status.json'
+        })
+        super().setUp()
+        self._coordinator.start()
+        self.runner._coordinator.connect()  # pylint: disable=protected-access
+
+    def tearDown(self):
+        self.runner._coordinator.disconnect()  # pylint: disable=protected-access
+        self._coordinator.stop()
+        super().tearDown()
+
+    def _service_until(self, check, others=()):
+        deadline = time.time() + self._WAIT_SEC
+        while not check():
+            self.assertLess(time.time(), deadline, 'condition not reached')
+            self._coordinator.service(0.01)
+            self.runner._handle_coordinator()  # pylint: disable=protected-access
+            for other in others:
+                other.receive()
+
+    def _owned(self):
+        return self.runner._coordinator.ports  # pylint: disable=protected-access
+
+    def test_assigned_ports(self):
+        """Test that only assigned (dpid, port) pairs are tested, replaying reassigned ports"""
+        # Events before any assignment are held back, and another switch's port 1 is separate.
+        self._deliver(self._state(1, True), self._learn(1, 'mac1'), self._state(3, True))
+        self.assertEqual((self._active_ports(), self._triggered()), ({}, []))
+        self._service_until(lambda: len(self._owned()) == 4)
+        self.assertEqual(self._active_ports(), {1: 'mac1', 3: True})
+        self.assertEqual(self._triggered(), [1])
+        self._deliver(self._state(2, True), self._learn(2, 'mac2'))
+        self.assertEqual(self._triggered(), [2])
+
+        # With port 1 under test, a new worker takes idle ports and gets the events for them.
+        self.runner.port_targets[1] = mock.Mock(state='testing')
+        self.runner._coordinator_heartbeat()  # pylint: disable=protected-access
+        other = CoordinatorClient({'coordinator_sock': 'coordinator.sock', 'worker_name': 'b'})
+        other.connect()
+        self._service_until(lambda: len(self._owned()) == 2, [other])
+        self.assertIn((_DPID, 1), self._owned())
+        self.assertEqual(other.ports, {(_DPID, 3), (9, 1)})
+        self.assertEqual(self._active_ports(), {1: 'mac1', 2: 'mac2'})
+        self._deliver(self._state(3, False), self._state(3, True), self._learn(3, 'mac3'))
+        self.assertEqual((self._active_ports(), self._triggered()), ({1: 'mac1', 2: 'mac2'}, []))
+
+        # Once the other worker goes away, the last seen state of its ports is picked up.
+        other.disconnect()
+        self._service_until(lambda: len(self._owned()) == 4)
+        self.assertEqual(self._active_ports(), {1: 'mac1', 2: 'mac2', 3: 'mac3'})
+        self.assertEqual(self._triggered(), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
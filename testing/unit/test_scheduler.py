@@ -0,0 +1,91 @@
+"""Unit tests for the global module scheduler"""
+
+import unittest
+
+from daq.scheduler import ModuleScheduler
+
+
+class TestModuleScheduler(unittest.TestCase):
+    """Test class for ModuleScheduler"""
+
+    def setUp(self):
+        self.started = []
+
+    def _starter(self, target_port, result=True):
+        def callback(test_name):
+            self.started.append((target_port, test_name))
+            return result
+        return callback
+
+    def test_unlimited(self):
+        """Test that runs start right away without any budgets"""
+        sched = ModuleScheduler({})
+        for port in (1, 2, 3):
+            sched.request(port, 'nmap', self._starter(port))
+        self.assertEqual(self.started, [(1, 'nmap'), (2, 'nmap'), (3, 'nmap')])
+        self.assertFalse(sched.is_pending(1))
+
+    def test_budgets(self):
+        """Test that cpu weights and slots hold back runs until others are released"""
+        sched = ModuleScheduler({'module_cpu_budget': 3, 'module_slots': 2})
+        sched.request(1, 'nmap', self._starter(1), {'cpu': 2})
+        sched.request(2, 'bacext', self._starter(2), {'cpu': 2})
+        sched.request(3, 'ping', self._starter(3))
+        sched.request(4, 'pass', self._starter(4))
+        self.assertEqual(self.started, [(1, 'nmap'), (3, 'ping')])
+        self.assertTrue(sched.is_pending(2))
+        sched.release(3, 'ping')
+        self.assertEqual(self.started[2:], [(4, 'pass')])
+        sched.release(1, 'nmap')
+        self.assertEqual(self.started[3:], [(2, 'bacext')])
+        sched.cancel(2)
+        self.assertFalse(sched.is_pending(2))
+
+    def test_policies(self):
+        """Test fair-share and shortest-job-first ordering, and refused starts"""
+        sched = ModuleScheduler({'module_slots': 2})
+        sched.request(1, 'hold', self._starter(1))
+        sched.request(1, 'nmap', self._starter(1))
+        sched.request(1, 'bacext', self._starter(1))
+        sched.request(2, 'ping', self._starter(2))
+        sched.release(1, 'nmap')
+        self.assertEqual(self.started, [(1, 'hold'), (1, 'nmap'), (2, 'ping')])
+        sched.release(2, 'ping')
+        self.assertEqual(self.started[3:], [(1, 'bacext')])
+
+        self.started = []
+        sched = ModuleScheduler({'module_slots': 1, 'module_schedule': 'sjf'})
+        sched.request(1, 'hold', self._starter(1))
+        sched.request(2, 'nmap', self._starter(2, result=False), {'runtime_sec': 300})
+        sched.request(3, 'ping', self._starter(3), {'runtime_sec': 5})
+        sched.release(1, 'hold')
+        self.assertEqual(self.started, [(1, 'hold'), (3, 'ping')])
+        sched.release(3, 'ping')
+        self.assertEqual(self.started[2:], [(2, 'nmap')])
+        sched.request(4, 'pass', self._starter(4))
+        self.assertEqual(self.started[3:], [(4, 'pass')])
+
+    def test_deferred(self):
+        """Test that a deferred run keeps its place in the queue"""
+        sched = ModuleScheduler({'module_slots': 1})
+        ready = {1: False}
+        def deferring(test_name):
+            self.started.append((1, test_name))
+            return True if ready[1] else ModuleScheduler.DEFER
+        sched.request(2, 'hold', self._starter(2))
+        sched.request(1, 'nmap', deferring)
+        sched.request(3, 'ping', self._starter(3))
+        sched.release(2, 'hold')
+        self.assertEqual(self.started, [(2, 'hold'), (1, 'nmap'), (3, 'ping')])
+        self.assertTrue(sched.is_pending(1))
+        sched.request(4, 'pass', self._starter(4))
+        sched.release(3, 'ping')
+        self.assertEqual(self.started[3:], [(1, 'nmap'), (4, 'pass')])
+        ready[1] = True
+        sched.release(4, 'pass')
+        self.assertEqual(self.started[5:], [(1, 'nmap')])
+        self.assertFalse(sched.is_pending(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Unit tests for the stream monitor event loops"""
+
+import os
+import threading
+import time
+import unittest
+
+from daq.stream_monitor import StreamMonitor, AsyncStreamMonitor
+
+
+class TestStreamMonitor(unittest.TestCase):
+    """Test class for the epoll StreamMonitor"""
+
+    _MONITOR_CLASS = StreamMonitor
+
+    def setUp(self):
+        self.monitor = self._MONITOR_CLASS(timeout_sec=1)
+        self.calls = []
+
+    def tearDown(self):
+        self.monitor.close()
+
+    def _record(self, result=None, exception=None):
+        self.calls.append((result, exception, threading.current_thread()))
+
+    def _run_until(self, check, limit=50):
+        for _ in range(limit):
+            if check():
+                return
+            self.monitor.event_loop()
+        self.fail('condition not reached')
+
+    def test_timer_order(self):
+        """Test that timers fire in deadline order, with ties in scheduling order"""
+        for name, delay in (('c', 0.03), ('a', 0.01), ('b', 0.02), ('b2', 0.02)):
+            self.monitor.schedule(delay, lambda name=name: self.calls.append(name), name=name)
+        self.monitor.run()
+        self.assertEqual(self.calls, ['a', 'b', 'b2', 'c'])
+        self.assertFalse(self.monitor.is_active())
+
+    def test_timer_cancel(self):
+        """Test that a cancelled timer never fires and doesn't keep the loop active"""
+        handle = self.monitor.schedule(0.01, lambda: self.calls.append('cancelled'))
+        self.monitor.schedule(0.02, lambda: self.calls.append('kept'))
+        self.assertTrue(self.monitor.is_active())
+        handle.cancel()
+        self.assertTrue(handle.cancelled())
+        self.monitor.run()
+        self.assertEqual(self.calls, ['kept'])
+        handle.cancel()
+        self.monitor.schedule(60, lambda: None).cancel()
+        self.assertFalse(self.monitor.is_active())
+
+    def test_threadsafe_wakeup(self):
+        """Test that a call from another thread wakes a blocked loop and runs on its thread"""
+        self.monitor.schedule(5, lambda: None)  # Keep the loop waiting.
+        thread = threading.Timer(0.05, self.monitor.call_soon_threadsafe,
+                                 [lambda: self._record('woken')])
+        thread.start()
+        started = time.monotonic()
+        self._run_until(lambda: self.calls)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(self.calls, [('woken', None, threading.current_thread())])
+        thread.join()
+
+    def test_executor_callback(self):
+        """Test that executor results are delivered as callbacks on the loop thread"""
+        workers = []
+        self.monitor.run_in_executor(lambda value: workers.append(threading.current_thread())
+                                     or value * 2, 21, callback=self._record)
+        self.assertTrue(self.monitor.is_active())
+        self._run_until(lambda: self.calls)
+        self.assertEqual(self.calls, [(42, None, threading.current_thread())])
+        self.assertIsNot(workers[0], threading.current_thread())
+        self.assertFalse(self.monitor.is_active())
+
+    def test_drain(self):
+        """Test that drain waits for executor work and runs callbacks on this thread"""
+        gate = threading.Event()
+        self.monitor.run_in_executor(lambda: gate.wait(1) and 'slow', callback=self._record)
+        self.monitor.run_in_executor(lambda: 1 / 0, callback=self._record)
+        threading.Timer(0.05, gate.set).start()
+        self.assertTrue(self.monitor.drain(5))
+        self.assertEqual(sorted(str(call[0]) for call in self.calls), ['None', 'slow'])
+        self.assertIsInstance(self.calls[0][1] or self.calls[1][1], ZeroDivisionError)
+        self.assertTrue(all(call[2] is threading.current_thread() for call in self.calls))
+        self.assertFalse(self.monitor.is_active())
+
+    def test_drain_timeout(self):
+        """Test that drain gives up on work that outlasts the timeout"""
+        gate = threading.Event()
+        self.monitor.run_in_executor(gate.wait, callback=self._record)
+        self.assertFalse(self.monitor.drain(0.05))
+        gate.set()
+        self.assertTrue(self.monitor.drain(5))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_idle_handler(self):
+        """Test that idle work runs when a poll finds nothing, not on passes with activity"""
+        self.monitor.close()
+        self.monitor = self._MONITOR_CLASS(timeout_sec=1,
+                                           idle_handler=lambda: self.calls.append('idle'))
+        read_fd, write_fd = os.pipe()
+        self.monitor.monitor('pipe', read_fd, lambda: self.calls.append(os.read(read_fd, 16)))
+        thread = threading.Timer(0.05, os.write, [write_fd, b'data'])
+        thread.start()
+        passes = []
+        for _ in range(3):
+            self.monitor.event_loop()
+            passes.append(self.calls)
+            self.calls = []
+        thread.join()
+        self.monitor.forget(read_fd)
+        os.close(read_fd)
+        os.close(write_fd)
+        # Idle once up front, then the data wakes the loop, then idle again straight after it.
+        self.assertEqual(passes, [['idle'], [b'data'], ['idle']])
+
+    def test_call_after_close(self):
+        """Test that callbacks queued after close are dropped rather than raising"""
+        gate = threading.Event()
+        self.monitor.run_in_executor(gate.wait, callback=self._record)
+        threading.Timer(0.05, gate.set).start()
+        closed, self.monitor = self.monitor, self._MONITOR_CLASS()
+        closed.close()
+        closed.call_soon_threadsafe(lambda: self._record('late'))
+        self.assertNotIn('late', [call[0] for call in self.calls])
+
+
+class TestAsyncStreamMonitor(TestStreamMonitor):
+    """Test class for the asyncio StreamMonitor"""
+
+    _MONITOR_CLASS = AsyncStreamMonitor
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+"""Unit tests for faucet topology and ACL generation"""
+
+import json
+import os
+import shutil
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import yaml
+
+from daq.topology import FaucetTopology, _DeviceSpecIndex
+
+_MAC_A = '9a:02:57:1e:8f:01'
+_MAC_B = '9a:02:57:1e:8f:02'
+_MAC_C = '9a:02:57:1e:8f:03'
+_MAC_D = '9a:02:57:1e:8f:04'
+
+_DEVICE_SPECS = {
+    'macAddrs': {
+        _MAC_A: {
+            'type': 'bacnet',
+            'group': 'bacnet',
+            'controllers': {
+                'bacnet': {'controlees': {'bacnet': {'mac_addrs': {_MAC_B: {}}}}}
+            }
+        },
+        _MAC_B: {'type': 'bacnet', 'group': 'bacnet'},
+        _MAC_C: {'type': 'plain', 'default_allow': False}
+    }
+}
+
+
+def _template(device_type, from_rules, to_rules=None):
+    return {'acls': {
+        FaucetTopology.FROM_ACL_KEY_FORMAT % device_type: [{'rule': rule} for rule in from_rules],
+        FaucetTopology.TO_ACL_KEY_FORMAT % device_type: [{'rule': rule}
+                                                         for rule in to_rules or []]
+    }}
+
+
+_BACNET_RULE = {'dl_type': '0x0800', 'nw_proto': 17, 'udp_src': 47808, 'udp_dst': 47808}
+
+_TEMPLATES = {
+    'baseline': _template('baseline', [{'dl_type': '0x0806', 'actions': {'allow': 1}}]),
+    'raw': _template('raw', [{'dl_dst': 'ff:ff:ff:ff:ff:ff', 'actions': {'allow': 1}}]),
+    'default': _template('default', [{'actions': {'allow': 1}}]),
+    'plain': _template('plain', [{'dl_type': '0x0800', 'nw_proto': 6, 'tcp_dst': 80,
+                                  'actions': {'allow': 1}}]),
+    'bacnet': _template('bacnet', [
+        dict(_BACNET_RULE, dl_src='@mac:bacnet', nw_dst='@ctrl:bacnet', actions={'allow': 1})
+    ], [
+        dict(_BACNET_RULE, dl_dst='@mac:bacnet', nw_src='@ctrl:bacnet', actions={'allow': 1})
+    ])
+}
+
+
+class TopologyTestBase(unittest.TestCase):
+    """Base class for tests of a small topology with device specs"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmpdir = tempfile.mkdtemp()
+        os.chdir(self._tmpdir)
+        os.makedirs('inst/acl_templates')
+        for device_type, template in _TEMPLATES.items():
+            self._write_template(device_type, template)
+        with open('device_specs.json', 'w') as specs_file:
+            json.dump(_DEVICE_SPECS, specs_file)
+        self.topology = self._make_topology()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmpdir)
+
+    def _make_topology(self, **config):
+        config = dict({'sec_port': '5', 'settle_sec': 0, 'device_specs': 'device_specs.json'},
+                      **config)
+        topology = FaucetTopology(config)
+        topology.initialize(types.SimpleNamespace(name='pri'))
+        return topology
+
+    def _write_template(self, device_type, template):
+        with open(FaucetTopology.TEMPLATE_FILE_FORMAT % device_type, 'w') as template_file:
+            yaml.safe_dump(template, template_file)
+
+    def _target(self, mac, port, port_set):
+        return {'port': port, 'port_set': port_set, 'mac': mac}
+
+    def _update(self, *changes, topology=None):
+        """Apply (mac, port, port_set) attach or (None, port, None) detach changes, and
+        return the acl files that were rewritten"""
+        topology = topology or self.topology
+        for mac, port, port_set in changes:
+            target = self._target(mac, port, port_set) if mac else None
+            topology.direct_port_traffic(mac, port, target)
+        with mock.patch('os.replace', wraps=os.replace) as replace:
+            topology.update_acls()
+        return sorted(os.path.relpath(call[0][1], 'inst') for call in replace.call_args_list)
+
+    def _read_acls(self):
+        acls = {}
+        for root, _, files in os.walk('inst'):
+            for name in files:
+                if name.endswith('.yaml') and 'acl_templates' not in root:
+                    with open(os.path.join(root, name)) as acl_file:
+                        acls[os.path.join(root, name)] = acl_file.read()
+        return acls
+
+    def _port_rules(self, port):
+        with open('inst/' + self._port_file(port)) as acl_file:
+            port_acl = yaml.safe_load(acl_file)['acls'][
+                FaucetTopology.PORT_ACL_NAME_FORMAT % ('sec', port)]
+        return [acl['rule'] for acl in port_acl]
+
+    def _allowed_ports(self, port, target_mac):
+        return [rule['actions']['output']['ports'] for rule in self._port_rules(port)
+                if rule.get('dl_dst') == target_mac]
+
+    @staticmethod
+    def _port_file(port):
+        return FaucetTopology.PORT_ACL_FILE_FORMAT % ('sec', port)
+
+
+class TestDeviceSpecIndex(TopologyTestBase):
+    """Test class for device spec lookups"""
+
+    def test_index(self):
+        """Test group and controller lookups of the spec index"""
+        specs = {'macAddrs': {
+            _MAC_A: {'group': 'ahu', 'controllers': {
+                'bacnet': {'controlees': {'bacnet': {'mac_addrs': {_MAC_B: {}, _MAC_C: {}}}}},
+                'modbus': {'controlees': {'bacnet': {'mac_addrs': {_MAC_D: {}}}}},
+                'empty': {'controlees': {'empty': {'mac_addrs': {}}}}
+            }},
+            _MAC_B: {'group': 'ahu'},
+            _MAC_C: {'group': 'vav'},
+            _MAC_D: {}
+        }}
+        index = _DeviceSpecIndex(specs)
+        self.assertEqual(index.group_members('ahu'), [_MAC_A, _MAC_B])
+        self.assertEqual(index.group_members('vav'), [_MAC_C])
+        self.assertEqual(index.group_members('missing'), [])
+        self.assertEqual(index.controlees(_MAC_A, 'bacnet'), [_MAC_B, _MAC_C])
+        self.assertIsNone(index.controlees(_MAC_A, 'modbus'))
+        self.assertEqual(index.controlees(_MAC_A, 'empty'), [])
+        self.assertIsNone(index.controlees(_MAC_B, 'bacnet'))
+        self.assertIsNone(index.controlees(_MAC_D, 'bacnet'))
+
+    def test_device_groups(self):
+        """Test device group lookups, with and without device specs"""
+        self.assertEqual(self.topology.device_group_for(_MAC_A), 'bacnet')
+        self.assertEqual(self.topology.device_group_for(_MAC_C), '9a02571e8f03')
+        self.assertEqual(self.topology.device_group_for(_MAC_D), '9a02571e8f04')
+        self.assertEqual(self.topology.device_group_size('bacnet'), 2)
+        self.assertEqual(self.topology.device_group_size('9a02571e8f03'), 1)
+        no_specs = FaucetTopology({'sec_port': '5'})
+        self.assertEqual(no_specs.device_group_for(_MAC_A), '9a02571e8f01')
+        self.assertEqual(no_specs.device_group_size('bacnet'), 1)
+
+    def test_mac_ports(self):
+        """Test that controller rules follow a device across detach and reattach"""
+        self._update((_MAC_A, 1, 1), (_MAC_B, 2, 1))
+        self.assertEqual(self._allowed_ports(1, _MAC_B), [[2, 5]])
+        self.assertEqual(self._update((None, 2, None)),
+                         [FaucetTopology.DP_ACL_FILE_FORMAT, self._port_file(1),
+                          self._port_file(2)])
+        self.assertEqual(self._allowed_ports(1, _MAC_B), [])
+        self._update((_MAC_B, 4, 2))
+        self.assertEqual(self._allowed_ports(1, _MAC_B), [[4, 5]])
+
+
+class TestIncrementalAcls(TopologyTestBase):
+    """Test class for incremental ACL regeneration"""
+
+    def test_dependent_ports(self):
+        """Test that a port change only rewrites its own and dependent ACL files"""
+        self._update((_MAC_A, 1, 1), (_MAC_C, 3, 2))
+        self.assertEqual(self._update((_MAC_B, 2, 1)),
+                         [FaucetTopology.DP_ACL_FILE_FORMAT, self._port_file(1),
+                          self._port_file(2)])
+        self.assertEqual(self._allowed_ports(1, _MAC_B), [[2, 5]])
+        self.assertEqual(self._update((None, 3, None)),
+                         [FaucetTopology.DP_ACL_FILE_FORMAT, self._port_file(3)])
+        self.assertEqual(self._update(), [])
+
+    def test_full_regeneration(self):
+        """Test that incremental updates end up the same as generating from scratch"""
+        steps = [
+            [(_MAC_B, 2, 1)],
+            [(_MAC_A, 1, 1), (_MAC_D, 4, 3)],
+            [(_MAC_C, 3, 1)],
+            [(None, 2, None)],
+            [(None, 4, None), (_MAC_B, 4, 2)]
+        ]
+        for changes in steps:
+            self._update(*changes)
+        incremental = self._read_acls()
+        shutil.rmtree('inst/port_acls')
+        os.remove('inst/' + FaucetTopology.DP_ACL_FILE_FORMAT)
+        topology = self._make_topology()
+        self._update((_MAC_A, 1, 1), (_MAC_C, 3, 1), (_MAC_B, 4, 2), topology=topology)
+        self.assertEqual(self._read_acls(), incremental)
+
+
+class TestTemplateReload(TopologyTestBase):
+    """Test class for reloading changed ACL templates"""
+
+    def _change_template(self, device_type, from_rules):
+        filename = FaucetTopology.TEMPLATE_FILE_FORMAT % device_type
+        mtime = os.stat(filename).st_mtime_ns
+        template = None if from_rules is None else _template(device_type, from_rules)
+        self._write_template(device_type, template)
+        # Make sure the change shows even on file systems with coarse timestamps.
+        os.utime(filename, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    def _regenerated(self):
+        """Update acls, returning the ports that were regenerated and the files rewritten"""
+        with mock.patch.object(self.topology, '_generate_port_acl',
+                               wraps=self.topology._generate_port_acl) as generate:
+            written = self._update()
+        return sorted(call[0][0] for call in generate.call_args_list), written
+
+    def test_changed_template(self):
+        """Test that a changed template is reloaded for just the ports that use it"""
+        self._update((_MAC_A, 1, 1), (_MAC_B, 2, 1), (_MAC_C, 3, 2))
+        self._change_template('plain', [{'dl_type': '0x0800', 'nw_proto': 6, 'tcp_dst': 443,
+                                         'actions': {'allow': 1}}])
+        self.assertEqual(self._regenerated(), ([3], [self._port_file(3)]))
+        with open('inst/' + self._port_file(3)) as acl_file:
+            self.assertIn('tcp_dst: 443', acl_file.read())
+        self._change_template('raw', [{'dl_type': '0x0806', 'actions': {'allow': 1}}])
+        self.assertEqual(self._regenerated(), ([4], [self._port_file(4)]))
+        self._change_template('baseline', [{'dl_type': '0x86dd', 'actions': {'allow': 1}}])
+        self.assertEqual(self._regenerated(),
+                         ([1, 2, 3], [self._port_file(port) for port in (1, 2, 3)]))
+        self.assertEqual(self._regenerated(), ([], []))
+
+    def test_empty_template(self):
+        """Test that an empty template is treated like a missing one, until filled in"""
+        self._change_template('raw', None)
+        self._update((_MAC_C, 3, 2))
+        self.assertEqual(self._port_rules(4), [{'actions': {'allow': 1, 'output': {'ports': [5]}}}])
+        self._change_template('raw', [{'dl_type': '0x0806', 'actions': {'allow': 1}}])
+        self.assertEqual(self._regenerated(), ([1, 2, 4], [self._port_file(port)
+                                                           for port in (1, 2, 4)]))
+        self.assertEqual(self._port_rules(4), [{'dl_type': '0x0806',
+                                                'actions': {'allow': 1, 'output': {'ports': [5]}}}])
+        self._change_template('plain', None)
+        self.assertEqual(self._regenerated(), ([3], [self._port_file(3)]))
+        self.assertEqual([rule.get('dl_type') for rule in self._port_rules(3)], ['0x0806', None])
+
+
+class TestMirrorModes(TopologyTestBase):
+    """Test class for the incoming mirror rules of each mirror_mode"""
+
+    def _incoming_rules(self, mirror_mode):
+        topology = self._make_topology(mirror_mode=mirror_mode)
+        self._update((_MAC_A, 1, 1), (_MAC_B, 2, 1), (_MAC_C, 3, 1), (_MAC_D, 4, 2),
+                     topology=topology)
+        with open('inst/' + FaucetTopology.DP_ACL_FILE_FORMAT) as acl_file:
+            acls = yaml.safe_load(acl_file)['acls']
+        incoming = [acl['rule'] for acl in acls[FaucetTopology.INCOMING_ACL_FORMAT % 'pri']]
+        self.assertEqual(incoming.pop(), {'actions': {'allow': 1}})
+        for rule in incoming:
+            self.assertEqual(rule.pop('vlan_vid'), '0x0000/0x1000')
+        return [(rule['dl_src'], rule.get('dl_dst'), rule['actions']['output']['ports'])
+                for rule in incoming]
+
+    def test_pair_mode(self):
+        """Test that pair mode mirrors each pair of devices in a set to just their ports"""
+        bcast = FaucetTopology.BROADCAST_MAC
+        set_mirrors = [1001, 1002, 1003]
+        self.assertEqual(self._incoming_rules('pair'), [
+            (_MAC_A, bcast, set_mirrors),
+            (_MAC_A, _MAC_B, [1001, 1002]),
+            (_MAC_A, _MAC_C, [1001, 1003]),
+            (_MAC_A, None, [1001]),
+            (_MAC_B, bcast, set_mirrors),
+            (_MAC_B, _MAC_A, [1002, 1001]),
+            (_MAC_B, _MAC_C, [1002, 1003]),
+            (_MAC_B, None, [1002]),
+            (_MAC_C, bcast, set_mirrors),
+            (_MAC_C, _MAC_A, [1003, 1001]),
+            (_MAC_C, _MAC_B, [1003, 1002]),
+            (_MAC_C, None, [1003]),
+            (_MAC_D, bcast, [1004]),
+            (_MAC_D, None, [1004])
+        ])
+
+    def test_group_mode(self):
+        """Test that group mode mirrors each device to all the mirror ports of its set"""
+        self.assertEqual(self._incoming_rules('group'), [
+            (_MAC_A, None, [1001, 1002, 1003]),
+            (_MAC_B, None, [1001, 1002, 1003]),
+            (_MAC_C, None, [1001, 1002, 1003]),
+            (_MAC_D, None, [1004])
+        ])
+
+    def test_bad_mode(self):
+        """Test that an unknown mirror_mode is rejected"""
+        with self.assertRaises(AssertionError):
+            self._make_topology(mirror_mode='all')
+
+
+if __name__ == '__main__':
+    unittest.main()